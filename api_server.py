@@ -0,0 +1,371 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Optional
+
+import openai
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+import metrics
+import pdf_renderer
+import pipeline
+from assessment_types import PROFILE_SECTIONS
+from document_processor import DocumentExtractionError, DocumentProcessor
+from document_store import DocumentEvicted, store as document_store
+from profile_generator import ANSWER_PARAMS, PROFILE_PARAMS, ProfileGenerator
+from reference_digests import get_library
+from vector_store import VectorStore
+
+BASE_DIR = Path(__file__).resolve().parent
+TEMPLATE_PATH = BASE_DIR / "template.pptx"
+DOCUMENT_ROLES = ("subject", "context")
+# How often idle cases are looked for; they are released after DOCUMENT_STORE_IDLE_MINUTES without a request
+EVICT_INTERVAL_SECONDS = float(os.getenv("API_EVICT_INTERVAL_SECONDS", "60"))
+PPTX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+
+class Case:
+    """Documents, vector store namespace and generated outputs for one case.
+
+    Document text lives in the shared document store under the case id, so idle
+    cases are released the same way idle app sessions are.
+    """
+
+    def __init__(self):
+        self.case_id = uuid.uuid4().hex
+        # Each case gets its own collection so concurrent cases never see each other's documents
+        self.vector_store = VectorStore(namespace=self.case_id)
+        self.doc_keys = {role: [] for role in DOCUMENT_ROLES}
+        self.metadatas = {role: [] for role in DOCUMENT_ROLES}
+        # Retrieved evidence per profile section, until the documents change
+        self.section_chunks = {}
+        self.profile = None
+        self.answers = []
+        self.deck = None
+        self.created_at = self.updated_at = time.time()
+
+    def docs(self, role):
+        """Text of the case's documents for a role; raises DocumentEvicted if the case was released."""
+        return document_store.get_many(self.doc_keys[role])
+
+    @property
+    def all_metadatas(self):
+        return self.metadatas["subject"] + self.metadatas["context"]
+
+    def summary(self):
+        return {
+            "case_id": self.case_id,
+            "documents": {role: [m.get("file_name") for m in self.metadatas[role]] for role in DOCUMENT_ROLES},
+            "has_profile": self.profile is not None,
+            "answers": len(self.answers),
+            "usage": metrics.usage.totals("case", self.case_id),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class QuestionRequest(BaseModel):
+    question: str
+    stream: bool = False
+
+
+class SectionRequest(BaseModel):
+    guidance: Optional[str] = None
+
+
+class _Upload:
+    """Gives an uploaded file the .name/.getvalue() interface pipeline.extract_uploads expects."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def _forget_case(case_id):
+    app.state.cases.pop(case_id, None)
+    metrics.usage.forget("case", case_id)
+
+
+async def _evict_idle_cases():
+    while True:
+        await asyncio.sleep(EVICT_INTERVAL_SECONDS)
+        await asyncio.to_thread(document_store.evict_idle)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.document_processor = DocumentProcessor()
+    app.state.profile_generator = ProfileGenerator()
+    app.state.cases = {}
+    # Cases evicted from the document store (idle, or over its memory ceiling) are discarded with their collection
+    document_store.on_evict("vector_store", VectorStore.drop_namespace)
+    document_store.on_evict("cases", _forget_case)
+    # Reference manuals and digests are loaded once per worker, not once per case
+    reference_folder = os.getenv("REFERENCE_FOLDER", str(BASE_DIR / pipeline.REFERENCE_FOLDER))
+    app.state.reference_library = await asyncio.to_thread(get_library, app.state.document_processor, reference_folder)
+    sweeper = asyncio.create_task(_evict_idle_cases())
+    yield
+    sweeper.cancel()
+    for case in list(app.state.cases.values()):
+        document_store.release(case.case_id)
+        case.vector_store.drop()
+
+
+app = FastAPI(title="KnowThee.AI API", lifespan=lifespan)
+CASE_PATH = re.compile(r"^/cases/([^/]+)")
+
+
+@app.middleware("http")
+async def _pin_case(request, call_next):
+    """Keep a case from being evicted while a request on it runs (until a streamed reply's headers are sent)."""
+    match = CASE_PATH.match(request.url.path)
+    if match is None:
+        return await call_next(request)
+    with document_store.active(match.group(1)):
+        return await call_next(request)
+
+
+def _get_case(case_id) -> Case:
+    case = app.state.cases.get(case_id)
+    if case is None:
+        raise HTTPException(status_code=404, detail=f"Unknown case {case_id}")
+    document_store.touch(case_id)
+    # Each request runs in its own context, so LLM usage for the rest of it is charged to this case
+    metrics.set_usage_scope(case=case_id)
+    return case
+
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _parse_profile(profile):
+    try:
+        return json.loads(profile)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=502, detail=f"Model returned a profile that is not valid JSON: {e}")
+
+
+async def _case_chunks(case):
+    return await asyncio.to_thread(case.vector_store.get_relevant_chunks)
+
+
+async def _reference_docs(case):
+    try:
+        subject_docs = case.docs("subject")
+    except DocumentEvicted:
+        raise HTTPException(status_code=404, detail=f"Case {case.case_id} was released; create it again")
+    return await asyncio.to_thread(app.state.reference_library.select, subject_docs)
+
+
+def _stream_completion(task, messages, params, on_done):
+    """Stream an LLM completion as server-sent events: delta events, then one done event."""
+    profile_generator = app.state.profile_generator
+
+    async def events():
+        parts = []
+        try:
+            async for delta in profile_generator.astream(task, messages, **params):
+                parts.append(delta)
+                yield _sse("delta", {"text": delta})
+            yield _sse("done", on_done("".join(parts)))
+        except openai.OpenAIError as e:
+            yield _sse("error", {"detail": f"{type(e).__name__}: {e}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/cases", status_code=201)
+async def create_case():
+    case = Case()
+    app.state.cases[case.case_id] = case
+    document_store.touch(case.case_id)
+    return case.summary()
+
+
+@app.get("/cases/{case_id}")
+async def get_case(case_id: str):
+    return _get_case(case_id).summary()
+
+
+@app.delete("/cases/{case_id}", status_code=204)
+async def delete_case(case_id: str):
+    case = _get_case(case_id)
+    _forget_case(case_id)
+    document_store.release(case_id)
+    await asyncio.to_thread(case.vector_store.drop)
+    return Response(status_code=204)
+
+
+@app.post("/cases/{case_id}/documents")
+async def upload_documents(case_id: str, files: List[UploadFile] = File(...), role: str = Form("subject")):
+    case = _get_case(case_id)
+    if role not in DOCUMENT_ROLES:
+        raise HTTPException(status_code=400, detail=f"role must be one of {', '.join(DOCUMENT_ROLES)}")
+    uploads = [_Upload(f.filename, await f.read()) for f in files]
+    try:
+        texts, metadatas, pages = await asyncio.to_thread(
+            pipeline.extract_uploads, app.state.document_processor, uploads)
+    except DocumentExtractionError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    chunks, chunk_metadatas = pipeline.page_chunks(role, texts, metadatas, pages)
+    case.doc_keys[role].extend(document_store.put_many(case_id, texts))
+    case.metadatas[role].extend(metadatas)
+    case.section_chunks = {}
+    # Only the new documents are embedded; earlier uploads stay in the collection
+    await asyncio.to_thread(case.vector_store.add_documents, chunks, chunk_metadatas)
+    case.updated_at = time.time()
+    return case.summary()
+
+
+@app.post("/cases/{case_id}/profile")
+async def generate_profile(case_id: str, stream: bool = False):
+    case = _get_case(case_id)
+    if not case.all_metadatas:
+        raise HTTPException(status_code=400, detail="Upload at least one document before generating a profile")
+    profile_generator = app.state.profile_generator
+    chunks = await _case_chunks(case)
+    reference_docs = await _reference_docs(case)
+
+    if stream:
+        # Oversized packets are digested during prompt assembly, which blocks
+        messages, doc_type_map = await asyncio.to_thread(
+            profile_generator.profile_messages, chunks, case.all_metadatas, reference_docs)
+
+        def on_done(content):
+            case.profile = profile_generator.repair_profile(content, doc_type_map)
+            case.deck = None
+            case.updated_at = time.time()
+            try:
+                return {"profile": json.loads(case.profile)}
+            except json.JSONDecodeError:
+                return {"profile": None, "raw": case.profile}
+
+        return _stream_completion("profile", messages, PROFILE_PARAMS, on_done)
+
+    try:
+        profile = await profile_generator.agenerate_profile(chunks, case.all_metadatas, reference_docs)
+    except openai.OpenAIError as e:
+        raise HTTPException(status_code=502, detail=f"{type(e).__name__}: {e}")
+    case.profile = profile
+    case.deck = None
+    case.updated_at = time.time()
+    return {"profile": _parse_profile(profile)}
+
+
+@app.get("/cases/{case_id}/profile")
+async def get_profile(case_id: str):
+    case = _get_case(case_id)
+    if case.profile is None:
+        raise HTTPException(status_code=404, detail="No profile has been generated for this case")
+    return {"profile": _parse_profile(case.profile)}
+
+
+@app.post("/cases/{case_id}/profile/sections/{section_name}")
+async def regenerate_section(case_id: str, section_name: str, request: SectionRequest = None):
+    case = _get_case(case_id)
+    if case.profile is None:
+        raise HTTPException(status_code=409, detail="Generate a profile before regenerating a section")
+    if section_name not in PROFILE_SECTIONS:
+        raise HTTPException(status_code=404, detail=f"section must be one of {', '.join(PROFILE_SECTIONS)}")
+    guidance = request.guidance if request else None
+    chunks = await asyncio.to_thread(pipeline.section_chunks, case.section_chunks, case.vector_store, section_name)
+    reference_docs = await _reference_docs(case)
+    try:
+        section = await asyncio.to_thread(app.state.profile_generator.regenerate_section, chunks, section_name,
+                                          case.all_metadatas, reference_docs, guidance)
+    except (openai.OpenAIError, ValueError) as e:
+        raise HTTPException(status_code=502, detail=f"{type(e).__name__}: {e}")
+    case.profile = pipeline.merge_sections(case.profile, [section])
+    if case.deck is not None:
+        # Patch just this section's slide; if that fails the deck is rendered again on request
+        case.deck = await asyncio.to_thread(pipeline.patch_deck, case.deck, section)
+    case.updated_at = time.time()
+    return {"section": section, "profile": _parse_profile(case.profile)}
+
+
+@app.post("/cases/{case_id}/questions")
+async def ask_question(case_id: str, request: QuestionRequest):
+    case = _get_case(case_id)
+    if not request.question.strip():
+        raise HTTPException(status_code=400, detail="question must not be empty")
+    profile_generator = app.state.profile_generator
+    chunks = await _case_chunks(case)
+    reference_docs = await _reference_docs(case)
+
+    if request.stream:
+        messages = await asyncio.to_thread(
+            profile_generator.answer_messages, chunks, request.question, reference_docs)
+
+        def on_done(answer):
+            case.answers.append({"question": request.question, "answer": answer})
+            case.updated_at = time.time()
+            return {"answer": answer}
+
+        return _stream_completion("answer", messages, ANSWER_PARAMS, on_done)
+
+    try:
+        answer = await profile_generator.aanswer_question(chunks, request.question, reference_docs)
+    except openai.OpenAIError as e:
+        raise HTTPException(status_code=502, detail=f"{type(e).__name__}: {e}")
+    case.answers.append({"question": request.question, "answer": answer})
+    case.updated_at = time.time()
+    return {"answer": answer}
+
+
+@app.get("/cases/{case_id}/deck.pptx")
+async def get_deck(case_id: str):
+    case = _get_case(case_id)
+    if case.profile is None:
+        raise HTTPException(status_code=409, detail="Generate a profile before requesting the deck")
+    if case.deck is None:
+        template = str(TEMPLATE_PATH) if TEMPLATE_PATH.exists() else None
+        deck = await asyncio.to_thread(pipeline.render_deck, _parse_profile(case.profile), template)
+        case.deck = deck.getvalue()
+    return Response(case.deck, media_type=PPTX_MEDIA_TYPE,
+                    headers={"Content-Disposition": f'attachment; filename="clinical_assessment_{case_id}.pptx"'})
+
+
+@app.get("/cases/{case_id}/report.pdf")
+async def get_report(case_id: str):
+    case = _get_case(case_id)
+    if case.profile is None:
+        raise HTTPException(status_code=409, detail="Generate a profile before requesting the report")
+    # Memoized by profile and answers, so repeat downloads skip rendering
+    report = await asyncio.to_thread(pdf_renderer.render_pdf, _parse_profile(case.profile), case.answers)
+    return Response(report, media_type="application/pdf",
+                    headers={"Content-Disposition": f'attachment; filename="clinical_assessment_{case_id}.pdf"'})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.registry.to_prometheus()
+
+
+@app.get("/usage")
+async def get_usage():
+    return metrics.usage.snapshot()
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "cases": len(app.state.cases)}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")))
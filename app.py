@@ -1,17 +1,18 @@
 import streamlit as st
 import os
 from dotenv import load_dotenv
-import tempfile
+import uuid
 from document_processor import DocumentProcessor
 from profile_generator import ProfileGenerator
+from reference_digests import get_library
 from vector_store import VectorStore
-from fpdf import FPDF
-import re
+from assessment_types import PROFILE_SECTIONS
+from document_store import DocumentEvicted, store as document_store
+import pipeline
+import pdf_renderer
+import metrics
 import json
-from pptx.dml.color import RGBColor
 import pandas as pd
-from pptx import Presentation
-from io import BytesIO
 import base64
 
 from pathlib import Path
@@ -229,585 +230,56 @@ load_dotenv()
 
 # Initialize session state
 for key, default in {
-    'subject_docs': [],
-    'context_docs': [],
     'team_docs': [],
     'profile': None,
     'user_question': '',
     'question_answer': None,
-    'reference_docs': [],
     'developer_mode': False,
     'intent': "Get an overall assessment",
-    'intent_other': ''
+    'intent_other': '',
+    'last_trace': None,
+    # Documents already processed for this case, so a re-Submit only handles what changed
+    'case_manifest': {},
+    'answered_question': None,
+    # Rendered deck and its build logs, reused until the profile changes
+    'deck_key': None,
+    'deck_bytes': None,
+    'deck_logs': '',
+    # Document text lives in the process-wide document store; sessions hold only its keys
+    'subject_doc_keys': [],
+    'context_doc_keys': [],
+    'reference_doc_keys': [],
+    # Retrieved evidence per profile section, reused by "Revise a section" until the documents change
+    'section_chunks': {},
+    # Per-session vector store collection so concurrent sessions never see each other's documents
+    'vector_namespace': uuid.uuid4().hex
 }.items():
     if key not in st.session_state:
         st.session_state[key] = default
+# The session's documents and its vector store collection are released together
+st.session_state.setdefault('session_id', st.session_state.vector_namespace)
+# LLM tokens and cost in this rerun are attributed to the session
+metrics.set_usage_scope(session=st.session_state.session_id)
 
 # Initialize components
 document_processor = DocumentProcessor()
-vector_store = VectorStore()
+vector_store = VectorStore(namespace=st.session_state.vector_namespace)
 profile_generator = ProfileGenerator()
 
-# Load and process reference PDFs from HowToInterpret/
-def load_reference_docs():
-    reference_folder = "HowToInterpret"
-    reference_texts = []
-    for filename in os.listdir(reference_folder):
-        if filename.lower().endswith('.pdf'):
-            file_path = os.path.join(reference_folder, filename)
-            try:
-                text, metadata = document_processor.process_document(file_path)
-                reference_texts.append(text)
-            except Exception as e:
-                print(f"Error processing {file_path}: {e}")
-    return reference_texts
-
-# Only load reference docs once per session
-if not st.session_state.reference_docs:
-    st.session_state.reference_docs = load_reference_docs()
-
-def create_pdf(profile_text, question_answer=None):
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-
-    pdf.add_page()
-
-    # Robust font path resolution
-    BASE_DIR = Path(__file__).resolve().parent
-    FONT_PATH = BASE_DIR / "fonts" / "DejaVuSans.ttf"
-
-    pdf.add_font("DejaVu", "", str(FONT_PATH), uni=True)
-    pdf.set_font("DejaVu", size=12)
-
-    lines = profile_text.split('\n')
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue  # Skip empty lines
-        # Break up very long words (over 80 chars)
-        if max((len(word) for word in line.split()), default=0) > 80:
-            words = [word if len(word) <= 80 else ' '.join([word[i:i+80] for i in range(0, len(word), 80)]) for word in line.split()]
-            line = ' '.join(words)
-        try:
-            if line.startswith("###"):
-                heading = line.replace("###", "").strip()
-                pdf.set_font("DejaVu", "B", 14)
-                pdf.cell(0, 10, heading, ln=True)
-                pdf.set_font("DejaVu", size=12)
-            elif re.match(r"^\s*\d+\.", line) or line.startswith("-"):
-                pdf.cell(10)
-                pdf.multi_cell(0, 8, line)
-            elif "**" in line:
-                parts = re.split(r'(\*\*.*?\*\*)', line)
-                for part in parts:
-                    if part.startswith("**") and part.endswith("**"):
-                        pdf.set_font("DejaVu", "B", 12)
-                        pdf.write(8, part[2:-2])
-                        pdf.set_font("DejaVu", size=12)
-                    else:
-                        pdf.write(8, part)
-                pdf.ln(10)
-            else:
-                pdf.multi_cell(0, 8, line)
-        except Exception as e:
-            print(f"Skipped line in PDF due to error: {e}\nLine content: {repr(line)}")
-            continue
-
-
-    if question_answer:
-        pdf.ln(10)
-        pdf.set_font("DejaVu", "B", 12)
-        pdf.cell(0, 10, "Special Question Answer:", ln=True)
+# Expose /metrics when METRICS_PORT is set (no-op on reruns)
+metrics.serve_from_env()
 
+# Reference manuals and their digests are loaded once per process
+reference_library = get_library(document_processor)
 
-        pdf.set_font("DejaVu", size=12)
-        try:
-            pdf.multi_cell(0, 10, question_answer)
-        except Exception as e:
-            print(f"Skipped question_answer in PDF due to error: {e}")
-
-    return pdf.output(dest='S')
+# Report fonts are parsed once per process, ahead of the first PDF export (no-op once loaded)
+pdf_renderer.preload()
 
-def clean_source_text(source_text):
-    """Clean up temporary filenames in sources text and replace generic file types with meaningful document descriptions."""
-    if not source_text:
-        return ""
-    
-    # First, extract source types from the text if possible
-    source_types = []
-    
-    # Check for Hogan references
-    if "Hogan" in source_text or "hogan" in source_text:
-        source_types.append("Hogan Assessment")
-    
-    # Check for IDI references - distinguish between the two IDI types
-    if "IDI" in source_text or "idi" in source_text:
-        # Check for Individual Directions Inventory
-        if "directions" in source_text.lower() or "individual directions" in source_text.lower():
-            source_types.append("Individual Directions Inventory")
-        # Check for Intercultural Development Assessment
-        elif "intercultural" in source_text.lower() or "cultural" in source_text.lower():
-            source_types.append("Intercultural Development Assessment")
-        # Generic IDI if we can't determine which one
-        else:
-            source_types.append("Assessment")
-    
-    # Check for 360 references
-    if "360" in source_text:
-        source_types.append("360° Feedback")
-    
-    # Check for CV references
-    if "CV" in source_text or "cv" in source_text or "resume" in source_text.lower():
-        source_types.append("CV/Resume")
-    
-    # Replace specific patterns
-    # Replace Hogan temp files
-    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.pdf\s*\(Hogan\)', 'Hogan Assessment', source_text)
-    
-    # Replace Individual Directions Inventory files
-    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.pdf\s*\(IDI\)', 'Individual Directions Inventory', source_text)
-    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.pdf\s*\(Individual Directions\)', 'Individual Directions Inventory', source_text)
-    
-    # Replace Intercultural Development references
-    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.pdf\s*\(Intercultural\)', 'Intercultural Development Assessment', source_text)
-    
-    # Replace other temp files
-    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.[a-z]+', '', source_text)
-    source_text = re.sub(r'tmp[a-zA-Z0-9]+', '', source_text)
-    
-    # Replace generic file types with more meaningful descriptions
-    source_text = re.sub(r'\bPDF\b', 'Document', source_text)
-    source_text = re.sub(r'\bDOCX\b', 'Document', source_text)
-    source_text = re.sub(r'\bDOC\b', 'Document', source_text)
-    
-    # Clean up formatting
-    source_text = re.sub(r'\s+', ' ', source_text)  # Multiple spaces
-    source_text = re.sub(r',\s*,', ',', source_text)  # Multiple commas
-    source_text = re.sub(r'\(\s*\)', '', source_text)  # Empty parentheses
-    source_text = re.sub(r',\s*$', '', source_text)  # Trailing commas
-    source_text = re.sub(r'^\s*,\s*', '', source_text)  # Leading commas
-    source_text = re.sub(r'\(\s*,', '(', source_text)  # Commas after opening parenthesis
-    source_text = re.sub(r',\s*\)', ')', source_text)  # Commas before closing parenthesis
-    
-    # Final cleanup
-    source_text = source_text.strip()
-    
-    # If we've removed everything but have identified source types, use them
-    if (not source_text or source_text == ',' or source_text == '()') and source_types:
-        return ", ".join(source_types)
-    
-    # If we still have nothing, return a generic source
-    if not source_text or source_text == ',' or source_text == '()':
-        return "Assessment Documents"
-    
-    return source_text
-
-def generate_pptx_from_json(json_data, template_path=None):
-    """
-    Generate a PowerPoint presentation from structured JSON data.
-    Uses a template if provided, otherwise creates a new presentation.
-    Maps each section to the appropriate slide in the template.
-    """
-    # Load template if provided, otherwise use blank
-    if template_path:
-        try:
-            prs = Presentation(template_path)
-            print(f"Using template: {template_path}")
-            # Debug template info
-            print(f"Template has {len(prs.slides)} slides")
-            for i, slide in enumerate(prs.slides):
-                print(f"Slide {i+1}: {len(slide.shapes)} shapes")
-                
-            # Debug theme colors
-            if hasattr(prs, 'theme') and hasattr(prs.theme, 'theme_color_scheme'):
-                print("\nTHEME COLORS:")
-                for idx, color in enumerate(prs.theme.theme_color_scheme.colors):
-                    if hasattr(color, 'rgb'):
-                        r, g, b = color.rgb >> 16, (color.rgb >> 8) & 0xFF, color.rgb & 0xFF
-                        print(f"  Color {idx+1}: RGB({r},{g},{b})")
-                    else:
-                        print(f"  Color {idx+1}: [No RGB value available]")
-            else:
-                print("\nNo theme color information available")
-        except Exception as e:
-            print(f"Error loading template: {e}")
-            prs = Presentation()
-    else:
-        prs = Presentation()
-        
-    # Define our brand colors
-    HEADER_COLOR_WHITE = RGBColor(255, 255, 255)  # White for headers
-    BODY_COLOR_BLUE = RGBColor(10, 44, 77)        # Deep blue for body text - matches template
-    
-    # If using a blank presentation, create slides for each section
-    if template_path is None or len(prs.slides) < 2:  # If no template or not enough slides
-        for section in json_data:
-            slide_layout = prs.slide_layouts[1] if len(prs.slide_layouts) > 1 else prs.slide_layouts[0]
-            slide = prs.slides.add_slide(slide_layout)
-            # Set title if possible
-            title_shape = None
-            for shape in slide.shapes:
-                if shape.name.startswith('Title'):
-                    title_shape = shape
-                    break
-            if title_shape and hasattr(title_shape, 'text_frame'):
-                title_shape.text_frame.text = section['section']
-                # Set title font to white for contrast against blue background
-                for paragraph in title_shape.text_frame.paragraphs:
-                    if hasattr(paragraph.font, 'color') and hasattr(paragraph.font.color, 'rgb'):
-                        paragraph.font.color.rgb = HEADER_COLOR_WHITE
-                    if hasattr(paragraph.font, 'bold'):
-                        paragraph.font.bold = True
-                    if hasattr(paragraph.font, 'size'):
-                        paragraph.font.size = 32 * 12700  # 32pt for headers
-            
-            # Add content
-            content = section['content']
-            sources = section.get('sources', '')
-            
-            # Clean up sources to remove temporary filenames
-            sources = clean_source_text(sources)
-            
-            content_shape = None
-            for shape in slide.placeholders:
-                if shape.placeholder_format.type == 1:  # MSO_PLACEHOLDER.BODY
-                    content_shape = shape
-                    break
-            if content_shape:
-                content_shape.text_frame.clear()
-                for line in content.split('\n'):
-                    if not line.strip():
-                        continue  # skip empty lines
-                    p = content_shape.text_frame.add_paragraph()
-                    p.text = line.lstrip('-* ').strip()
-                    if line.strip().startswith(('-', '*')):
-                        p.level = 0
-                        p.font.bullet = True
-                    if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
-                        try:
-                            p.font.color.rgb = RGBColor(10, 44, 77)
-                        except:
-                            pass
-                    if hasattr(p.font, 'name'):
-                        try:
-                            p.font.name = "Calibri"
-                        except:
-                            pass
-                    if hasattr(p.font, 'size'):
-                        try:
-                            p.font.size = 18 * 12700  # 18pt (increased from 12pt)
-                        except:
-                            pass
-                # Add sources as a separate paragraph if present
-                if sources:
-                    p = content_shape.text_frame.add_paragraph()
-                    p.text = f"Sources: {sources}"
-                    if hasattr(p.font, 'italic'):
-                        p.font.italic = True
-                    if hasattr(p.font, 'name'):
-                        p.font.name = "Calibri"
-                    if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
-                        p.font.color.rgb = RGBColor(10, 44, 77)
-                    if hasattr(p.font, 'size'):
-                        p.font.size = 18 * 12700  # 18pt (increased from 12pt)
-    else:
-        # Using the template - map sections to specific slides
-        # Based on the template structure shown in screenshots
-        
-        # Keep cover slide (slide 1) and table of contents (slide 2) as is
-        
-        # Define a map from section titles (from the JSON) to slide numbers in the template
-        section_to_slide = {
-            "Presenting Concerns and Goals": 2,     # Slide 3
-            "History Snapshot": 3,                  # Slide 4
-            "Behavioral Observations": 4,           # Slide 5
-            "Test Results by Domain": 5,            # Slide 6
-            "Integrative Case Formulation": 6,      # Slide 7
-            "Diagnoses": 7,                         # Slide 8
-            # For legacy support and backward compatibility:
-            "Profile Summary": 2,                   # Map to Presenting Concerns (slide 3)
-            "Key Strengths": 4,                     # Map to Behavioral Observations (slide 5)
-            "Potential Challenges": 5,              # Map to Test Results (slide 6)
-            "Psychological Style": 6,               # Map to Case Formulation (slide 7)
-            "Treatment Considerations": 7,          # Map to Diagnoses (slide 8)
-            "Risk Factors": 7                       # Map to Diagnoses (slide 8)
-        }
-        
-        # Process each section from the JSON data
-        print(f"Processing {len(json_data)} sections")
-        for section in json_data:
-            section_name = section['section']
-            print(f"Processing section: '{section_name}'")
-                
-            content = section['content']
-            sources = section.get('sources', '')
-            
-            # Clean up sources to remove temporary filenames
-            sources = clean_source_text(sources)
-            
-            # Find the slide index for this section
-            slide_idx = section_to_slide.get(section_name)
-            if slide_idx is None:
-                # Try more flexible matching for alternate section names
-                for map_name, idx in section_to_slide.items():
-                    # Check for strict containment first
-                    if map_name.lower() in section_name.lower() or section_name.lower() in map_name.lower():
-                        slide_idx = idx
-                        print(f"Found slide match: '{section_name}' -> '{map_name}' (slide {idx+1})")
-                        break
-                
-                # If still no match, try more relaxed matching using section title subset
-                if (section_name.lower().startswith('present') or section_name.lower().startswith('concern')) and (idx == 2):
-                    slide_idx = idx
-                    print(f"Mapping '{section_name}' to slide {idx+1} (Presenting Concerns and Goals)")
-                elif "history" in section_name.lower() and (idx == 3):
-                    slide_idx = idx
-                    print(f"Mapping '{section_name}' to slide {idx+1} (History Snapshot)")
-                elif "observation" in section_name.lower() or "mental status" in section_name.lower() and (idx == 4):
-                    slide_idx = idx
-                    print(f"Mapping '{section_name}' to slide {idx+1} (Behavioral Observations)")
-                elif "test" in section_name.lower() or "results" in section_name.lower() and (idx == 5):
-                    slide_idx = idx
-                    print(f"Mapping '{section_name}' to slide {idx+1} (Test Results by Domain)")
-                elif "formulation" in section_name.lower() or "case" in section_name.lower() and (idx == 6):
-                    slide_idx = idx
-                    print(f"Mapping '{section_name}' to slide {idx+1} (Integrative Case Formulation)")
-                elif "diagnos" in section_name.lower() or "differential" in section_name.lower() and (idx == 7):
-                    slide_idx = idx
-                    print(f"Mapping '{section_name}' to slide {idx+1} (Diagnoses)")
-                
-            # If still no match, try keyword matching for diagnosis or test sections
-            if slide_idx is None:
-                if "diagnos" in section_name.lower() or "dsm" in section_name.lower() or "icd" in section_name.lower():
-                    slide_idx = 7  # Map to Diagnoses
-                    print(f"Keyword mapping '{section_name}' to slide 8 (Diagnoses)")
-                elif "test" in section_name.lower() or "assessment" in section_name.lower() or "measure" in section_name.lower():
-                    slide_idx = 5  # Map to Test Results
-                    print(f"Keyword mapping '{section_name}' to slide 6 (Test Results)")
-                elif "history" in section_name.lower() or "background" in section_name.lower():
-                    slide_idx = 3  # Map to History
-                    print(f"Keyword mapping '{section_name}' to slide 4 (History Snapshot)")
-                elif "observation" in section_name.lower() or "mental status" in section_name.lower() or "mse" in section_name.lower():
-                    slide_idx = 4  # Map to Behavioral Observations
-                    print(f"Keyword mapping '{section_name}' to slide 5 (Behavioral Observations)")
-            
-            if slide_idx is not None and slide_idx < len(prs.slides):
-                # Use existing slide from template
-                slide = prs.slides[slide_idx]
-                print(f"Adding content to slide {slide_idx+1} for section '{section_name}'")
-                
-                # IMPORTANT CHANGE: SKIP ALL TITLE MANIPULATION
-                # We will leave the template titles exactly as they are
-                
-                # FIND OR CREATE CONTENT SHAPE
-                content_shape = None
-                
-                # Look for existing content shapes (not the title)
-                for shape in slide.shapes:
-                    if hasattr(shape, 'text_frame'):
-                        # Skip any shape that looks like a title (usually at the top of slide)
-                        if hasattr(shape, 'top') and shape.top < 1000000:  # ~1 inch from top
-                            continue
-                        # Use the first non-title text shape we find for content
-                        content_shape = shape
-                        print(f"Found content shape in slide {slide_idx+1}")
-                        break
-                
-                # If no content shape found, create a new textbox for content
-                if not content_shape:
-                    try:
-                        # Create new textbox with better positioning (below title)
-                        content_left = 0.5 * 914400    # 0.5 inch from left
-                        content_top = 650000     # 0.5 inches from top (below title)
-                        content_width = prs.slide_width - (1 * 914400)  # Full width minus 1 inch
-                        content_height = prs.slide_height - content_top - (0.5 * 914400)  # From top to bottom with margin
-                        
-                        content_shape = slide.shapes.add_textbox(content_left, content_top, content_width, content_height)
-                        print(f"Created new content textbox on slide {slide_idx+1}")
-                    except Exception as e:
-                        print(f"Error creating content textbox: {e}")
-                
-                if content_shape:
-                    try:
-                        # Clear existing text
-                        if hasattr(content_shape, 'text_frame'):
-                            content_shape.text_frame.clear()
-                        
-                        # Adjust position for better spacing from header
-                        if hasattr(content_shape, 'top'):
-                            try:
-                                if content_shape.top < 650000:
-                                    content_shape.top = 650000
-                            except:
-                                pass
-                        
-                        # Enable word wrap 
-                        if hasattr(content_shape, 'text_frame') and hasattr(content_shape.text_frame, 'word_wrap'):
-                            content_shape.text_frame.word_wrap = True
-                        
-                        # Add margins to text frame if possible
-                        if hasattr(content_shape, 'text_frame') and hasattr(content_shape.text_frame, 'margin_top'):
-                            try:
-                                # Add generous margins
-                                content_shape.text_frame.margin_top = 300000     # ~8mm top margin
-                                content_shape.text_frame.margin_bottom = 150000  # ~4mm bottom margin
-                                content_shape.text_frame.margin_left = 150000    # ~4mm left margin
-                                content_shape.text_frame.margin_right = 150000   # ~4mm right margin
-                            except:
-                                pass
-                        
-                        # Add main content as bullet-aware paragraphs
-                        for line in content.split('\n'):
-                            if not line.strip():
-                                continue
-                            p = content_shape.text_frame.add_paragraph()
-                            p.text = line.lstrip('-* ').strip()
-                            if line.strip().startswith(('-', '*')):
-                                p.level = 0
-                                p.font.bullet = True
-                            if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
-                                try:
-                                    p.font.color.rgb = RGBColor(10, 44, 77)
-                                except:
-                                    pass
-                            if hasattr(p.font, 'name'):
-                                try:
-                                    p.font.name = "Calibri"
-                                except:
-                                    pass
-                            if hasattr(p.font, 'size'):
-                                try:
-                                    p.font.size = 18 * 12700  # 18pt (increased from 12pt)
-                                except:
-                                    pass
-                        
-                        # Add sources as a separate paragraph if present
-                        if sources:
-                            p = content_shape.text_frame.add_paragraph()
-                            p.text = f"Sources: {sources}"
-                            if hasattr(p.font, 'italic'):
-                                p.font.italic = True
-                            if hasattr(p.font, 'name'):
-                                p.font.name = "Calibri"
-                            if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
-                                p.font.color.rgb = RGBColor(10, 44, 77)
-                            if hasattr(p.font, 'size'):
-                                p.font.size = 18 * 12700  # 18pt (increased from 12pt)
-                        
-                        print(f"Successfully added content to slide {slide_idx+1}")
-                    except Exception as e:
-                        print(f"Error setting content on slide {slide_idx+1}: {e}")
-            else:
-                print(f"No matching slide found for section '{section_name}', creating new slide")
-                # Add a new slide with appropriate formatting
-                slide_layout = prs.slide_layouts[1] if len(prs.slide_layouts) > 1 else prs.slide_layouts[0]
-                slide = prs.slides.add_slide(slide_layout)
-                
-                # Create proper title with blue background
-                try:
-                    # Create a title box with blue background
-                    title_left = 0
-                    title_top = 0
-                    title_width = prs.slide_width
-                    title_height = 0.8 * 914400  # 0.8 inches
-                    
-                    # Add shape for title background
-                    title_shape = slide.shapes.add_textbox(title_left, title_top, title_width, title_height)
-                    
-                    # Apply blue background
-                    if hasattr(title_shape, 'fill'):
-                        title_shape.fill.solid()
-                        title_shape.fill.fore_color.rgb = RGBColor(10, 44, 77)
-                    
-                    # Add title text
-                    title_shape.text_frame.clear()
-                    p = title_shape.text_frame.add_paragraph()
-                    p.text = section_name
-                    p.alignment = 1  # Center
-                    
-                    # Format title - white text
-                    if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
-                        p.font.color.rgb = RGBColor(255,255,255)
-                    if hasattr(p.font, 'bold'):
-                        p.font.bold = True
-                    if hasattr(p.font, 'size'):
-                        p.font.size = 36 * 12700  # 36pt (increased from 32pt)
-                        
-                    # Apply to all runs
-                    for run in p.runs:
-                        if hasattr(run.font, 'color') and hasattr(run.font.color, 'rgb'):
-                            run.font.color.rgb = RGBColor(255,255,255)
-                        if hasattr(run.font, 'bold'):
-                            run.font.bold = True
-                        if hasattr(run.font, 'size'):
-                            run.font.size = 36 * 12700  # 36pt (increased from 32pt)
-                except Exception as e:
-                    print(f"Error creating title on new slide: {e}")
-                
-                # Create content box
-                try:
-                    # Create content box
-                    content_left = 0.5 * 914400    # 0.5 inch from left
-                    content_top = 650000     # 1.2 inches from top (below title)
-                    content_width = prs.slide_width - (1 * 914400)  # Full width minus 1 inch margins
-                    content_height = prs.slide_height - content_top - (0.5 * 914400)  # To bottom with margin
-                    
-                    content_shape = slide.shapes.add_textbox(content_left, content_top, content_width, content_height)
-                    
-                    # Add margins to text frame
-                    if hasattr(content_shape, 'text_frame') and hasattr(content_shape.text_frame, 'margin_top'):
-                        content_shape.text_frame.margin_top = 300000     # Top margin
-                        content_shape.text_frame.margin_bottom = 150000  # Bottom margin
-                        content_shape.text_frame.margin_left = 150000    # Left margin
-                        content_shape.text_frame.margin_right = 150000   # Right margin
-                    
-                    # Enable word wrap
-                    if hasattr(content_shape, 'text_frame') and hasattr(content_shape.text_frame, 'word_wrap'):
-                        content_shape.text_frame.word_wrap = True
-                    
-                    # Add content
-                    p = content_shape.text_frame.add_paragraph()
-                    p.text = content
-                    
-                    # Format content - blue text
-                    if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
-                        p.font.color.rgb = RGBColor(10, 44, 77)
-                    if hasattr(p.font, 'name'):
-                        p.font.name = "Calibri"
-                    if hasattr(p.font, 'size'):
-                        p.font.size = 18 * 12700  # 18pt (increased from 12pt)
-                        
-                    # Apply to all runs
-                    for run in p.runs:
-                        if hasattr(run.font, 'color') and hasattr(run.font.color, 'rgb'):
-                            run.font.color.rgb = RGBColor(10, 44, 77)
-                        if hasattr(run.font, 'name'):
-                            run.font.name = "Calibri"
-                        if hasattr(run.font, 'size'):
-                            run.font.size = 18 * 12700  # 18pt (increased from 12pt)
-                    
-                    # Add sources if available
-                    if sources:
-                        p = content_shape.text_frame.add_paragraph()
-                        p.text = f"Sources: {sources}"
-                        
-                        # Format sources - italic
-                        if hasattr(p.font, 'italic'):
-                            p.font.italic = True
-                        if hasattr(p.font, 'name'):
-                            p.font.name = "Calibri"
-                        if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
-                            p.font.color.rgb = RGBColor(10, 44, 77)
-                        if hasattr(p.font, 'size'):
-                            p.font.size = 18 * 12700  # 18pt (increased from 12pt)
-                except Exception as e:
-                    print(f"Error creating content on new slide: {e}")
-    
-    # Save to BytesIO
-    pptx_io = BytesIO()
-    prs.save(pptx_io)
-    pptx_io.seek(0)
-    return pptx_io
+# Idle sessions give back their document text and vector store
+document_store.on_evict("vector_store", VectorStore.drop_namespace)
+document_store.on_evict("usage", lambda session_id: metrics.usage.forget("session", session_id))
+document_store.touch(st.session_state.session_id)
+document_store.evict_idle()
 
 def main():
     st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
@@ -851,58 +323,16 @@ def main():
     st.markdown('<div class="section-desc">Do you have any specific clinical questions in mind? <br>Examples: "Are there any contraindications for CBT with this patient?" • "What differential diagnoses should be considered?" • "What specific risk factors should be monitored throughout treatment?"</div>', unsafe_allow_html=True)
     user_question = st.text_area(" ", height=80, key="user_question")
 
+    trace = None
     if st.button("Submit"):
-        all_docs = list(st.session_state.reference_docs)
-
-        all_metadatas = []  # NEW: to collect all metadata for the report
-
-
+        trace = metrics.begin_trace("submit")
         with st.spinner("Processing documents...... This could take about a minute, please wait."):
-            if subject_docs:
-                st.session_state.subject_docs = []
-
-                st.session_state.subject_metadatas = []  # NEW
-
-                for file in subject_docs:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as tmp_file:
-                        tmp_file.write(file.getvalue())
-                        text, metadata = document_processor.process_document(tmp_file.name)
-                        st.session_state.subject_docs.append(text)
-                        st.session_state.subject_metadatas.append(metadata)
-                        os.unlink(tmp_file.name)
-                all_docs.extend(st.session_state.subject_docs)
-
-
-                all_metadatas.extend(st.session_state.subject_metadatas)
-
-            if context_docs:
-                st.session_state.context_docs = []
-                st.session_state.context_metadatas = []  # NEW
-
-                for file in context_docs:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as tmp_file:
-                        tmp_file.write(file.getvalue())
-                        text, metadata = document_processor.process_document(tmp_file.name)
-                        st.session_state.context_docs.append(text)
-                        st.session_state.context_metadatas.append(metadata)
-                        os.unlink(tmp_file.name)
-                all_docs.extend(st.session_state.context_docs)
-
-
-                all_metadatas.extend(st.session_state.context_metadatas)
-
-            vector_store.store_documents(all_docs)  # all_docs is now a list of strings
-
-            with st.spinner("Generating clinical assessment...This could take a minute. Please wait."):
-                st.session_state.profile = profile_generator.generate_profile(
-                    vector_store.get_relevant_chunks(),
-                    all_metadatas  # Pass the metadata list for the document summary
-                )
-
-            if user_question.strip():
-                st.session_state.question_answer = profile_generator.answer_question(
-                    vector_store.get_relevant_chunks(), user_question
-                )
+            # Only documents added or removed since the last Submit are processed, and
+            # only the profile sections they bear on are regenerated
+            pipeline.submit_case(
+                st.session_state, subject_docs, context_docs, user_question,
+                document_processor, vector_store, profile_generator, reference_library
+            )
 
     if st.session_state.profile:
         # Try to parse the profile as JSON
@@ -915,6 +345,10 @@ def main():
             
             # CSV download button removed per user request
             
+            # The PDF report renders on a background thread (or comes from its cache) while the deck is built
+            answers = [{"answer": st.session_state.question_answer}] if st.session_state.question_answer else []
+            pdf_future = pdf_renderer.submit_pdf(profile_json, answers)
+
             # PowerPoint generation and download
             # Use Path for robust template path handling
             template_path = Path(__file__).resolve().parent / "template.pptx"
@@ -929,15 +363,21 @@ def main():
                     import io
                     import sys
                     
-                    log_capture = io.StringIO()
-                    original_stdout = sys.stdout
-                    sys.stdout = log_capture
-                    
-                    pptx_io = generate_pptx_from_json(profile_json, template_path=template_path)
-                    
-                    # Restore stdout and get logs
-                    sys.stdout = original_stdout
-                    logs = log_capture.getvalue()
+                    deck_key = (st.session_state.profile, str(template_path))
+                    if st.session_state.deck_key != deck_key:
+                        log_capture = io.StringIO()
+                        original_stdout = sys.stdout
+                        sys.stdout = log_capture
+                        try:
+                            st.session_state.deck_bytes = pipeline.render_deck(
+                                profile_json, template_path=template_path).getvalue()
+                        finally:
+                            # Restore stdout and get logs
+                            sys.stdout = original_stdout
+                        st.session_state.deck_logs = log_capture.getvalue()
+                        st.session_state.deck_key = deck_key
+                    pptx_io = io.BytesIO(st.session_state.deck_bytes)
+                    logs = st.session_state.deck_logs
                     
                     # Only show logs if developer mode is enabled (hidden feature)
                     if st.session_state.get('developer_mode', False):
@@ -955,7 +395,7 @@ def main():
                     # Don't show the specific error, just a generic fallback message
                     # Fallback to generating PowerPoint without template
                     try:
-                        pptx_io = generate_pptx_from_json(profile_json, template_path=None)
+                        pptx_io = pipeline.render_deck(profile_json, template_path=None)
                         st.download_button(
                             label="Download Clinical Assessment",
                             data=pptx_io,
@@ -965,6 +405,18 @@ def main():
                         )
                     except Exception:
                         st.error("Could not generate PowerPoint. Please try again later.")
+
+            try:
+                st.download_button(
+                    label="Export to PDF",
+                    data=pdf_future.result(),
+                    file_name="clinical_assessment.pdf",
+                    mime="application/pdf",
+                    key="download_pdf"
+                )
+            except Exception as e:
+                print(f"PDF export failed: {e}")
+                st.error("Could not generate the PDF report. Please try again later.")
         except Exception as e:
             st.error(f"Could not parse profile as JSON: {e}")
             st.markdown('<div class="section-title">Executive Summary</div>', unsafe_allow_html=True)
@@ -972,6 +424,20 @@ def main():
             st.write(st.session_state.profile)
             st.markdown('</div>', unsafe_allow_html=True)
 
+        # Redo one section from its own evidence without regenerating the whole profile
+        if st.session_state.case_manifest:
+            with st.expander("Revise a section"):
+                section_name = st.selectbox("Section", PROFILE_SECTIONS, key="revise_section")
+                guidance = st.text_input("What should change? (optional)", key="revise_guidance")
+                if st.button("Regenerate section"):
+                    try:
+                        with st.spinner("Regenerating section..."):
+                            pipeline.regenerate_section(st.session_state, section_name, vector_store, profile_generator,
+                                                        guidance=guidance or None)
+                        st.rerun()
+                    except DocumentEvicted:
+                        st.warning("This session was idle and its documents were released. Please Submit again.")
+
         if st.session_state.question_answer:
             st.markdown('<div class="section-title">Clinical Consultation Response</div>', unsafe_allow_html=True)
             st.markdown('<div class="profile-section">', unsafe_allow_html=True)
@@ -979,14 +445,27 @@ def main():
             st.markdown('</div>', unsafe_allow_html=True)
 
 
-        # pdf_bytes = create_pdf(st.session_state.profile, st.session_state.question_answer)
-        # st.download_button(
-        #     label="Export to PDF",
-        #     data=pdf_bytes,
-        #     file_name="psychology_profile.pdf",
-        #     mime="application/pdf"
-        # )
+    if trace is not None:
+        metrics.end_trace(trace)
+        st.session_state.last_trace = trace.to_dict()
+
+    # Per-request waterfall (hidden developer feature)
+    if st.session_state.get('developer_mode', False) and st.session_state.last_trace:
+        with st.expander("Request Waterfall"):
+            st.code(metrics.format_waterfall(st.session_state.last_trace))
+
+    # Memory this session holds (hidden developer feature)
+    if st.session_state.get('developer_mode', False):
+        with st.expander("Session Memory"):
+            memory = pipeline.session_memory(st.session_state, vector_store)
+            memory["upload_bytes"] = sum(len(f.getvalue()) for f in (subject_docs or []) + (context_docs or []))
+            st.json(memory)
 
+    # LLM tokens and estimated cost (hidden developer feature)
+    if st.session_state.get('developer_mode', False):
+        with st.expander("LLM Usage"):
+            st.json({"session": metrics.usage.totals("session", st.session_state.session_id),
+                     "today": metrics.usage.today()})
 
     st.markdown('<div class="footer">KNOWTHEE.AI CLINICAL ASSESSMENT</div>', unsafe_allow_html=True)
 
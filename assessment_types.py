@@ -0,0 +1,101 @@
+from typing import List
+
+# Content terms that identify each assessment or document type, in the order
+# types are reported
+ASSESSMENT_TERMS = [
+    ("Hogan Assessment", ["hogan", "hpi", "hds", "mvpi", "motives values preferences", "personality inventory", "development survey"]),
+    ("CV/Resume", ["cv", "resume", "résumé", "curriculum vitae", "work history", "professional experience", "education:"]),
+    ("Intercultural Development Assessment", ["intercultural development inventory", "intercultural sensitivity", "cultural competence"]),
+    ("Individual Directions Inventory", ["individual directions inventory", "idi report", "directions inventory"]),
+    ("Performance Review", ["performance review", "annual review", "performance assessment", "performance rating"]),
+    ("Interview Notes", ["interview notes", "interview summary", "candidate interview"]),
+]
+
+
+def _has_360(text: str) -> bool:
+    return "360" in text or "360-degree" in text.lower()
+
+
+def detect_assessment_types(document_chunks: List[str]) -> List[str]:
+    """Identify the assessment and document types present in the chunks from their content."""
+    joined = " ".join(document_chunks)
+    joined_lower = joined.lower()
+    assessment_types = []
+    for doc_type, terms in ASSESSMENT_TERMS:
+        if any(term in joined_lower for term in terms):
+            assessment_types.append(doc_type)
+        # 360 feedback is matched case-sensitively and reported after Hogan
+        if doc_type == "Hogan Assessment" and _has_360(joined):
+            assessment_types.append("360° Feedback")
+    return assessment_types
+
+
+def document_type_from_filename(file_name: str, file_type: str) -> str:
+    """Meaningful document type parsed from a file name, or a generic '<TYPE> Document'."""
+    lower = file_name.lower()
+    if 'hogan' in lower:
+        return "Hogan Assessment"
+    if '360' in file_name:
+        return "360° Feedback"
+    if any(term in lower for term in ['cv', 'resume', 'résumé']):
+        return "CV/Resume"
+    if 'idi' in lower:
+        return "IDI Assessment"
+    return f"{file_type.upper()} Document"
+
+
+def classify_document(text: str, file_name: str, file_type: str) -> str:
+    """Document type for one document: from its file name if that is informative, else its content."""
+    doc_type = document_type_from_filename(file_name, file_type)
+    if doc_type.endswith(" Document"):
+        detected = detect_assessment_types([text])
+        if detected:
+            return detected[0]
+    return doc_type
+
+
+PROFILE_SECTIONS = [
+    "Presenting Concerns and Goals",
+    "History Snapshot",
+    "Behavioral Observations",
+    "Test Results by Domain",
+    "Integrative Case Formulation",
+    "Diagnoses",
+]
+
+# Profile sections each document type provides evidence for. The formulation
+# integrates all evidence, so any change touches it; unknown types touch everything.
+SECTION_EVIDENCE = {
+    "Hogan Assessment": ["Behavioral Observations", "Test Results by Domain", "Diagnoses"],
+    "IDI Assessment": ["Behavioral Observations", "Test Results by Domain"],
+    "Intercultural Development Assessment": ["Behavioral Observations", "Test Results by Domain"],
+    "Individual Directions Inventory": ["Presenting Concerns and Goals", "Test Results by Domain"],
+    "360° Feedback": ["Presenting Concerns and Goals", "Behavioral Observations"],
+    "CV/Resume": ["History Snapshot"],
+    "Performance Review": ["Presenting Concerns and Goals", "Behavioral Observations"],
+    "Interview Notes": ["Presenting Concerns and Goals", "History Snapshot", "Behavioral Observations"],
+}
+
+
+def affected_sections(doc_types: List[str]) -> List[str]:
+    """Profile sections (in profile order) that evidence of the given document types can change."""
+    touched = {"Integrative Case Formulation"}
+    for doc_type in doc_types:
+        touched.update(SECTION_EVIDENCE.get(doc_type, PROFILE_SECTIONS))
+    return [section for section in PROFILE_SECTIONS if section in touched]
+
+# Retrieval query per section, for regenerating one section from its own evidence
+SECTION_QUERIES = {
+    "Presenting Concerns and Goals": "presenting concerns, reasons for referral, goals, development priorities, feedback themes",
+    "History Snapshot": "work history, education, career, family and social background, medical and psychological history",
+    "Behavioral Observations": "observed behaviour, interpersonal style, rater comments, interview observations, strengths and derailers",
+    "Test Results by Domain": "scale scores, percentiles, T scores, HPI HDS MVPI results, assessment results by domain",
+    "Integrative Case Formulation": "predisposing, precipitating, perpetuating and protective factors; patterns across assessments",
+    "Diagnoses": "diagnosis, DSM ICD codes, symptoms, criteria, risk factors, clinical impressions",
+}
+
+
+def section_types(section: str) -> List[str]:
+    """Document types that provide evidence for a section, including generic (unclassified) documents."""
+    types = [doc_type for doc_type, sections in SECTION_EVIDENCE.items() if section in sections]
+    return types + ["PDF Document", "DOCX Document"]
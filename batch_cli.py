@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import llm_batch
+import metrics
+import pdf_renderer
+import pipeline
+from document_processor import DocumentProcessor
+from profile_generator import ANSWER_PARAMS, PROFILE_PARAMS, ProfileGenerator
+from reference_digests import get_library
+
+BASE_DIR = Path(__file__).resolve().parent
+SUPPORTED_SUFFIXES = (".pdf", ".docx")
+QUESTIONS_FILE = "questions.txt"
+MANIFEST_FILE = "manifest.json"
+BATCH_REQUESTS_FILE = "batch_requests.jsonl"
+TEAM_DECK_FILE = "team_assessment.pptx"
+
+
+def find_cases(cases_dir):
+    """Return case folders: any directory with a subject/ or context/ subfolder."""
+    cases = []
+    for path in sorted(Path(cases_dir).iterdir()):
+        if path.is_dir() and ((path / "subject").is_dir() or (path / "context").is_dir()):
+            cases.append(path)
+    return cases
+
+
+def _documents(folder):
+    if not folder.is_dir():
+        return []
+    return sorted(p for p in folder.iterdir() if p.suffix.lower() in SUPPORTED_SUFFIXES)
+
+
+def _questions(case_dir):
+    path = case_dir / QUESTIONS_FILE
+    if not path.exists():
+        return []
+    return [line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
+def case_input_hash(case_dir):
+    """Hash every input file of a case, so edited cases are re-run on resume."""
+    digest = hashlib.sha256()
+    inputs = _documents(case_dir / "subject") + _documents(case_dir / "context")
+    if (case_dir / QUESTIONS_FILE).exists():
+        inputs.append(case_dir / QUESTIONS_FILE)
+    for path in inputs:
+        digest.update(str(path.relative_to(case_dir)).encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Per-case status persisted after every case, so an interrupted batch can resume."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.cases = {}
+        # The outstanding Batch API job, if any, so --llm-mode batch can resume polling
+        self.batch = {}
+        if self.path.exists():
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            self.cases = data.get("cases", {})
+            self.batch = data.get("batch", {})
+
+    def is_done(self, case_name, input_hash):
+        entry = self.cases.get(case_name)
+        return bool(entry) and entry.get("status") == "done" and entry.get("input_hash") == input_hash
+
+    def update(self, case_name, **fields):
+        with self.lock:
+            self.cases.setdefault(case_name, {}).update(fields)
+            self._save()
+
+    def update_batch(self, **fields):
+        with self.lock:
+            self.batch.update(fields)
+            self._save()
+
+    def batch_outstanding(self):
+        return bool(self.batch.get("id")) and self.batch.get("status") != "collected"
+
+    def _save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"cases": self.cases, "batch": self.batch}, indent=2), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+
+def write_outputs(case_out, profile, answers, template_path):
+    """Write profile.json, answers.json, the deck and the PDF report for one case; returns the files written."""
+    try:
+        profile_json = json.loads(profile)
+    except json.JSONDecodeError as e:
+        (case_out / "profile_raw.txt").write_text(profile, encoding="utf-8")
+        raise ValueError(f"Could not parse profile as JSON: {e}")
+
+    (case_out / "profile.json").write_text(json.dumps(profile_json, indent=2, ensure_ascii=False), encoding="utf-8")
+    if answers:
+        (case_out / "answers.json").write_text(json.dumps(answers, indent=2, ensure_ascii=False), encoding="utf-8")
+    deck = pipeline.render_deck(profile_json, template_path=template_path)
+    (case_out / "clinical_assessment.pptx").write_bytes(deck.getvalue())
+    (case_out / "clinical_assessment.pdf").write_bytes(pdf_renderer.render_pdf(profile_json, answers))
+    return ["profile.json", "clinical_assessment.pptx", "clinical_assessment.pdf"] + (["answers.json"] if answers else [])
+
+
+def _case_chunks(case_dir, reference_library, document_processor):
+    """Extract a case's documents; returns their page chunks, metadata, reference material and document count."""
+    subject_docs, subject_metadatas, subject_pages = pipeline.extract_paths(
+        document_processor, _documents(case_dir / "subject"))
+    context_docs, context_metadatas, context_pages = pipeline.extract_paths(
+        document_processor, _documents(case_dir / "context"))
+    subject_chunks, _ = pipeline.page_chunks("subject", subject_docs, subject_metadatas, subject_pages)
+    context_chunks, _ = pipeline.page_chunks("context", context_docs, context_metadatas, context_pages)
+    reference_docs = reference_library.select(subject_docs) if reference_library else []
+    # The profile reads every page, so there is nothing to retrieve and no store to embed them in
+    return (subject_chunks + context_chunks, subject_metadatas + context_metadatas, reference_docs,
+            len(subject_docs) + len(context_docs))
+
+
+def process_case(case_dir, out_dir, reference_library, document_processor, profile_generator, template_path):
+    """Run extraction, profile, questions and deck rendering for one case folder."""
+    case_out = Path(out_dir) / case_dir.name
+    case_out.mkdir(parents=True, exist_ok=True)
+
+    with metrics.start_trace("batch_case", case=case_dir.name) as trace, metrics.usage_scope(case=case_dir.name):
+        chunks, all_metadatas, reference_docs, documents = _case_chunks(case_dir, reference_library, document_processor)
+        profile = profile_generator.generate_profile(chunks, all_metadatas, reference_docs)
+
+        answers = []
+        for question in _questions(case_dir):
+            answer = profile_generator.answer_question(chunks, question, reference_docs)
+            answers.append({"question": question, "answer": answer})
+
+        outputs = write_outputs(case_out, profile, answers, template_path)
+
+    return {"outputs": outputs, "documents": documents, "questions": len(answers),
+            "duration_s": round(trace.duration, 2), "usage": metrics.usage.totals("case", case_dir.name)}
+
+
+def prepare_case(case_dir, reference_library, document_processor, profile_generator):
+    """Extract a case and build its Batch API request lines; returns (lines, manifest fields)."""
+    with metrics.start_trace("batch_prepare", case=case_dir.name), metrics.usage_scope(case=case_dir.name):
+        chunks, all_metadatas, reference_docs, documents = _case_chunks(case_dir, reference_library, document_processor)
+        messages, doc_type_map = profile_generator.profile_messages(chunks, all_metadatas, reference_docs)
+        questions = _questions(case_dir)
+        requests = [llm_batch.batch_line(f"{case_dir.name}/profile", "profile", messages, PROFILE_PARAMS)]
+        for i, question in enumerate(questions):
+            requests.append(llm_batch.batch_line(f"{case_dir.name}/answer/{i}", "answer",
+                                                 profile_generator.answer_messages(chunks, question, reference_docs),
+                                                 ANSWER_PARAMS))
+    lines = [line for line, _ in requests]
+    estimate = round(sum(cost for _, cost in requests), 6)
+    return lines, {"doc_type_map": doc_type_map, "questions": questions, "documents": documents,
+                   "estimated_cost_usd": estimate}
+
+
+def collect_case(case_name, out_dir, results, errors, entry, profile_generator, template_path):
+    """Turn one case's batch results into the same outputs the interactive mode writes."""
+    custom_id = f"{case_name}/profile"
+    if custom_id not in results:
+        raise ValueError(f"No profile in batch output: {errors.get(custom_id, 'missing')}")
+    # Same repair and source clean-up generate_profile applies to an interactive response, without re-requests
+    profile = profile_generator.repair_profile(results[custom_id], entry.get("doc_type_map", {}))
+    answers = []
+    for i, question in enumerate(entry.get("questions", [])):
+        custom_id = f"{case_name}/answer/{i}"
+        if custom_id not in results:
+            raise ValueError(f"No answer to question {i + 1} in batch output: {errors.get(custom_id, 'missing')}")
+        answers.append({"question": question, "answer": results[custom_id]})
+
+    case_out = Path(out_dir) / case_name
+    case_out.mkdir(parents=True, exist_ok=True)
+    outputs = write_outputs(case_out, profile, answers, template_path)
+    return {"outputs": outputs, "questions": len(answers), "usage": metrics.usage.totals("case", case_name)}
+
+
+def run_interactive(pending, manifest, out_dir, reference_library, document_processor, profile_generator,
+                    template_path, args):
+    """Process cases in parallel with one chat completion per profile and question."""
+    failures = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for case_dir, input_hash in pending:
+            manifest.update(case_dir.name, status="running", input_hash=input_hash, started_at=time.time())
+            future = executor.submit(process_case, case_dir, out_dir, reference_library,
+                                     document_processor, profile_generator, template_path)
+            futures[future] = case_dir
+        for future in as_completed(futures):
+            case_dir = futures[future]
+            try:
+                result = future.result()
+                manifest.update(case_dir.name, status="done", error=None, finished_at=time.time(), **result)
+                print(f"done  {case_dir.name} ({result['duration_s']}s)", file=sys.stderr)
+            except Exception as e:
+                failures += 1
+                manifest.update(case_dir.name, status="failed", error=f"{type(e).__name__}: {e}",
+                                finished_at=time.time())
+                print(f"fail  {case_dir.name}: {e}", file=sys.stderr)
+    return failures
+
+
+def submit_llm_batch(pending, manifest, out_dir, reference_library, document_processor, profile_generator, args):
+    """Extract every pending case, then submit all their LLM requests as one Batch API job."""
+    lines = []
+    submitted = []
+    estimate = 0.0
+    failures = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(prepare_case, case_dir, reference_library, document_processor, profile_generator):
+                   (case_dir, input_hash) for case_dir, input_hash in pending}
+        for future in as_completed(futures):
+            case_dir, input_hash = futures[future]
+            try:
+                case_lines, fields = future.result()
+            except Exception as e:
+                failures += 1
+                manifest.update(case_dir.name, status="failed", input_hash=input_hash,
+                                error=f"{type(e).__name__}: {e}", finished_at=time.time())
+                print(f"fail  {case_dir.name}: {e}", file=sys.stderr)
+                continue
+            lines.extend(case_lines)
+            submitted.append(case_dir.name)
+            estimate += fields["estimated_cost_usd"]
+            manifest.update(case_dir.name, status="submitted", input_hash=input_hash, error=None,
+                            started_at=time.time(), **fields)
+    if not lines:
+        return failures
+
+    requests_path = Path(out_dir) / BATCH_REQUESTS_FILE
+    llm_batch.write_requests(requests_path, lines)
+    batch = llm_batch.submit(profile_generator.client, requests_path, metadata={"source": "batch_cli"})
+    manifest.update_batch(id=batch.id, status=batch.status, cases=sorted(submitted), submitted_at=time.time())
+    print(f"Submitted batch {batch.id} with {len(lines)} request(s) for {len(submitted)} case(s), "
+          f"at most ${estimate:.4f}", file=sys.stderr)
+    return failures
+
+
+def collect_llm_batch(manifest, out_dir, profile_generator, template_path, args):
+    """Wait for the manifest's outstanding batch and fan its results out into per-case outputs."""
+    client = profile_generator.client
+
+    def on_poll(batch):
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total})" if counts and counts.total else ""
+        print(f"batch {batch.id}: {batch.status}{progress}", file=sys.stderr)
+        manifest.update_batch(status=batch.status)
+
+    batch = llm_batch.wait(client, manifest.batch["id"], poll_interval=args.poll_interval, on_poll=on_poll)
+    case_names = manifest.batch.get("cases", [])
+    if batch.status != "completed":
+        for case_name in case_names:
+            manifest.update(case_name, status="failed", error=f"Batch {batch.id} {batch.status}",
+                            finished_at=time.time())
+        manifest.update_batch(status="collected")
+        print(f"Batch {batch.id} ended as {batch.status}", file=sys.stderr)
+        return len(case_names)
+
+    results, errors = llm_batch.read_results(client, batch)
+    failures = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(collect_case, case_name, out_dir, results, errors, manifest.cases.get(case_name, {}),
+                                   profile_generator, template_path): case_name for case_name in case_names}
+        for future in as_completed(futures):
+            case_name = futures[future]
+            try:
+                result = future.result()
+                manifest.update(case_name, status="done", error=None, finished_at=time.time(), **result)
+                print(f"done  {case_name}", file=sys.stderr)
+            except Exception as e:
+                failures += 1
+                manifest.update(case_name, status="failed", error=f"{type(e).__name__}: {e}",
+                                finished_at=time.time())
+                print(f"fail  {case_name}: {e}", file=sys.stderr)
+    manifest.update_batch(status="collected")
+    return failures
+
+
+def write_team_deck(manifest, out_dir, template_path):
+    """Combine the profiles of every done case into one deck at <out>/team_assessment.pptx."""
+    profiles = []
+    for case_name in sorted(manifest.cases):
+        path = out_dir / case_name / "profile.json"
+        if manifest.cases[case_name].get("status") == "done" and path.exists():
+            profiles.append({"name": case_name, "profile": json.loads(path.read_text(encoding="utf-8"))})
+    if not profiles:
+        print("No finished cases for a team deck", file=sys.stderr)
+        return
+    with open(out_dir / "batch.log", "a", encoding="utf-8") as log, redirect_stdout(log):
+        deck = pipeline.render_team_deck(profiles, template_path=template_path)
+    (out_dir / TEAM_DECK_FILE).write_bytes(deck.getvalue())
+    print(f"Team deck of {len(profiles)} profile(s): {out_dir / TEAM_DECK_FILE}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate profiles and decks for a directory of case folders.")
+    parser.add_argument("cases_dir", help="Directory of case folders, each with subject/ and/or context/ and an optional questions.txt")
+    parser.add_argument("--out", default="batch_output", help="Output directory (one subfolder per case)")
+    parser.add_argument("--workers", type=int, default=4, help="Cases processed in parallel")
+    parser.add_argument("--llm-concurrency", type=int, default=2, help="Maximum simultaneous LLM requests, map-reduce digest calls included")
+    parser.add_argument("--force", action="store_true", help="Re-run cases already completed in the manifest")
+    parser.add_argument("--no-reference", action="store_true", help="Send no HowToInterpret reference material")
+    parser.add_argument("--template", default=str(BASE_DIR / "template.pptx"))
+    parser.add_argument("--llm-mode", choices=["interactive", "batch"], default="interactive",
+                        help="batch submits all LLM requests as one OpenAI Batch API job (cheaper, completes within 24h)")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between Batch API status checks")
+    parser.add_argument("--team-deck", action="store_true",
+                        help=f"Also combine every finished case into one deck ({TEAM_DECK_FILE})")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(out_dir / MANIFEST_FILE)
+    template_path = args.template if Path(args.template).exists() else None
+
+    cases = find_cases(args.cases_dir)
+    outstanding_batch = args.llm_mode == "batch" and manifest.batch_outstanding()
+    in_batch = set(manifest.batch.get("cases", [])) if outstanding_batch else set()
+    pending = []
+    for case_dir in cases:
+        input_hash = case_input_hash(case_dir)
+        if not args.force and manifest.is_done(case_dir.name, input_hash):
+            print(f"skip  {case_dir.name} (already done)", file=sys.stderr)
+            continue
+        if case_dir.name in in_batch:
+            continue
+        pending.append((case_dir, input_hash))
+    print(f"{len(pending)} of {len(cases)} case(s) to process", file=sys.stderr)
+    if not pending and not outstanding_batch:
+        if args.team_deck:
+            write_team_deck(manifest, out_dir, template_path)
+        return
+
+    document_processor = DocumentProcessor()
+    # Every request the generator sends takes a slot, so the bound holds when a large case fans out
+    profile_generator = ProfileGenerator(slots=threading.BoundedSemaphore(args.llm_concurrency))
+
+    # Pipeline stages narrate on stdout; keep that in a log and progress on stderr
+    log_path = out_dir / "batch.log"
+    failures = 0
+    with open(log_path, "a", encoding="utf-8") as log, redirect_stdout(log):
+        if outstanding_batch:
+            print(f"Resuming batch {manifest.batch['id']} for {len(in_batch)} case(s)", file=sys.stderr)
+            failures += collect_llm_batch(manifest, out_dir, profile_generator, template_path, args)
+
+        if pending:
+            reference_library = None if args.no_reference else get_library(
+                document_processor, str(BASE_DIR / pipeline.REFERENCE_FOLDER))
+            if args.llm_mode == "batch":
+                failures += submit_llm_batch(pending, manifest, out_dir, reference_library,
+                                             document_processor, profile_generator, args)
+                if manifest.batch_outstanding():
+                    failures += collect_llm_batch(manifest, out_dir, profile_generator, template_path, args)
+            else:
+                failures += run_interactive(pending, manifest, out_dir, reference_library,
+                                            document_processor, profile_generator, template_path, args)
+
+    done = sum(1 for entry in manifest.cases.values() if entry.get("status") == "done")
+    print(f"Finished: {failures} failed, {done} done in total. Manifest: {manifest.path}", file=sys.stderr)
+    if args.team_deck:
+        write_team_deck(manifest, out_dir, template_path)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
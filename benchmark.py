@@ -0,0 +1,545 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# The benchmarks never call the API, but the processor and generator refuse
+# to initialise without a key.
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark-placeholder")
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import PyPDF2
+from document_processor import (PDF_WORKERS, DocumentProcessor, available_pdf_backends, extract_pdf_range,
+                                extract_pdf_parallel, iter_docx_blocks)
+from lexical_index import tokenize
+import pdf_renderer
+import reference_index
+from profile_generator import ProfileGenerator
+from reference_digests import ReferenceLibrary
+from pptx_renderer import clean_source_text, generate_pptx_from_json, generate_team_pptx
+import synthetic_corpus
+
+BASE_DIR = Path(__file__).resolve().parent
+REFERENCE_DIR = BASE_DIR / "HowToInterpret"
+TEMPLATE_PATH = BASE_DIR / "template.pptx"
+
+QUERIES = [
+    "HDS derailers under pressure",
+    "MMPI-2 anxiety T=68",
+    "360 feedback from direct reports",
+    "F41.1 Generalized Anxiety Disorder",
+    "work history and education",
+]
+
+SOURCE_SAMPLES = [
+    "tmpa1b2c3d4.pdf (Hogan), tmpz9y8x7.docx",
+    "Psychological Assessment, tmpq1w2e3.pdf (IDI), 360 review",
+    "CV, tmpabc.pdf (Individual Directions), PDF, DOCX",
+    "Clinical Interview, , Treatment Notes,",
+]
+
+
+def _summarize(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    return {
+        "runs": len(samples),
+        "median_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "min_ms": round(samples[0] * 1000, 3),
+    }
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _pdf_pages(path):
+    with open(path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def load_corpora(workdir, sizes, seed):
+    """Build the synthetic packets and index the HowToInterpret PDFs."""
+    corpora = {}
+    for size in sizes:
+        corpora[f"synthetic_{size}"] = synthetic_corpus.generate_packet(
+            os.path.join(workdir, size), size=size, seed=seed
+        )
+    reference = []
+    for path in sorted(REFERENCE_DIR.glob("*.pdf")):
+        reference.append({
+            "path": str(path),
+            "kind": "reference",
+            "format": "pdf",
+            "pages": _pdf_pages(path),
+            "bytes": path.stat().st_size,
+            "text": None,
+        })
+    corpora["howtointerpret"] = reference
+    return corpora
+
+
+def bench_extraction(ctx):
+    processor = ctx["processor"]
+    results = {}
+    for name, docs in ctx["corpora"].items():
+        pages = sum(d["pages"] for d in docs if d["format"] == "pdf")
+        total_bytes = sum(d["bytes"] for d in docs)
+        texts = []
+
+        def run():
+            texts.clear()
+            for d in docs:
+                texts.append(processor._extract_text(d["path"]))
+
+        samples = _time(run, ctx["repeat"])
+        ctx.setdefault("raw_texts", {})[name] = list(texts)
+        median = statistics.median(samples)
+        results[name] = {
+            **_summarize(samples),
+            "documents": len(docs),
+            "pdf_pages": pages,
+            "bytes": total_bytes,
+            "pages_per_s": round(pages / median, 2) if pages else None,
+            "mb_per_s": round(total_bytes / 1e6 / median, 3),
+        }
+    return results
+
+
+def _token_f1(reference, candidate):
+    ref, cand = Counter(tokenize(reference)), Counter(tokenize(candidate))
+    overlap = sum((ref & cand).values())
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / sum(cand.values()), overlap / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def bench_pdf_backends(ctx):
+    """Throughput of each installed PDF backend on the reference PDFs, and its fidelity against PyPDF2.
+
+    Fidelity is the token-level F1 of each page's text against PyPDF2's text for the
+    same page, so PyPDF2 scores 1.0 by definition; empty_pages counts pages with no text.
+    """
+    docs = ctx["corpora"].get("howtointerpret", [])
+    pages_total = sum(d["pages"] for d in docs)
+    extracted = {}
+    results = {}
+    for backend in available_pdf_backends():
+        def run():
+            extracted[backend] = [extract_pdf_range(backend, d["path"]) for d in docs]
+
+        samples = _time(run, ctx["repeat"])
+        pages = [page for doc in extracted[backend] for page in doc]
+        results[backend] = {
+            **_summarize(samples),
+            "pages": pages_total,
+            "pages_per_s": round(pages_total / statistics.median(samples), 2) if pages_total else None,
+            "chars": sum(len(page) for page in pages),
+            "empty_pages": sum(1 for page in pages if not page.strip()),
+        }
+    reference = [page for doc in extracted.get("pypdf2", []) for page in doc]
+    for backend, result in results.items():
+        pages = [page for doc in extracted[backend] for page in doc]
+        if reference and len(pages) == len(reference):
+            result["token_f1_vs_pypdf2"] = round(statistics.mean(
+                _token_f1(ref, page) for ref, page in zip(reference, pages) if ref.strip()), 4)
+    return results
+
+
+def _large_pdf(workdir, min_pages=400):
+    """One large PDF made by concatenating the reference PDFs until it has min_pages pages."""
+    path = os.path.join(workdir, f"large_{min_pages}.pdf")
+    if not os.path.exists(path):
+        writer = PyPDF2.PdfWriter()
+        sources = sorted(REFERENCE_DIR.glob("*.pdf"))
+        while sources and len(writer.pages) < min_pages:
+            for source in sources:
+                writer.append(str(source))
+        os.makedirs(workdir, exist_ok=True)
+        with open(path, "wb") as f:
+            writer.write(f)
+    return path
+
+
+def bench_pdf_parallel(ctx):
+    """Serial versus page-range parallel extraction of one large PDF, per backend."""
+    path = _large_pdf(ctx["workdir"])
+    pages = _pdf_pages(path)
+    results = {"pages": pages, "workers": PDF_WORKERS}
+    for backend in available_pdf_backends():
+        extract = lambda path, backend=backend: extract_pdf_range(backend, path)
+        serial_pages = extract(path)
+        # The first parallel run starts the worker processes; keep that out of the timings
+        parallel_pages = extract_pdf_parallel(backend, path, pages)
+        serial = _time(lambda: extract(path), ctx["repeat"])
+        parallel = _time(lambda: extract_pdf_parallel(backend, path, pages), ctx["repeat"])
+        results[backend] = {
+            "serial": _summarize(serial),
+            "parallel": _summarize(parallel),
+            "serial_pages_per_s": round(pages / statistics.median(serial), 2),
+            "parallel_pages_per_s": round(pages / statistics.median(parallel), 2),
+            "speedup": round(statistics.median(serial) / statistics.median(parallel), 2),
+            "identical": serial_pages == parallel_pages,
+        }
+    return results
+
+
+def _python_docx_blocks(path):
+    # The previous extractor: the whole DOM, paragraphs only
+    from docx import Document
+    return [paragraph.text for paragraph in Document(path).paragraphs]
+
+
+def _streaming_docx_blocks(path):
+    return list(iter_docx_blocks(path))
+
+
+DOCX_EXTRACTORS = {"python_docx": _python_docx_blocks, "streaming": _streaming_docx_blocks}
+
+
+def _proc_status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+
+
+def _docx_peak_rss_kb(extractor, path):
+    # Runs in a fresh process, with the kernel's RSS high-water mark reset after imports
+    # (Linux only; ru_maxrss would carry over the parent's peak through exec)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+    before = _proc_status_kb("VmRSS")
+    DOCX_EXTRACTORS[extractor](path)
+    return _proc_status_kb("VmHWM") - before
+
+
+def bench_docx(ctx):
+    """python-docx against streaming DOCX extraction: time, line recall of the ground truth, and peak memory.
+
+    Runs over the synthetic packets' DOCX files plus one 400-page report. Line recall
+    counts ground-truth lines (paragraphs and score table rows) found in the output.
+    """
+    docs = [d for docs in ctx["corpora"].values() for d in docs if d["format"] == "docx"]
+    docs.append(synthetic_corpus.generate_document(ctx["workdir"], "performance", "docx", 400, seed=ctx["seed"]))
+    largest = max(docs, key=lambda d: d["bytes"])
+    results = {"documents": len(docs), "bytes": sum(d["bytes"] for d in docs), "largest_bytes": largest["bytes"]}
+    for name, extract in DOCX_EXTRACTORS.items():
+        outputs = []
+
+        def run():
+            outputs.clear()
+            outputs.extend(extract(d["path"]) for d in docs)
+
+        samples = _time(run, ctx["repeat"])
+        found = total = 0
+        for d, blocks in zip(docs, outputs):
+            extracted = set(blocks)
+            lines = [line for line in d["text"].splitlines() if line]
+            found += sum(1 for line in lines if line in extracted)
+            total += len(lines)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            peak_kb = pool.submit(_docx_peak_rss_kb, name, largest["path"]).result()
+        results[name] = {**_summarize(samples), "mb_per_s": round(results["bytes"] / 1e6 / statistics.median(samples), 3),
+                         "line_recall": round(found / total, 4) if total else None,
+                         "largest_peak_rss_kb": peak_kb}
+    return results
+
+
+def bench_cleaning(ctx):
+    processor = ctx["processor"]
+    results = {}
+    for name, texts in ctx.get("raw_texts", {}).items():
+        cleaned = []
+
+        def run():
+            cleaned.clear()
+            for text in texts:
+                for cleaner in processor.text_cleaners:
+                    text = cleaner(text)
+                cleaned.append(text)
+
+        samples = _time(run, ctx["repeat"])
+        ctx.setdefault("clean_texts", {})[name] = list(cleaned)
+        chars = sum(len(t) for t in texts)
+        results[name] = {**_summarize(samples), "chars": chars,
+                         "mchars_per_s": round(chars / 1e6 / statistics.median(samples), 3)}
+    return results
+
+
+def bench_source_cleaning(ctx):
+    rounds = 200
+    samples = _time(lambda: [clean_source_text(s) for _ in range(rounds) for s in SOURCE_SAMPLES], ctx["repeat"])
+    return {**_summarize(samples), "calls_per_run": rounds * len(SOURCE_SAMPLES)}
+
+
+def bench_vector_store(ctx):
+    from vector_store import VectorStore
+
+    store = VectorStore()
+    results = {}
+    for name, texts in ctx.get("clean_texts", {}).items():
+        insert = _time(lambda: store.store_documents(texts), ctx["repeat"])
+        queries = {}
+        for mode in ("vector", "lexical", "hybrid"):
+            samples = []
+            for _ in range(ctx["repeat"]):
+                for q in QUERIES:
+                    samples.extend(_time(lambda: store.get_relevant_chunks(q, n_results=5, mode=mode), 1))
+            queries[mode] = _summarize(samples)
+        results[name] = {"insert": _summarize(insert), "query": queries["vector"], "query_lexical": queries["lexical"],
+                         "query_hybrid": queries["hybrid"], "documents": len(texts)}
+    return results
+
+
+def bench_profile_prompt(ctx):
+    generator = ctx["generator"]
+    results = {}
+    for name, texts in ctx.get("clean_texts", {}).items():
+        metadata = [{"file_type": d["format"], "file_name": os.path.basename(d["path"])}
+                    for d in ctx["corpora"][name]]
+        detection = _time(lambda: generator.detect_assessment_types(texts), ctx["repeat"])
+        assembly = _time(lambda: generator._build_profile_prompt(texts, metadata), ctx["repeat"])
+        results[name] = {"detection": _summarize(detection), "prompt_assembly": _summarize(assembly),
+                         "chars": sum(len(t) for t in texts)}
+    return results
+
+
+def bench_pptx(ctx):
+    profile = synthetic_corpus.sample_profile()
+    template = str(TEMPLATE_PATH) if TEMPLATE_PATH.exists() else None
+    # The renderer narrates every slide on stdout; keep the benchmark output readable
+    devnull = open(os.devnull, "w")
+    original_stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        with_template = _time(lambda: generate_pptx_from_json(profile, template_path=template), ctx["repeat"])
+        blank = _time(lambda: generate_pptx_from_json(profile, template_path=None), ctx["repeat"])
+    finally:
+        sys.stdout = original_stdout
+        devnull.close()
+    return {"template": _summarize(with_template), "blank": _summarize(blank)}
+
+
+def bench_pdf_report(ctx):
+    profile = synthetic_corpus.sample_profile()
+    answers = [{"question": "Would CBT suit this client?", "answer": "Consider a structured, time-limited course."}]
+
+    font_dir = next(d for d in pdf_renderer.FONT_DIRS if (d / pdf_renderer.FONT_FILES[""]).exists())
+    shared_add_fonts = pdf_renderer._add_fonts
+
+    def add_fonts_per_report(pdf):
+        # What every export paid before: parse the full TTF files again
+        for style, name in pdf_renderer.FONT_FILES.items():
+            pdf.add_font(pdf_renderer.FONT_FAMILY, style, str(font_dir / name))
+        return True
+
+    def fresh(add_fonts):
+        pdf_renderer._add_fonts = add_fonts
+        pdf_renderer._cache.clear()
+        try:
+            return pdf_renderer.render_pdf(profile, answers)
+        finally:
+            pdf_renderer._add_fonts = shared_add_fonts
+
+    fresh(shared_add_fonts)  # Loads the shared fonts outside the timings
+    font_per_report = _time(lambda: fresh(add_fonts_per_report), ctx["repeat"])
+    shared_fonts = _time(lambda: fresh(shared_add_fonts), ctx["repeat"])
+    cached = _time(lambda: pdf_renderer.render_pdf(profile, answers), ctx["repeat"])
+    return {"font_per_report": _summarize(font_per_report), "shared_fonts": _summarize(shared_fonts),
+            "cached": _summarize(cached), "bytes": len(pdf_renderer.render_pdf(profile, answers))}
+
+
+def bench_pptx_team(ctx):
+    profile = synthetic_corpus.sample_profile()
+    template = str(TEMPLATE_PATH) if TEMPLATE_PATH.exists() else None
+    results = {}
+    devnull = open(os.devnull, "w")
+    original_stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        for n in (1, 2, 4, 8):
+            profiles = [{"name": f"Person {i + 1}", "profile": profile} for i in range(n)]
+            team = _time(lambda: generate_team_pptx(profiles, template_path=template), ctx["repeat"])
+            separate = _time(lambda: [generate_pptx_from_json(profile, template_path=template) for _ in range(n)],
+                             ctx["repeat"])
+            results[n] = {"team_deck": _summarize(team), "separate_decks": _summarize(separate)}
+    finally:
+        sys.stdout = original_stdout
+        devnull.close()
+    # Cost of each profile added to a team deck, beyond the first
+    results["ms_per_added_profile"] = round(
+        (results[8]["team_deck"]["median_ms"] - results[1]["team_deck"]["median_ms"]) / 7, 2)
+    return results
+
+
+def bench_reference_index(ctx):
+    # A copy of the manuals, so building the index here leaves HowToInterpret/ as it is
+    folder = Path(ctx["workdir"]) / "reference_index"
+    folder.mkdir(parents=True, exist_ok=True)
+    for path in sorted(REFERENCE_DIR.glob("*.pdf")):
+        target = folder / path.name
+        if not target.exists():
+            target.write_bytes(path.read_bytes())
+    everything = ["hogan hpi disc mbti strengthsfinder individual directions inventory"]
+
+    def first_case():
+        # What the first case after a restart pays: a new library, then its first selection
+        return ReferenceLibrary(ctx["processor"], str(folder)).select(everything)
+
+    index_dir = folder / reference_index.INDEX_FOLDER
+    for path in index_dir.glob("*"):
+        path.unlink()
+    cold = _time(first_case, ctx["repeat"])
+    build = _time(lambda: reference_index.build_index(ctx["processor"], str(folder), force=True), 1)
+    indexed = _time(first_case, ctx["repeat"])
+    return {"cold_extract": _summarize(cold), "cold_indexed": _summarize(indexed), "build": _summarize(build),
+            "manuals": len(list(folder.glob("*.pdf")))}
+
+
+# Stages run in this order; later stages reuse texts produced by earlier ones
+STAGES = {
+    "extraction": bench_extraction,
+    "pdf_backends": bench_pdf_backends,
+    "pdf_parallel": bench_pdf_parallel,
+    "docx": bench_docx,
+    "cleaning": bench_cleaning,
+    "source_cleaning": bench_source_cleaning,
+    "vector_store": bench_vector_store,
+    "profile_prompt": bench_profile_prompt,
+    "pptx": bench_pptx,
+    "pdf_report": bench_pdf_report,
+    "pptx_team": bench_pptx_team,
+    "reference_index": bench_reference_index,
+}
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, sub in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, sub, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare(previous, current, threshold):
+    """Print metric deltas and return the list of regressions beyond threshold."""
+    old = _flatten("", previous["results"], {})
+    new = _flatten("", current["results"], {})
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        if key.endswith(("_ms",)):
+            lower_is_better = True
+        elif key.endswith(("_per_s",)):
+            lower_is_better = False
+        else:
+            continue
+        if not old[key]:
+            continue
+        change = (new[key] - old[key]) / old[key]
+        worse = change > threshold if lower_is_better else change < -threshold
+        marker = "REGRESSION" if worse else ""
+        print(f"{key:<60} {old[key]:>12} -> {new[key]:>12} ({change:+.1%}) {marker}")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the document and rendering pipeline.")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to run")
+    parser.add_argument("--sizes", default="small,medium,large", help="Synthetic packet sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", default="bench_corpus", help="Where synthetic packets are written")
+    parser.add_argument("--output", help="Results JSON path (default bench_results/<revision>.json)")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change flagged as a regression")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}")
+
+    revision = _git_revision()
+    ctx = {
+        "repeat": args.repeat,
+        "workdir": args.workdir,
+        "seed": args.seed,
+        "processor": DocumentProcessor(),
+        "generator": ProfileGenerator(),
+        "corpora": load_corpora(args.workdir, [s for s in args.sizes.split(",") if s], args.seed),
+    }
+
+    results = {}
+    for stage in STAGES:
+        # Extraction and cleaning feed later stages, so run them whenever something downstream needs texts
+        needed = stage in stages or (stage in ("extraction", "cleaning") and
+                                     any(s in stages for s in ("cleaning", "vector_store", "profile_prompt")))
+        if not needed:
+            continue
+        print(f"Running {stage}...")
+        try:
+            output = STAGES[stage](ctx)
+        except Exception as e:
+            print(f"Stage {stage} failed: {e}")
+            output = {"error": f"{type(e).__name__}: {e}"}
+        if stage in stages:
+            results[stage] = output
+
+    report = {
+        "meta": {
+            "revision": revision,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    output_path = Path(args.output or BASE_DIR / "bench_results" / f"{revision}.json")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {output_path}")
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text())
+        regressions = compare(previous, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
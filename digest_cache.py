@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class DigestCache:
+    """Evidence digests keyed by document hash, kept in memory and optionally on disk.
+
+    Digests summarise client documents, so they are only written to disk when a
+    directory is configured (DIGEST_CACHE_DIR); otherwise they live for the process.
+    """
+
+    def __init__(self, directory=None, max_entries=1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(text, model, instructions):
+        """Hash of the document text and everything that shapes its digest."""
+        digest = hashlib.sha256()
+        for part in (model, instructions, text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if self.directory and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    value = json.load(f)["digest"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable digest cache entry {key}: {e}")
+                return None
+            self._remember(key, value)
+            return value
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.directory:
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"digest": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -1,11 +1,196 @@
 import PyPDF2
-from docx import Document
 import re
 import os
+import math
+import multiprocessing
+import threading
+import zipfile
+from lxml import etree
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from openai import OpenAI
+import metrics
+
+try:
+    import pypdfium2
+except ImportError:  # Optional native PDF backend; PyPDF2 is always available
+    pypdfium2 = None
+
+class DocumentExtractionError(ValueError):
+    """A document could not be read: corrupt, encrypted, or not really the PDF or DOCX it claims to be."""
+
+    def __init__(self, file_name, reason):
+        super().__init__(f"Could not extract text from {file_name}: {reason}")
+        self.file_name = file_name
+        self.reason = reason
+
+# DOCX files have no fixed pages; they are chunked into sections of this size instead
+DOCX_SECTION_CHARS = 3000
+
+# WordprocessingML element names
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# PDF text backend: "pdfium" (native, much faster), "pypdf2", or "auto" for the fastest installed
+PDF_BACKEND = os.getenv("PDF_BACKEND", "auto")
+
+# PDFs with at least this many pages are split into page ranges extracted in worker processes
+PDF_PARALLEL_PAGES = int(os.getenv("PDF_PARALLEL_PAGES", "150"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+
+# PDFium allows only one thread in the library at a time, even for different documents. The lock is
+# held per PDFium call (open, one page's text, close), not per document, so sessions and batch workers
+# extracting concurrently interleave page by page; file reads and string handling run outside it
+_pdfium_lock = threading.Lock()
+
+def _pypdf2_pages(file_path, start=0, stop=None, split_from=None):
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        count = len(pdf_reader.pages)
+        if split_from is not None and count >= split_from:
+            return count, None
+        return count, [page.extract_text() + "\n" for page in pdf_reader.pages[start:stop]]
+
+def _pdfium_pages(file_path, start=0, stop=None, split_from=None):
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    with _pdfium_lock:
+        pdf = pypdfium2.PdfDocument(data)
+        count = len(pdf)
+    try:
+        if split_from is not None and count >= split_from:
+            return count, None
+        pages = []
+        for index in range(*slice(start, stop).indices(count)):
+            with _pdfium_lock:
+                page = pdf[index]
+                textpage = page.get_textpage()
+                text = textpage.get_text_bounded()
+                textpage.close()
+                page.close()
+            pages.append(text.replace("\r\n", "\n") + "\n")
+        return count, pages
+    finally:
+        with _pdfium_lock:
+            pdf.close()
+
+# Backends in order of preference for "auto". Each is read(path, start, stop, split_from) and returns
+# (page count, pages[start:stop]), with pages None when the PDF has split_from pages or more, so the
+# caller can split it across workers; the count comes from the same open document as the text
+PDF_BACKENDS = {
+    "pdfium": _pdfium_pages,
+    "pypdf2": _pypdf2_pages,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Return the process-wide extraction pool, creating it once.
+
+    Workers are spawned rather than forked, since the parent has threads (Streamlit,
+    Chroma, batch workers) that a fork would copy mid-flight.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+def extract_pdf_range(backend, file_path, start=0, stop=None):
+    """Text of pages [start:stop] of a PDF with one backend, one string per page."""
+    return PDF_BACKENDS[backend](file_path, start, stop)[1]
+
+def _paragraph_text(paragraph):
+    parts = []
+    for node in paragraph.iter(W + "t", W + "tab", W + "br", W + "cr"):
+        if node.tag == W + "t":
+            parts.append(node.text or "")
+        elif node.tag == W + "tab":
+            parts.append("\t")
+        else:
+            parts.append("\n")
+    return "".join(parts)
+
+def iter_docx_blocks(file_path):
+    """Yield a DOCX file's paragraphs and table rows as text, in document order.
+
+    word/document.xml is parsed incrementally straight from the zip, and each block
+    is freed once read, so memory stays flat however large the document. A table row
+    is its cells joined by " | "; a nested table's rows are part of the enclosing cell.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml:
+        cells = []  # text parts of each open table cell, innermost last
+        rows = []  # cell texts of each open table row, innermost last
+        for event, element in etree.iterparse(xml, events=("start", "end"),
+                                              tag=(W + "p", W + "tc", W + "tr")):
+            if event == "start":
+                if element.tag == W + "tr":
+                    rows.append([])
+                elif element.tag == W + "tc":
+                    cells.append([])
+                continue
+            if element.tag == W + "p":
+                text = _paragraph_text(element)
+                if cells:
+                    cells[-1].append(text)
+                    element.clear()
+                    continue
+                block = text
+            elif element.tag == W + "tc":
+                rows[-1].append(" ".join(part for part in cells.pop() if part))
+                continue
+            else:
+                row = " | ".join(rows.pop())
+                if cells:
+                    cells[-1].append(row)
+                    continue
+                block = row
+            # A finished top-level block: free it and everything before it
+            element.clear()
+            parent = element.getparent()
+            while element.getprevious() is not None:
+                del parent[0]
+            yield block
+
+def page_ranges(page_count, workers):
+    """Split page_count pages into contiguous (start, stop) ranges, two per worker for load balance."""
+    size = max(1, math.ceil(page_count / (workers * 2)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+def extract_pdf_parallel(backend, file_path, page_count, workers=PDF_WORKERS):
+    """Extract a PDF's pages by range in worker processes and stitch them back in page order."""
+    ranges = page_ranges(page_count, workers)
+    futures = [_get_pool().submit(extract_pdf_range, backend, file_path, start, stop) for start, stop in ranges]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    metrics.annotate(ranges=len(ranges))
+    return pages
+
+def available_pdf_backends():
+    """Names of the PDF backends installed here, fastest first."""
+    return [name for name in PDF_BACKENDS if name != "pdfium" or pypdfium2 is not None]
+
+def resolve_pdf_backend(name=None):
+    """Backend to use for a requested name; an uninstalled backend falls back to PyPDF2."""
+    name = (name or PDF_BACKEND).lower()
+    if name == "auto":
+        return available_pdf_backends()[0]
+    if name not in PDF_BACKENDS:
+        raise ValueError(f"Unknown PDF backend '{name}'; choose auto, {', '.join(PDF_BACKENDS)}")
+    if name not in available_pdf_backends():
+        print(f"PDF backend '{name}' is not installed; using pypdf2")
+        return "pypdf2"
+    return name
 
 class DocumentProcessor:
-    def __init__(self):
+    def __init__(self, pdf_backend: str = None):
+        self.pdf_backend = resolve_pdf_backend(pdf_backend)
         self.text_cleaners = [
             self._remove_headers_footers,
             self._remove_extra_whitespace,
@@ -18,37 +203,94 @@ class DocumentProcessor:
     
     def process_document(self, file_path):
         """Process a document and return cleaned text and metadata."""
-        text = self._extract_text(file_path)
-        for cleaner in self.text_cleaners:
-            text = cleaner(text)
+        pages, metadata = self.process_document_pages(file_path)
+        return " ".join(page for page in pages if page), metadata
+
+    def process_document_pages(self, file_path):
+        """Process a document and return its cleaned text page by page, with metadata.
+
+        DOCX files have no pages, so they are split into sections of about DOCX_SECTION_CHARS.
+        Raises DocumentExtractionError if the file cannot be parsed.
+        """
+        file_type = file_path.split('.')[-1].lower()
+        labels = {"backend": self.pdf_backend} if file_type == "pdf" else {}
+        with metrics.span("extract", file_type=file_type, **labels) as span:
+            span.record(bytes=os.path.getsize(file_path))
+            try:
+                pages = self._extract_pages(file_path)
+            except ValueError:
+                raise
+            except Exception as e:
+                # PdfReadError, PdfiumError, BadZipFile, XMLSyntaxError, ... depending on the parser
+                raise DocumentExtractionError(os.path.basename(file_path), f"{type(e).__name__}: {e}") from e
+        with metrics.span("clean") as span:
+            span.record(chars=sum(len(page) for page in pages))
+            cleaned = []
+            for text in pages:
+                for cleaner in self.text_cleaners:
+                    text = cleaner(text)
+                cleaned.append(text)
         metadata = {
-            "file_type": file_path.split('.')[-1].lower(),
+            "file_type": file_type,
             "file_name": os.path.basename(file_path)
         }
-        return text, metadata
+        return cleaned, metadata
     
     def _extract_text(self, file_path):
         """Extract text from PDF or DOCX file."""
+        return "\n".join(self._extract_pages(file_path))
+
+    def _extract_pages(self, file_path):
+        """Extract text from PDF or DOCX file as a list of pages."""
         if file_path.lower().endswith('.pdf'):
-            return self._extract_pdf_text(file_path)
+            return self._extract_pdf_pages(file_path)
         elif file_path.lower().endswith('.docx'):
-            return self._extract_docx_text(file_path)
+            return self._extract_docx_sections(file_path)
         else:
             raise ValueError("Unsupported file format")
     
-    def _extract_pdf_text(self, file_path):
-        """Extract text from PDF file."""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+    def _extract_pdf_pages(self, file_path):
+        """Extract text from PDF file, one string per page, falling back to PyPDF2 if the backend fails."""
+        backend = self.pdf_backend
+        try:
+            pages = self._read_pdf(backend, file_path)
+        except Exception as e:
+            if backend == "pypdf2":
+                raise
+            print(f"PDF backend {backend} failed on {os.path.basename(file_path)} ({e}); falling back to pypdf2")
+            metrics.registry.inc("pdf_backend_fallback_total", backend=backend)
+            backend = "pypdf2"
+            pages = self._read_pdf(backend, file_path)
+        metrics.annotate(pages=len(pages), backend=backend)
+        return pages
+
+    def _read_pdf(self, backend, file_path):
+        """Pages of a PDF; large ones are split into page ranges extracted concurrently in worker processes."""
+        count, pages = PDF_BACKENDS[backend](file_path, split_from=PDF_PARALLEL_PAGES if PDF_WORKERS > 1 else None)
+        if pages is not None:
+            return pages
+        try:
+            return extract_pdf_parallel(backend, file_path, count)
+        except BrokenProcessPool as e:
+            print(f"PDF worker pool failed ({e}); extracting {os.path.basename(file_path)} in-process")
+            _reset_pool()
+        return extract_pdf_range(backend, file_path)
     
-    def _extract_docx_text(self, file_path):
-        """Extract text from DOCX file."""
-        doc = Document(file_path)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+    def _extract_docx_sections(self, file_path):
+        """Extract text from DOCX file (paragraphs and table rows), grouped into sections of about DOCX_SECTION_CHARS."""
+        sections = []
+        current = []
+        size = 0
+        for block in iter_docx_blocks(file_path):
+            if current and size + len(block) > DOCX_SECTION_CHARS:
+                sections.append("\n".join(current))
+                current = []
+                size = 0
+            current.append(block)
+            size += len(block) + 1
+        if current or not sections:
+            sections.append("\n".join(current))
+        return sections
     
     def _remove_headers_footers(self, text):
         """Remove common header and footer patterns."""
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+import metrics
+
+# Ceiling on the text held for all sessions; past it, least recently active sessions are evicted
+MAX_BYTES = int(float(os.getenv("DOCUMENT_STORE_MAX_MB", "512")) * 1024 * 1024)
+# Sessions untouched for this long release their documents
+IDLE_SECONDS = float(os.getenv("DOCUMENT_STORE_IDLE_MINUTES", "60")) * 60
+
+
+class DocumentEvicted(KeyError):
+    """A session asked for document text that was evicted; the case must be submitted again."""
+
+
+def text_key(text: str) -> str:
+    """Content address of a document's text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocumentStore:
+    """Process-wide document text, stored once per distinct content and reference-counted by session.
+
+    Sessions keep only keys. A text is dropped when no session holds it any more,
+    which happens when a session releases it, goes idle, or is evicted to stay
+    under the memory ceiling. Sessions in the middle of a request (see active())
+    are never evicted; the store goes over its ceiling until they finish.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, idle_seconds=IDLE_SECONDS):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._texts = {}
+        self._sizes = {}
+        self._refs = {}  # key -> number of sessions holding it
+        self._sessions = {}  # session id -> set of keys
+        self._last_seen = {}  # session id -> time of last activity
+        self._active = {}  # session id -> number of requests using it right now
+        self._bytes = 0
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+    def on_evict(self, name: str, callback):
+        """Call callback(session_id) whenever a session is evicted; re-registering a name replaces it."""
+        with self._lock:
+            self._listeners[name] = callback
+
+    def put(self, session_id: str, text: str) -> str:
+        """Store text for a session (once per distinct text) and return its key."""
+        key = text_key(text)
+        evicted = []
+        with self._lock:
+            self._last_seen[session_id] = time.time()
+            held = self._sessions.setdefault(session_id, set())
+            if key not in held:
+                held.add(key)
+                if key not in self._texts:
+                    self._texts[key] = text
+                    self._sizes[key] = _size(text)
+                    self._bytes += self._sizes[key]
+                self._refs[key] = self._refs.get(key, 0) + 1
+            if self._bytes > self.max_bytes:
+                evicted = self._evict_for_ceiling(session_id)
+        self._notify(evicted, "ceiling")
+        return key
+
+    def put_many(self, session_id: str, texts: List[str]) -> List[str]:
+        return [self.put(session_id, text) for text in texts]
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            if key not in self._texts:
+                raise DocumentEvicted(key)
+            return self._texts[key]
+
+    def get_many(self, keys: List[str]) -> List[str]:
+        return [self.get(key) for key in keys]
+
+    def has_all(self, keys: List[str]) -> bool:
+        with self._lock:
+            return all(key in self._texts for key in keys)
+
+    def retain(self, session_id: str, keys: List[str]):
+        """Release every text the session holds except those in keys."""
+        with self._lock:
+            keep = set(keys)
+            held = self._sessions.get(session_id, set())
+            for key in held - keep:
+                self._release_key(key)
+            self._sessions[session_id] = held & keep
+
+    def release(self, session_id: str):
+        """Release all of a session's texts and forget the session."""
+        with self._lock:
+            self._release_session(session_id)
+
+    def touch(self, session_id: str):
+        with self._lock:
+            self._last_seen[session_id] = time.time()
+
+    @contextmanager
+    def active(self, session_id: str):
+        """Pin a session for the length of a request, so neither idle nor ceiling eviction releases it meanwhile.
+
+        When the last request on a session ends, the ceiling is enforced again.
+        """
+        with self._lock:
+            self._active[session_id] = self._active.get(session_id, 0) + 1
+        try:
+            yield
+        finally:
+            evicted = []
+            with self._lock:
+                self._active[session_id] -= 1
+                if not self._active[session_id]:
+                    del self._active[session_id]
+                    if self._bytes > self.max_bytes:
+                        evicted = self._evict_for_ceiling(session_id)
+            self._notify(evicted, "ceiling")
+
+    def evict_idle(self, now: float = None) -> int:
+        """Release sessions idle for longer than idle_seconds, unless in use; returns how many."""
+        now = time.time() if now is None else now
+        with self._lock:
+            idle = [s for s, seen in self._last_seen.items()
+                    if now - seen > self.idle_seconds and s not in self._active]
+            for session_id in idle:
+                self._release_session(session_id)
+        self._notify(idle, "idle")
+        return len(idle)
+
+    def session_bytes(self, session_id: str) -> dict:
+        """Text bytes a session references: all of them, and its share with texts split between holders."""
+        with self._lock:
+            held = self._sessions.get(session_id, set())
+            total = sum(self._sizes[key] for key in held)
+            share = sum(self._sizes[key] / self._refs[key] for key in held)
+            return {"documents": len(held), "bytes": total, "shared_bytes": total - round(share),
+                    "attributed_bytes": round(share)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "documents": len(self._texts), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes}
+
+    def _evict_for_ceiling(self, current_session):
+        # Least recently active first; never the session that is storing right now, nor one mid-request
+        candidates = sorted((seen, s) for s, seen in self._last_seen.items()
+                            if s != current_session and s not in self._active)
+        evicted = []
+        for _, session_id in candidates:
+            if self._bytes <= self.max_bytes:
+                break
+            self._release_session(session_id)
+            evicted.append(session_id)
+        if self._bytes > self.max_bytes:
+            print(f"Document store holds {self._bytes} bytes for sessions in use, above its {self.max_bytes}-byte ceiling")
+        return evicted
+
+    def _notify(self, evicted, reason):
+        # Outside the lock: listeners may do slow work such as dropping a vector store
+        if not evicted:
+            return
+        metrics.registry.inc("document_store_evictions_total", len(evicted), reason=reason)
+        with self._lock:
+            listeners = list(self._listeners.values())
+        for session_id in evicted:
+            for callback in listeners:
+                try:
+                    callback(session_id)
+                except Exception as e:
+                    print(f"Eviction listener failed for session {session_id}: {e}")
+
+    def _release_session(self, session_id):
+        for key in self._sessions.pop(session_id, set()):
+            self._release_key(key)
+        self._last_seen.pop(session_id, None)
+
+    def _release_key(self, key):
+        self._refs[key] -= 1
+        if not self._refs[key]:
+            del self._refs[key]
+            del self._texts[key]
+            self._bytes -= self._sizes.pop(key)
+
+
+def _size(text):
+    # Bytes of UTF-8; close to what CPython holds for mostly-ASCII text
+    return len(text.encode("utf-8"))
+
+
+# Shared by every session in the process
+store = DocumentStore()
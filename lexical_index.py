@@ -0,0 +1,134 @@
+import math
+import re
+import threading
+from collections import Counter
+from typing import List
+
+# Keeps clinical tokens such as "mmpi-2", "t=68", "f41.1" and "360°" whole
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-=.:/][a-z0-9]+)*°?")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased lexical tokens, with clinical codes and scores kept as single tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """In-memory inverted index over chunks, scored with Okapi BM25.
+
+    Postings are updated per chunk on add/remove, so inserts never rebuild the index.
+    Metadata values have postings too, so filtered searches only score matching chunks.
+    """
+
+    def __init__(self):
+        self.postings = {}  # term -> {chunk id: term frequency}
+        self.lengths = {}  # chunk id -> token count
+        self.documents = {}
+        self.metadatas = {}
+        self.fields = {}  # (metadata key, value) -> set of chunk ids
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[dict] = None):
+        """Index chunks under the given ids, replacing any already indexed under the same id."""
+        metadatas = metadatas or [{}] * len(ids)
+        with self._lock:
+            for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                if chunk_id in self.documents:
+                    self._remove(chunk_id)
+                counts = Counter(tokenize(document))
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = tf
+                length = sum(counts.values())
+                self.lengths[chunk_id] = length
+                self.total_length += length
+                self.documents[chunk_id] = document
+                self.metadatas[chunk_id] = metadata or {}
+                for key, value in (metadata or {}).items():
+                    self.fields.setdefault((key, value), set()).add(chunk_id)
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            for chunk_id in ids:
+                if chunk_id in self.documents:
+                    self._remove(chunk_id)
+
+    def _remove(self, chunk_id):
+        for term in set(tokenize(self.documents.pop(chunk_id))):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(chunk_id)
+        for field in self.metadatas.pop(chunk_id).items():
+            ids = self.fields.get(field)
+            if ids is not None:
+                ids.discard(chunk_id)
+                if not ids:
+                    del self.fields[field]
+
+    def clear(self):
+        with self._lock:
+            self.postings.clear()
+            self.lengths.clear()
+            self.documents.clear()
+            self.metadatas.clear()
+            self.fields.clear()
+            self.total_length = 0
+
+    def _candidates(self, filters):
+        """Ids of the chunks matching every filter (a list matches any of its values), or None if nothing is filtered."""
+        candidates = None
+        for key, value in filters.items():
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            ids = set().union(*(self.fields.get((key, v), ()) for v in values))
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, query: str, n_results: int = 5, **filters) -> List[tuple]:
+        """Top chunks for query as (chunk id, score), best first, restricted to chunks matching filters."""
+        with self._lock:
+            n = len(self.documents)
+            if not n:
+                return []
+            candidates = self._candidates(filters)
+            if candidates is not None and not candidates:
+                return []
+            avg_length = self.total_length / n
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                # idf stays corpus-wide, so a filter changes which chunks rank, not their scores
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                if candidates is None:
+                    matched = postings.items()
+                elif len(candidates) < len(postings):
+                    matched = [(i, postings[i]) for i in candidates if i in postings]
+                else:
+                    matched = [(i, tf) for i, tf in postings.items() if i in candidates]
+                for chunk_id, tf in matched:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:n_results]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[tuple]:
+    """Fuse several ranked id lists into one (id, score) ranking, scoring each id by the sum of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
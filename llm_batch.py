@@ -0,0 +1,99 @@
+import io
+import json
+import time
+
+import metrics
+from model_router import router
+from profile_generator import DEFAULT_MODEL, ProfileGenerator
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def batch_line(custom_id, task, messages, params):
+    """One Batch API request line for a task, with the same body and prompt preflight as the interactive path.
+
+    A prompt over the model's context window is trimmed or rejected (PromptTooLarge) before it
+    is queued. Returns (line, estimated cost in USD), assuming the reply uses all of max_tokens.
+    """
+    params = dict(params)
+    params.pop("timeout", None)  # A client option, not part of the request body
+    model, tier = ProfileGenerator._route(task, params)
+    messages, prompt_tokens = ProfileGenerator._preflight(task, model, messages, params)
+    metrics.registry.inc("llm_batch_prompt_tokens_est_total", prompt_tokens, model=model, tier=tier)
+    cost = router.cost(model, prompt_tokens, 0, params.get("max_tokens") or 0, batch=True)
+    line = {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "messages": messages, **params},
+    }
+    return line, cost
+
+
+def write_requests(path, lines):
+    """Serialise request lines to the JSONL input file the Batch API expects."""
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def submit(client, path, metadata=None):
+    """Upload a JSONL request file and start a batch over it; returns the batch object."""
+    with metrics.span("llm_batch_submit") as span:
+        with open(path, "rb") as f:
+            data = f.read()
+        span.record(bytes=len(data), requests=data.count(b"\n"))
+        input_file = client.files.create(file=(str(path).rsplit("/", 1)[-1], io.BytesIO(data)), purpose="batch")
+        return client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                     completion_window=COMPLETION_WINDOW, metadata=metadata)
+
+
+def wait(client, batch_id, poll_interval=30.0, timeout=None, on_poll=None):
+    """Poll a batch until it reaches a terminal status; returns the final batch object."""
+    start = time.time()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if on_poll is not None:
+            on_poll(batch)
+        if batch.status in TERMINAL_STATUSES:
+            metrics.registry.observe("llm_batch_wait_seconds", time.time() - start, status=batch.status)
+            return batch
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout:.0f}s")
+        time.sleep(poll_interval)
+
+
+def read_results(client, batch):
+    """Return ({custom_id: content}, {custom_id: error message}) for a finished batch."""
+    results = {}
+    errors = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for raw in client.files.content(file_id).text.splitlines():
+            if not raw.strip():
+                continue
+            item = json.loads(raw)
+            custom_id = item["custom_id"]
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or response.get("body", {}).get("error") or {}
+                errors[custom_id] = error.get("message") or f"HTTP {response.get('status_code')}"
+                continue
+            body = response["body"]
+            results[custom_id] = body["choices"][0]["message"]["content"]
+            usage = body.get("usage") or {}
+            model = body.get("model", DEFAULT_MODEL)
+            metrics.registry.inc("llm_batch_prompt_tokens_total", usage.get("prompt_tokens", 0), model=model)
+            metrics.registry.inc("llm_batch_completion_tokens_total", usage.get("completion_tokens", 0), model=model)
+            attrs = {"prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": usage.get("completion_tokens", 0),
+                     "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0}
+            # Custom ids are "<case>/<task>[/<n>]"
+            case, task = (custom_id.split("/") + [""])[:2]
+            with metrics.usage_scope(case=case):
+                ProfileGenerator._record_usage(task, model, router.route(task).tier, attrs, batch=True)
+    metrics.registry.inc("llm_batch_results_total", len(results), outcome="ok")
+    metrics.registry.inc("llm_batch_results_total", len(errors), outcome="error")
+    return results, errors
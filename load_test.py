@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from docx import Document
+
+import metrics
+import pipeline
+import synthetic_corpus
+from stub_llm_server import start_stub_server
+from vector_store import VectorStore
+
+BASE_DIR = Path(__file__).resolve().parent
+TEMPLATE_PATH = BASE_DIR / "template.pptx"
+
+STAGES = ["extract", "reference_select", "vector_store", "profile", "answer", "submit", "pptx_render", "total"]
+# Stages inside a Submit, timed from the spans of its trace: stage -> (span names, tasks or None for any)
+SUBMIT_STAGE_SPANS = {
+    "extract": (("extract", "clean"), None),
+    "reference_select": (("reference_select",), None),
+    "vector_store": (("vector_store.store", "vector_store.add", "vector_store.delete"), None),
+    "profile": (("prompt_assembly", "llm_call"), ("profile", "sections")),
+    "answer": (("llm_call",), ("answer",)),
+}
+
+QUESTION = "Are there any contraindications for CBT with this patient?"
+
+
+class Upload:
+    """Mimics Streamlit's UploadedFile for the pipeline functions."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def _marker_upload(marker):
+    doc = Document()
+    doc.add_paragraph(f"Interview notes for case {marker}. The candidate interview covered career goals.")
+    buffer = BytesIO()
+    doc.save(buffer)
+    return Upload(f"interview_{marker}.docx", buffer.getvalue())
+
+
+def _packet_uploads(packet):
+    return [Upload(os.path.basename(d["path"]), Path(d["path"]).read_bytes()) for d in packet]
+
+
+def _new_state():
+    # Same defaults app.py puts into st.session_state
+    return {
+        'subject_doc_keys': [],
+        'context_doc_keys': [],
+        'reference_doc_keys': [],
+        'team_docs': [],
+        'profile': None,
+        'question_answer': None,
+        'session_id': uuid.uuid4().hex,
+        'vector_namespace': uuid.uuid4().hex,
+    }
+
+
+class RssSampler:
+    """Samples resident set size in the background to find the peak during a run."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_rss():
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        # ru_maxrss is the process lifetime peak (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _stage_timings(trace):
+    """Seconds spent in each SUBMIT_STAGE_SPANS stage of a finished Submit trace."""
+    timings = {}
+    for stage, (names, tasks) in SUBMIT_STAGE_SPANS.items():
+        spans = [s for s in trace.spans if s.name in names and (tasks is None or s.labels.get("task") in tasks)]
+        if spans:
+            timings[stage] = sum(s.duration or 0 for s in spans)
+    return timings
+
+
+def run_session(session_id, marker, all_markers, packet, components, args):
+    """Drive one simulated session through the same pipeline call main() makes on Submit."""
+    document_processor, profile_generator, reference_library = components
+    state = _new_state()
+    timings = {}
+    result = {"session": session_id, "marker": marker, "timings": timings, "error": None}
+
+    def timed(stage, fn):
+        start = time.perf_counter()
+        value = fn()
+        timings[stage] = time.perf_counter() - start
+        return value
+
+    session_start = time.perf_counter()
+    # LLM usage is charged to the session, as the app does per Streamlit session
+    with metrics.usage_scope(session=state['session_id']):
+        try:
+            # Each Streamlit script run builds its own VectorStore
+            namespace = None if args.shared_store else state['vector_namespace']
+            vector_store = VectorStore(namespace=namespace)
+
+            subject_files = _packet_uploads(packet) + [_marker_upload(marker)]
+            with metrics.start_trace("submit") as trace:
+                timed("submit", lambda: pipeline.submit_case(state, subject_files, [], QUESTION, document_processor,
+                                                             vector_store, profile_generator, reference_library))
+            timings.update(_stage_timings(trace))
+
+            # Check what actually reached the model for this session (the answer, the last call of the Submit)
+            sent = "\n".join(profile_generator.last_chunks())
+            result["foreign_markers"] = sorted(m for m in all_markers if m != marker and m in sent)
+            result["own_missing"] = marker not in sent
+
+            profile_json = json.loads(state['profile'])
+            template = str(TEMPLATE_PATH) if TEMPLATE_PATH.exists() else None
+            deck = timed("pptx_render", lambda: pipeline.render_deck(profile_json, template_path=template))
+            result["deck_bytes"] = len(deck.getvalue())
+
+            if namespace:
+                vector_store.drop()
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+    timings["total"] = time.perf_counter() - session_start
+    result["cost_usd"] = metrics.usage.totals("session", state['session_id'])["cost_usd"]
+    metrics.usage.forget("session", state['session_id'])
+    result["cross_talk"] = bool(result.get("foreign_markers")) or result.get("own_missing", False)
+    return result
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))] * 1000, 1)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "n": len(values)}
+
+
+def run_level(n_sessions, rounds, packet, components, args):
+    """Run N concurrent sessions `rounds` times and summarise latency, throughput, RSS and cross-talk."""
+    results = []
+    wall_start = time.perf_counter()
+    with RssSampler() as sampler:
+        for _ in range(rounds):
+            session_ids = [len(results) + i for i in range(n_sessions)]
+            markers = {sid: f"LT{sid:04d}{uuid.uuid4().hex[:8]}" for sid in session_ids}
+            all_markers = set(markers.values())
+            with ThreadPoolExecutor(max_workers=n_sessions) as executor:
+                futures = [executor.submit(run_session, sid, markers[sid], all_markers, packet, components, args)
+                           for sid in session_ids]
+                results.extend(f.result() for f in futures)
+    wall = time.perf_counter() - wall_start
+
+    errors = [r["error"] for r in results if r["error"]]
+    completed = len(results) - len(errors)
+    return {
+        "sessions": n_sessions,
+        "rounds": rounds,
+        "completed": completed,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "cross_talk": sum(1 for r in results if r["cross_talk"]),
+        "wall_s": round(wall, 2),
+        "throughput_per_min": round(completed / wall * 60, 2) if wall else None,
+        "peak_rss_mb": round(sampler.peak / 1e6, 1),
+        # Priced from model_tiers.json; only meaningful when the token counts are realistic
+        "cost_per_session_usd": round(sum(r["cost_usd"] for r in results) / len(results), 6) if results else None,
+        # Sessions keep their documents until they go idle, as in the app
+        "document_store_mb": round(pipeline.document_store.stats()["bytes"] / 1e6, 1),
+        "stages": {stage: _percentiles([r["timings"][stage] for r in results if stage in r["timings"]])
+                   for stage in STAGES},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test of the Submit pipeline against a stub LLM.")
+    parser.add_argument("--sessions", default="1,2,4,8", help="Comma-separated concurrency levels for the saturation curve")
+    parser.add_argument("--rounds", type=int, default=1, help="Submits per session at each level")
+    parser.add_argument("--packet-size", choices=sorted(synthetic_corpus.PACKET_SIZES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-url", help="Use an already running stub (or real endpoint) instead of starting one")
+    parser.add_argument("--ttft", type=float, default=0.8)
+    parser.add_argument("--tokens-per-sec", type=float, default=60.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--reference-dir", default=str(BASE_DIR / "HowToInterpret"))
+    parser.add_argument("--no-reference", action="store_true", help="Send no HowToInterpret reference material")
+    parser.add_argument("--shared-store", action="store_true",
+                        help="Use the single shared collection of older builds, to reproduce cross-talk")
+    parser.add_argument("--workdir", default="bench_corpus")
+    parser.add_argument("--output", default="bench_results/load_test.json")
+    args = parser.parse_args()
+
+    if args.base_url:
+        base_url = args.base_url
+        stub = None
+    else:
+        stub, base_url = start_stub_server(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec,
+                                           error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                           seed=args.seed)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-load-test")
+
+    from document_processor import DocumentProcessor
+    from profile_generator import ProfileGenerator
+    from reference_digests import get_library
+
+    class RecordingGenerator(ProfileGenerator):
+        """Remembers, per thread, the chunks each session sent for its profile."""
+
+        _local = threading.local()
+
+        def generate_profile(self, document_chunks, metadata=None, reference_docs=None):
+            self._local.chunks = list(document_chunks)
+            return super().generate_profile(document_chunks, metadata, reference_docs)
+
+        def last_chunks(self):
+            return getattr(self._local, "chunks", [])
+
+    document_processor = DocumentProcessor()
+    reference_library = None if args.no_reference else get_library(document_processor, args.reference_dir)
+    components = (document_processor, RecordingGenerator(base_url=base_url), reference_library)
+    packet = synthetic_corpus.generate_packet(os.path.join(args.workdir, args.packet_size),
+                                              size=args.packet_size, seed=args.seed)
+
+    levels = [int(n) for n in args.sessions.split(",") if n.strip()]
+    curve = []
+    for n in levels:
+        print(f"Running {n} concurrent session(s)...")
+        summary = run_level(n, args.rounds, packet, components, args)
+        curve.append(summary)
+        total = summary["stages"]["total"] or {}
+        print(f"  sessions={n} completed={summary['completed']} errors={summary['errors']} "
+              f"cross_talk={summary['cross_talk']} throughput={summary['throughput_per_min']}/min "
+              f"p50={total.get('p50_ms')}ms p95={total.get('p95_ms')}ms peak_rss={summary['peak_rss_mb']}MB")
+
+    report = {"base_url": base_url, "packet_size": args.packet_size, "curve": curve}
+    if stub is not None:
+        with stub.config.lock:
+            report["stub_stats"] = dict(stub.config.stats)
+        stub.shutdown()
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram buckets (seconds) covering everything from a regex cleaning pass
+# up to a full-profile LLM call.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+METRIC_PREFIX = "knowthee_"
+
+
+def _metric_name(name):
+    """Normalise a span or counter name into a Prometheus metric name."""
+    return METRIC_PREFIX + name.replace(".", "_").replace("-", "_")
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(label_key, extra=None):
+    items = list(label_key) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    escaped = []
+    for key, value in items:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter."""
+        key = (_metric_name(name), _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        """Record a value in a histogram."""
+        key = (_metric_name(name), _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """Return every series as a list of plain dicts."""
+        rows = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                rows.append({"type": "counter", "name": name, "labels": dict(labels), "value": value})
+            for (name, labels), hist in sorted(self._histograms.items()):
+                rows.append({
+                    "type": "histogram",
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": hist.count,
+                    "sum": hist.sum,
+                    "buckets": dict(zip([str(b) for b in hist.buckets], hist.counts)),
+                })
+        return rows
+
+    def to_prometheus(self):
+        """Render all series in the Prometheus text exposition format."""
+        lines = []
+        typed = set()
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self):
+        """Render all series as JSON lines, one per series."""
+        return "".join(json.dumps(row) + "\n" for row in self.snapshot())
+
+    def write_jsonl(self, path):
+        """Write a snapshot of all series to a JSONL file."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_jsonl())
+
+
+registry = MetricsRegistry()
+
+
+class Span:
+    """A single timed stage within a trace."""
+
+    def __init__(self, name, labels, parent=None):
+        self.name = name
+        self.labels = labels
+        self.parent = parent
+        self.attrs = {}
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def record(self, **attrs):
+        """Attach measurements (bytes, pages, tokens, ...) to this span."""
+        for key, value in attrs.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.attrs[key] = self.attrs.get(key, 0) + value
+            else:
+                self.attrs[key] = value
+
+
+class Trace:
+    """Collects the spans of one user request for the waterfall view."""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.duration = None
+        self.spans = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            "trace": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round((self.duration or 0) * 1000, 2),
+            "attrs": self.attrs,
+            "spans": [
+                {
+                    "span": s.name,
+                    "depth": _span_depth(s),
+                    "offset_ms": round((s.start - self.start) * 1000, 2),
+                    "duration_ms": round((s.duration or 0) * 1000, 2),
+                    "labels": s.labels,
+                    "attrs": s.attrs,
+                    "error": s.error,
+                }
+                for s in spans
+            ],
+        }
+
+
+def _span_depth(span):
+    depth = 0
+    while span.parent is not None:
+        depth += 1
+        span = span.parent
+    return depth
+
+
+def format_waterfall(trace_dict, width=40):
+    """Render a trace dict as a fixed-width text waterfall."""
+    total = trace_dict["duration_ms"] or max(
+        [s["offset_ms"] + s["duration_ms"] for s in trace_dict["spans"]] or [1]
+    )
+    lines = [f"{trace_dict['trace']}: {total:.0f} ms"]
+    for s in trace_dict["spans"]:
+        start_col = int(width * s["offset_ms"] / total) if total else 0
+        bar_len = max(1, int(width * s["duration_ms"] / total)) if total else 1
+        bar = " " * start_col + "#" * min(bar_len, width - start_col)
+        label = ("  " * s["depth"] + s["span"])[:28]
+        detail = ", ".join(f"{k}={v}" for k, v in {**s["labels"], **s["attrs"]}.items())
+        lines.append(f"{label:<28} |{bar:<{width}}| {s['duration_ms']:>9.1f} ms  {detail}")
+    return "\n".join(lines)
+
+
+_current_trace = contextvars.ContextVar("knowthee_trace", default=None)
+_current_span = contextvars.ContextVar("knowthee_span", default=None)
+
+
+def begin_trace(name, **attrs):
+    """Start a trace and make it current for spans opened in this context."""
+    trace = Trace(name, **attrs)
+    trace._token = _current_trace.set(trace)
+    return trace
+
+
+def end_trace(trace):
+    """Finish a trace, record its total duration and append it to the JSONL log."""
+    trace.duration = time.perf_counter() - trace.start
+    try:
+        _current_trace.reset(trace._token)
+    except ValueError:
+        # Ended from a different context than it was started in
+        _current_trace.set(None)
+    registry.observe(f"{trace.name}_trace_seconds", trace.duration)
+    jsonl_path = os.getenv("METRICS_JSONL_PATH")
+    if jsonl_path:
+        try:
+            with open(jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace.to_dict()) + "\n")
+        except OSError as e:
+            print(f"Error writing trace to {jsonl_path}: {e}")
+    return trace
+
+
+@contextmanager
+def start_trace(name, **attrs):
+    trace = begin_trace(name, **attrs)
+    try:
+        yield trace
+    finally:
+        end_trace(trace)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, **labels):
+    """Time a pipeline stage, feeding both the registry and the current trace.
+
+    Labels should be low-cardinality (file type, task, model); per-call
+    measurements go through Span.record() or annotate().
+    """
+    current = Span(name, labels, parent=_current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        registry.inc(f"{name}_errors_total", **labels)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_span.reset(token)
+        registry.observe(f"{name}_seconds", current.duration, **labels)
+        for key, value in current.attrs.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                registry.inc(f"{name}_{key}_total", value, **labels)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(current)
+
+
+def annotate(**attrs):
+    """Record measurements on the innermost active span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.record(**attrs)
+
+
+def bind(fn):
+    """Wrap fn so it runs with the caller's trace and span when handed to a worker thread."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+_usage_scope = contextvars.ContextVar("knowthee_usage_scope", default={})
+
+USAGE_SCOPES = ("session", "case")
+
+
+@contextmanager
+def usage_scope(**scope):
+    """Attribute LLM usage inside the block to a session and/or case; nested scopes add to the outer one."""
+    token = _usage_scope.set({**_usage_scope.get(), **scope})
+    try:
+        yield
+    finally:
+        _usage_scope.reset(token)
+
+
+def set_usage_scope(**scope):
+    """Replace the usage scope for the rest of this context (for script runs that cannot wrap a block)."""
+    _usage_scope.set(dict(scope))
+
+
+class UsageLedger:
+    """LLM token usage and estimated cost, aggregated per session, per case and per UTC day."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, prompt_tokens, cached_tokens, completion_tokens, cost_usd, **labels):
+        """Add one call's usage to its day and to the current session/case scope, and to the cost counters."""
+        scope = _usage_scope.get()
+        keys = [("day", time.strftime("%Y-%m-%d", time.gmtime()))]
+        keys += [(kind, scope[kind]) for kind in USAGE_SCOPES if scope.get(kind)]
+        with self._lock:
+            for key in keys:
+                totals = self._totals.setdefault(key, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                                                       "completion_tokens": 0, "cost_usd": 0.0})
+                totals["calls"] += 1
+                totals["prompt_tokens"] += prompt_tokens
+                totals["cached_tokens"] += cached_tokens
+                totals["completion_tokens"] += completion_tokens
+                totals["cost_usd"] += cost_usd
+        registry.inc("llm_cost_usd_total", cost_usd, **labels)
+
+    def totals(self, kind, key):
+        """Totals for one session, case or day (YYYY-MM-DD); zeros if nothing was recorded."""
+        with self._lock:
+            totals = dict(self._totals.get((kind, key)) or {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                                                            "completion_tokens": 0, "cost_usd": 0.0})
+        totals["cost_usd"] = round(totals["cost_usd"], 6)
+        return totals
+
+    def today(self):
+        return self.totals("day", time.strftime("%Y-%m-%d", time.gmtime()))
+
+    def snapshot(self):
+        """Every aggregate as {kind: {key: totals}}."""
+        with self._lock:
+            keys = list(self._totals)
+        snapshot = {}
+        for kind, key in keys:
+            snapshot.setdefault(kind, {})[key] = self.totals(kind, key)
+        return snapshot
+
+    def forget(self, kind, key):
+        """Drop one aggregate, e.g. a session that has ended."""
+        with self._lock:
+            self._totals.pop((kind, key), None)
+
+
+usage = UsageLedger()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path in ("/metrics", "/"):
+            body = registry.to_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.jsonl":
+            body = registry.to_jsonl().encode("utf-8")
+            content_type = "application/x-ndjson"
+        elif self.path == "/usage.json":
+            body = json.dumps(usage.snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port, host="127.0.0.1"):
+    """Expose /metrics (Prometheus), /metrics.jsonl and /usage.json on a local port. Idempotent."""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        thread = threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True)
+        thread.start()
+        print(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+        return _server
+
+
+def serve_from_env():
+    """Start the metrics endpoint when METRICS_PORT is set."""
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    try:
+        return serve(int(port), host=os.getenv("METRICS_HOST", "127.0.0.1"))
+    except OSError as e:
+        print(f"Could not start metrics endpoint on port {port}: {e}")
+        return None
@@ -0,0 +1,93 @@
+import json
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Tiers and the task -> tier map live outside the code; LLM_TIERS_PATH points at another file
+TIERS_PATH = os.getenv("LLM_TIERS_PATH", os.path.join(BASE_DIR, "model_tiers.json"))
+# Every task that calls a model. Document-type detection is keyword-based and questions are
+# sent as asked (there is no rewriting step), so neither is a task
+TASKS = ("profile", "sections", "answer", "digest", "reference_digest")
+
+
+class Route:
+    """Where one task's calls go: tier, model, reply budget and request timeout (seconds)."""
+
+    def __init__(self, task, tier, model, max_tokens, timeout):
+        self.task = task
+        self.tier = tier
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+
+    def params(self) -> dict:
+        """Request parameters for chat.completions.create (unset ones are left to the client's defaults)."""
+        params = {"model": self.model, "max_tokens": self.max_tokens, "timeout": self.timeout}
+        return {key: value for key, value in params.items() if value is not None}
+
+
+class ModelRouter:
+    """Routes each LLM task (profile, answer, digest, ...) to a named model tier.
+
+    A task's own max_tokens and timeout override its tier's; tasks not listed use
+    the default tier. LLM_<TIER>_MODEL (e.g. LLM_FAST_MODEL) overrides a tier's
+    model without editing the file.
+    """
+
+    def __init__(self, tiers: dict, tasks: dict = None, default_tier: str = "synthesis", prices: dict = None,
+                 batch_discount: float = 0.5):
+        self.tiers = {}
+        for name, tier in tiers.items():
+            tier = dict(tier)
+            tier["model"] = os.getenv(f"LLM_{name.upper()}_MODEL", tier.get("model"))
+            if not tier["model"]:
+                raise ValueError(f"Model tier '{name}' has no model")
+            self.tiers[name] = tier
+        self.tasks = tasks or {}
+        self.default_tier = default_tier
+        self.prices = prices or {}
+        self.batch_discount = batch_discount
+        unknown = sorted(set(self.tasks) - set(TASKS))
+        if unknown:
+            raise ValueError(f"Unknown LLM task(s) {', '.join(unknown)}; tasks are {', '.join(TASKS)}")
+        for task, config in [("(default)", {"tier": default_tier})] + list(self.tasks.items()):
+            if config.get("tier", default_tier) not in self.tiers:
+                raise ValueError(f"Task {task} uses unknown model tier '{config.get('tier')}'")
+
+    @classmethod
+    def from_file(cls, path: str = TIERS_PATH):
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(config["tiers"], config.get("tasks"), config.get("default_tier", "synthesis"),
+                   config.get("prices_per_million_tokens"), config.get("batch_discount", 0.5))
+
+    def route(self, task: str) -> Route:
+        config = self.tasks.get(task, {})
+        tier_name = config.get("tier", self.default_tier)
+        tier = self.tiers[tier_name]
+        return Route(task, tier_name, tier["model"], config.get("max_tokens", tier.get("max_tokens")),
+                     config.get("timeout", tier.get("timeout")))
+
+    def params(self, task: str) -> dict:
+        return self.route(task).params()
+
+    def context_tokens(self, model: str) -> int:
+        """Context window of a model, from the tier that uses it (the default tier's for unknown models)."""
+        for tier in self.tiers.values():
+            if tier["model"] == model and tier.get("context_tokens"):
+                return tier["context_tokens"]
+        return self.tiers[self.default_tier].get("context_tokens") or 0
+
+    def cost(self, model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int,
+             batch: bool = False) -> float:
+        """Estimated cost in USD of one call; 0 for models without a price."""
+        price = self.prices.get(model)
+        if not price:
+            return 0.0
+        uncached = max(prompt_tokens - cached_tokens, 0)
+        cost = (uncached * price["input"] + cached_tokens * price.get("cached_input", price["input"])
+                + completion_tokens * price["output"]) / 1_000_000
+        return cost * self.batch_discount if batch else cost
+
+
+# Read once at startup and shared by every generator in the process
+router = ModelRouter.from_file()
@@ -0,0 +1,201 @@
+import copy
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+from fontTools import subset as ftsubset, ttLib
+from fpdf import FPDF
+from fpdf.fonts import SubsetMap, TTFFont
+
+import metrics
+from pptx_renderer import clean_source_text
+
+BASE_DIR = Path(__file__).resolve().parent
+# Searched in order for DejaVuSans.ttf / DejaVuSans-Bold.ttf; PDF_FONT_DIR goes first when set
+FONT_DIRS = [Path(d) for d in (os.getenv("PDF_FONT_DIR"), BASE_DIR / "fonts", "/usr/share/fonts/truetype/dejavu") if d]
+FONT_FILES = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf"}
+FONT_FAMILY = "DejaVu"
+# Core PDF font used when DejaVu is not installed; it only covers Latin-1
+FALLBACK_FAMILY = "helvetica"
+# Unicode blocks the report fonts keep: Latin, Greek, punctuation, currency, letterlike symbols,
+# arrows, maths and shapes. Cutting DejaVu (~6000 glyphs) to these once makes subsetting each report cheap
+FONT_COVERAGE = [(0x20, 0x24F), (0x370, 0x3FF), (0x2000, 0x206F), (0x20A0, 0x20CF), (0x2100, 0x214F),
+                 (0x2190, 0x21FF), (0x2200, 0x22FF), (0x25A0, 0x25FF)]
+# Rendered reports kept in memory, keyed by the hash of what they were rendered from
+CACHE_ENTRIES = 32
+
+BULLET_PATTERN = re.compile(r"^\s*[-*•]\s+")
+NUMBERED_PATTERN = re.compile(r"^\s*\d+[.)]\s+")
+HEADING_PATTERN = re.compile(r"^\s*#+\s*")
+# Characters the Latin-1 fallback cannot draw, mapped to close equivalents
+FALLBACK_TRANSLATION = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"', "–": "-", "—": "-",
+                                      "•": "-", "…": "...", "≥": ">=", "≤": "<="})
+
+_fonts = None
+_fonts_lock = threading.Lock()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pdf-render")
+
+
+def _coverage_subset(path) -> bytes:
+    """The font file cut down to FONT_COVERAGE, without the layout tables fpdf drops anyway."""
+    font = ttLib.TTFont(path, recalcTimestamp=False)
+    options = ftsubset.Options(notdef_outline=True, recommended_glyphs=True, glyph_names=True, name_IDs=["*"],
+                               layout_features=[])
+    options.drop_tables += ["FFTM", "GDEF", "GPOS", "GSUB", "MATH", "hdmx", "meta"]
+    subsetter = ftsubset.Subsetter(options)
+    subsetter.populate(unicodes=[code for first, last in FONT_COVERAGE for code in range(first, last + 1)])
+    subsetter.subset(font)
+    data = io.BytesIO()
+    font.save(data)
+    return data.getvalue()
+
+
+def _load_fonts():
+    """Parse the report fonts once per process; returns {style: (parsed font, file bytes)}, or {} for the fallback."""
+    global _fonts
+    with _fonts_lock:
+        if _fonts is None:
+            _fonts = {}
+            for directory in FONT_DIRS:
+                paths = {style: directory / name for style, name in FONT_FILES.items()}
+                if all(path.exists() for path in paths.values()):
+                    with metrics.span("pdf_font_load"):
+                        for style, path in paths.items():
+                            data = _coverage_subset(path)
+                            # The FPDF here only numbers the font; each report gets its own copy
+                            _fonts[style] = (TTFFont(FPDF(), io.BytesIO(data), FONT_FAMILY.lower() + style, style), data)
+                    break
+            else:
+                print(f"DejaVu fonts not found in {', '.join(map(str, FONT_DIRS))}; PDF reports use {FALLBACK_FAMILY}")
+        return _fonts
+
+
+def preload():
+    """Load the report fonts in the background, so the first export does not wait for them."""
+    _executor.submit(_load_fonts)
+
+
+def _add_fonts(pdf):
+    """Register the parsed fonts with a report, or return False if it has to use the fallback font.
+
+    Writing a PDF subsets its fonts in place, so each report gets a shallow copy of the
+    parsed metrics with its own font file handle and glyph subset; only the parse is shared.
+    """
+    fonts = _load_fonts()
+    if not fonts:
+        return False
+    for style, (parsed, data) in fonts.items():
+        font = copy.copy(parsed)
+        font.i = len(pdf.fonts) + 1
+        font.ttfont = ttLib.TTFont(io.BytesIO(data), recalcTimestamp=False, fontNumber=0, lazy=True)
+        font.hbfont = None
+        font.missing_glyphs = []
+        font.subset = SubsetMap(font, [ord(char) for char in "\x00 \r\n0123456789" + pdf.str_alias_nb_pages])
+        pdf.fonts[font.fontkey] = font
+    return True
+
+
+class _ReportPDF(FPDF):
+    """FPDF whose markdown is only **bold**, the one style the report fonts register.
+
+    Model text is full of "__" form blanks, "--" dashes and bracketed citations, which
+    fpdf would otherwise read as italics, underline and links.
+    """
+    MARKDOWN_ITALICS_MARKER = None
+    MARKDOWN_UNDERLINE_MARKER = None
+    MARKDOWN_LINK_REGEX = re.compile(r"(?!)")
+
+
+def report_key(profile_json: List[dict], answers: List[dict] = None) -> str:
+    """Hash of everything a report is rendered from."""
+    payload = json.dumps([profile_json, answers or []], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _write_block(pdf, text, clean, indent=0):
+    pdf.set_x(pdf.l_margin + indent)
+    pdf.multi_cell(0, 7, clean(text), align="L", markdown=True, new_x="LMARGIN", new_y="NEXT")
+
+
+def _render(profile_json, answers):
+    pdf = _ReportPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    if _add_fonts(pdf):
+        family, clean = FONT_FAMILY, str
+    else:
+        family = FALLBACK_FAMILY
+        clean = lambda text: text.translate(FALLBACK_TRANSLATION).encode("latin-1", "replace").decode("latin-1")
+    pdf.add_page()
+
+    pdf.set_font(family, "B", 18)
+    pdf.cell(0, 12, "Clinical Assessment", new_x="LMARGIN", new_y="NEXT")
+    for section in profile_json:
+        pdf.ln(4)
+        pdf.set_font(family, "B", 14)
+        pdf.multi_cell(0, 9, clean(section.get("section", "")), new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font(family, "", 11)
+        for line in str(section.get("content", "")).split("\n"):
+            if not line.strip():
+                continue
+            if BULLET_PATTERN.match(line):
+                _write_block(pdf, "•  " + BULLET_PATTERN.sub("", line, count=1), clean, indent=5)
+            elif NUMBERED_PATTERN.match(line):
+                _write_block(pdf, line.strip(), clean, indent=5)
+            elif HEADING_PATTERN.match(line):
+                _write_block(pdf, f"**{HEADING_PATTERN.sub('', line, count=1).strip()}**", clean)
+            else:
+                _write_block(pdf, line.strip(), clean)
+        sources = clean_source_text(section.get("sources", ""))
+        if sources:
+            pdf.set_font(family, "", 9)
+            pdf.set_text_color(90, 90, 90)
+            _write_block(pdf, f"Sources: {sources}", clean)
+            pdf.set_text_color(0, 0, 0)
+
+    for answer in answers or []:
+        pdf.ln(6)
+        pdf.set_font(family, "B", 14)
+        pdf.cell(0, 9, "Clinical Consultation Response", new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font(family, "", 11)
+        if answer.get("question"):
+            _write_block(pdf, f"**Question:** {answer['question']}", clean)
+        for line in answer.get("answer", "").split("\n"):
+            if line.strip():
+                _write_block(pdf, HEADING_PATTERN.sub("", line, count=1).strip(), clean)
+    return bytes(pdf.output())
+
+
+def render_pdf(profile_json: List[dict], answers: List[dict] = None) -> bytes:
+    """Render profile sections (and optional {"question", "answer"} consultation answers) to PDF bytes.
+
+    Reports are memoized by report_key, so re-rendering an unchanged profile is a lookup.
+    """
+    key = report_key(profile_json, answers)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            metrics.registry.inc("pdf_render_cache_total", outcome="hit")
+            return _cache[key]
+    metrics.registry.inc("pdf_render_cache_total", outcome="miss")
+    with metrics.span("pdf_render") as span:
+        data = _render(profile_json, answers)
+        span.record(bytes=len(data))
+    with _cache_lock:
+        _cache[key] = data
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return data
+
+
+def submit_pdf(profile_json: List[dict], answers: List[dict] = None):
+    """Render a report on a background thread; returns a Future of the PDF bytes."""
+    return _executor.submit(metrics.bind(render_pdf), profile_json, answers)
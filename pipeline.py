@@ -0,0 +1,296 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import uuid
+
+import metrics
+from document_processor import DocumentExtractionError
+from document_store import DocumentEvicted, store as document_store
+from assessment_types import PROFILE_SECTIONS, SECTION_QUERIES, affected_sections, classify_document, section_types
+from pptx_renderer import generate_pptx_from_json, generate_team_pptx, patch_section_slide
+from vector_store import DUPLICATE_THRESHOLD, MMR_LAMBDA
+
+REFERENCE_FOLDER = "HowToInterpret"
+# Session state holds document store keys for each kind, as '<kind>_doc_keys'
+DOCUMENT_KINDS = ("subject", "context", "reference")
+# Prompt tokens of evidence retrieved per section when one section is regenerated on its own
+SECTION_TOKEN_BUDGET = 4000
+
+def extract_uploads(document_processor, files):
+    """Extract text, metadata and per-page text from uploaded files (anything with .name and .getvalue()).
+
+    Raises DocumentExtractionError, naming the upload, for a file that cannot be parsed.
+    """
+    texts = []
+    metadatas = []
+    pages = []
+    for file in files:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as tmp_file:
+            tmp_file.write(file.getvalue())
+        try:
+            doc_pages, metadata = document_processor.process_document_pages(tmp_file.name)
+        except DocumentExtractionError as e:
+            raise DocumentExtractionError(file.name, e.reason) from e
+        finally:
+            os.unlink(tmp_file.name)
+        texts.append(" ".join(page for page in doc_pages if page))
+        metadatas.append(metadata)
+        pages.append(doc_pages)
+    return texts, metadatas, pages
+
+def extract_paths(document_processor, paths):
+    """Extract text, metadata and per-page text from documents already on disk."""
+    texts = []
+    metadatas = []
+    pages = []
+    for path in paths:
+        doc_pages, metadata = document_processor.process_document_pages(str(path))
+        texts.append(" ".join(page for page in doc_pages if page))
+        metadatas.append(metadata)
+        pages.append(doc_pages)
+    return texts, metadatas, pages
+
+def page_chunks(role, texts, metadatas, pages, doc_ids=None):
+    """Split extracted documents into per-page chunks with metadata for the vector store.
+
+    Each chunk is tagged with its role (subject or context), the document's
+    detected type, its file name and its 1-based page number, plus its
+    document's id from doc_ids if given (so the document can be removed later).
+    """
+    chunks = []
+    chunk_metadatas = []
+    for i, (text, metadata, doc_pages) in enumerate(zip(texts, metadatas, pages)):
+        doc_type = classify_document(text, metadata['file_name'], metadata['file_type'])
+        for number, page in enumerate(doc_pages, start=1):
+            if not page.strip():
+                continue
+            chunk_metadata = {"role": role, "type": doc_type, "file": metadata['file_name'], "page": number}
+            if doc_ids is not None:
+                chunk_metadata["doc"] = doc_ids[i]
+            chunks.append(page)
+            chunk_metadatas.append(chunk_metadata)
+    return chunks, chunk_metadatas
+
+def upload_hash(file):
+    """Content hash identifying an uploaded document across Submits."""
+    return hashlib.sha256(file.getvalue()).hexdigest()[:32]
+
+def session_id(state):
+    """The id a session's documents are held under in the document store."""
+    if not state.get('session_id'):
+        state['session_id'] = uuid.uuid4().hex
+    return state['session_id']
+
+def session_docs(state, kind):
+    """Text of the session's subject, context or reference documents, from the document store.
+
+    Raises DocumentEvicted if the session was idle or evicted and must submit again.
+    """
+    return document_store.get_many(state.get(f'{kind}_doc_keys') or [])
+
+def _session_keys(state):
+    return [key for kind in DOCUMENT_KINDS for key in state.get(f'{kind}_doc_keys') or []]
+
+def _pins_session(func):
+    """Run func(state, ...) with the session pinned in the document store, so it is not evicted mid-call."""
+    @functools.wraps(func)
+    def wrapper(state, *args, **kwargs):
+        with document_store.active(session_id(state)):
+            return func(state, *args, **kwargs)
+    return wrapper
+
+def select_reference_docs(state, reference_library):
+    """Choose reference material for the instruments found in the subject documents into session state.
+
+    The session then holds only the documents it currently uses; texts no
+    session holds are freed.
+    """
+    reference_docs = reference_library.select(session_docs(state, 'subject')) if reference_library else []
+    sid = session_id(state)
+    state['reference_doc_keys'] = document_store.put_many(sid, reference_docs)
+    document_store.retain(sid, _session_keys(state))
+    return reference_docs
+
+def session_memory(state, vector_store=None):
+    """Approximate memory held for a session, in bytes, for the developer panel."""
+    memory = document_store.session_bytes(session_id(state))
+    memory["profile_bytes"] = len((state.get('profile') or "").encode("utf-8"))
+    memory["deck_bytes"] = len(state.get('deck_bytes') or b"")
+    memory["section_chunk_bytes"] = sum(len(chunk.encode("utf-8")) for chunks in (state.get('section_chunks') or {}).values()
+                                        for chunk in chunks)
+    if vector_store is not None:
+        memory["vector_store_chunks"] = vector_store.collection.count()
+        memory["lexical_index_bytes"] = sum(len(chunk.encode("utf-8")) for chunk in vector_store.lexical.documents.values())
+    memory["store"] = document_store.stats()
+    return memory
+
+def generate_assessment(state, all_metadatas, question, vector_store, profile_generator):
+    """Generate the profile, and the consultation answer if a question was asked, into session state."""
+    reference_docs = session_docs(state, 'reference')
+    state['profile'] = profile_generator.generate_profile(
+        vector_store.get_relevant_chunks(),
+        all_metadatas,  # Pass the metadata list for the document summary
+        reference_docs=reference_docs
+    )
+
+    if question and question.strip():
+        state['question_answer'] = profile_generator.answer_question(
+            vector_store.get_relevant_chunks(), question, reference_docs=reference_docs
+        )
+
+def _parses(profile):
+    try:
+        return isinstance(json.loads(profile), list)
+    except (TypeError, ValueError):
+        return False
+
+def merge_sections(profile, sections):
+    """Replace sections of a profile JSON string by name, returning the merged JSON string."""
+    profile_json = json.loads(profile)
+    replacements = {section["section"]: section for section in sections}
+    merged = [replacements.pop(section.get("section"), section) for section in profile_json]
+    merged.extend(replacements.values())
+    return json.dumps(merged, ensure_ascii=False)
+
+@_pins_session
+def submit_case(state, subject_files, context_files, question, document_processor, vector_store, profile_generator,
+                reference_library):
+    """Run a Submit, reprocessing only the documents added or removed since the previous one.
+
+    state['case_manifest'] maps "<role>:<hash>" for each document in the case to
+    its text's document store key, metadata and type. Without a previous profile everything is
+    processed and generated. Otherwise only new uploads are extracted, removed
+    ones are deleted from the vector store, and only the profile sections that
+    the changed documents' types bear on are regenerated and merged into the
+    profile. Returns the names of the regenerated sections.
+    """
+    manifest = state.get('case_manifest') or {}
+    uploads = {}
+    for role, files in (("subject", subject_files), ("context", context_files)):
+        for file in files or []:
+            uploads.setdefault(f"{role}:{upload_hash(file)}", (role, file))
+    # An evicted session has lost its document text and vector store (another session holding the
+    # same text keeps the keys alive, so the collection is checked too), so it starts over
+    incremental = (bool(manifest) and _parses(state.get('profile'))
+                   and document_store.has_all([entry["text_key"] for entry in manifest.values()])
+                   and vector_store.collection.count() > 0)
+    if not incremental:
+        manifest = {}
+        vector_store.store_documents([])
+    added = [key for key in uploads if key not in manifest]
+    removed = [key for key in manifest if key not in uploads]
+
+    with metrics.span("case_update", mode="incremental" if incremental else "full") as span:
+        span.record(added=len(added), removed=len(removed), unchanged=len(uploads) - len(added))
+        for key in removed:
+            vector_store.delete_documents(doc=key)
+        for role in ("subject", "context"):
+            keys = [key for key in added if uploads[key][0] == role]
+            if not keys:
+                continue
+            texts, metadatas, pages = extract_uploads(document_processor, [uploads[key][1] for key in keys])
+            chunks, chunk_metadatas = page_chunks(role, texts, metadatas, pages, doc_ids=keys)
+            vector_store.add_documents(chunks, chunk_metadatas)
+            for key, text, metadata in zip(keys, texts, metadatas):
+                doc_type = classify_document(text, metadata['file_name'], metadata['file_type'])
+                manifest[key] = {"role": role, "text_key": document_store.put(session_id(state), text),
+                                 "metadata": metadata, "type": doc_type}
+
+    changed_types = [manifest[key]["type"] for key in added + removed]
+    if added or removed or not incremental:
+        state['section_chunks'] = {}
+    for key in removed:
+        del manifest[key]
+    # Keep the manifest in upload order, which is the order documents reach the prompt
+    state['case_manifest'] = {key: manifest[key] for key in uploads}
+    for role in ("subject", "context"):
+        entries = [entry for entry in state['case_manifest'].values() if entry["role"] == role]
+        state[f'{role}_doc_keys'] = [entry["text_key"] for entry in entries]
+        state[f'{role}_metadatas'] = [entry["metadata"] for entry in entries]
+    all_metadatas = state['subject_metadatas'] + state['context_metadatas']
+    select_reference_docs(state, reference_library)
+
+    if not incremental:
+        generate_assessment(state, all_metadatas, question, vector_store, profile_generator)
+        state['answered_question'] = question
+        return list(PROFILE_SECTIONS)
+
+    sections = affected_sections(changed_types) if changed_types else []
+    if sections == PROFILE_SECTIONS:
+        generate_assessment(state, all_metadatas, "", vector_store, profile_generator)
+    elif sections:
+        regenerated = profile_generator.generate_sections(
+            vector_store.get_relevant_chunks(), sections, all_metadatas, reference_docs=session_docs(state, 'reference'))
+        state['profile'] = merge_sections(state['profile'], regenerated)
+    metrics.registry.inc("profile_sections_regenerated_total", len(sections))
+
+    if question and question.strip() and (changed_types or question != state.get('answered_question')):
+        state['question_answer'] = profile_generator.answer_question(
+            vector_store.get_relevant_chunks(), question, reference_docs=session_docs(state, 'reference'))
+        state['answered_question'] = question
+    return sections
+
+def section_chunks(cache, vector_store, section_name):
+    """Evidence for one profile section: a diversified hybrid query restricted to the section's document types.
+
+    Results are kept in cache (a dict stored with the case), which must be
+    emptied whenever the case's documents change.
+    """
+    if section_name in cache:
+        metrics.registry.inc("section_retrieval_cache_total", outcome="hit")
+        return cache[section_name]
+    metrics.registry.inc("section_retrieval_cache_total", outcome="miss")
+    query = SECTION_QUERIES.get(section_name, section_name)
+    options = dict(n_results=None, mode="hybrid", mmr_lambda=MMR_LAMBDA, duplicate_threshold=DUPLICATE_THRESHOLD,
+                   token_budget=SECTION_TOKEN_BUDGET)
+    chunks = vector_store.get_relevant_chunks(query, type=section_types(section_name), **options)
+    if not chunks:
+        # No documents of the section's usual types: fall back to the whole case
+        chunks = vector_store.get_relevant_chunks(query, **options)
+    cache[section_name] = chunks
+    return chunks
+
+@_pins_session
+def regenerate_section(state, section_name, vector_store, profile_generator, guidance=None):
+    """Rewrite one section of the profile in session state with one small call; returns the new section.
+
+    The rendered deck in state, if current, has just that section's slide patched.
+    Raises DocumentEvicted if the case's documents (and vector store) were released.
+    """
+    keys = _session_keys(state)
+    if not document_store.has_all(keys) or (keys and not vector_store.collection.count()):
+        raise DocumentEvicted(session_id(state))
+    chunks = section_chunks(state.setdefault('section_chunks', {}), vector_store, section_name)
+    all_metadatas = state.get('subject_metadatas', []) + state.get('context_metadatas', [])
+    section = profile_generator.regenerate_section(chunks, section_name, all_metadatas,
+                                                   reference_docs=session_docs(state, 'reference'), guidance=guidance)
+    previous = state['profile']
+    state['profile'] = merge_sections(previous, [section])
+    deck_key = state.get('deck_key')
+    if deck_key and deck_key[0] == previous and state.get('deck_bytes'):
+        patched = patch_deck(state['deck_bytes'], section)
+        if patched is not None:
+            state['deck_bytes'] = patched
+            state['deck_key'] = (state['profile'],) + tuple(deck_key[1:])
+    return section
+
+def patch_deck(deck_bytes, section):
+    """Rewrite one section's slide in a rendered deck; returns the new deck bytes, or None to re-render."""
+    with metrics.span("pptx_patch"):
+        patched = patch_section_slide(deck_bytes, section)
+    return patched.getvalue() if patched is not None else None
+
+def render_deck(profile_json, template_path=None):
+    """Render the profile JSON to a PowerPoint deck, returning a BytesIO."""
+    with metrics.span("pptx_render", template="yes" if template_path else "no"):
+        return generate_pptx_from_json(profile_json, template_path=template_path)
+
+def render_team_deck(profiles, template_path=None):
+    """Render several individuals' profiles ({"name", "profile"}) into one deck, returning a BytesIO."""
+    with metrics.span("pptx_team_render", template="yes" if template_path else "no") as span:
+        span.record(profiles=len(profiles))
+        return generate_team_pptx(profiles, template_path=template_path,
+                                  on_profile=lambda name, seconds: metrics.registry.observe(
+                                      "pptx_team_profile_seconds", seconds))
@@ -0,0 +1,627 @@
+import re
+import time
+from copy import deepcopy
+from functools import lru_cache
+from io import BytesIO
+from pptx import Presentation
+from pptx.dml.color import RGBColor
+from pptx.enum.text import MSO_ANCHOR, PP_ALIGN
+from pptx.util import Pt
+
+def clean_source_text(source_text):
+    """Clean up temporary filenames in sources text and replace generic file types with meaningful document descriptions."""
+    if not source_text:
+        return ""
+    
+    # First, extract source types from the text if possible
+    source_types = []
+    
+    # Check for Hogan references
+    if "Hogan" in source_text or "hogan" in source_text:
+        source_types.append("Hogan Assessment")
+    
+    # Check for IDI references - distinguish between the two IDI types
+    if "IDI" in source_text or "idi" in source_text:
+        # Check for Individual Directions Inventory
+        if "directions" in source_text.lower() or "individual directions" in source_text.lower():
+            source_types.append("Individual Directions Inventory")
+        # Check for Intercultural Development Assessment
+        elif "intercultural" in source_text.lower() or "cultural" in source_text.lower():
+            source_types.append("Intercultural Development Assessment")
+        # Generic IDI if we can't determine which one
+        else:
+            source_types.append("Assessment")
+    
+    # Check for 360 references
+    if "360" in source_text:
+        source_types.append("360° Feedback")
+    
+    # Check for CV references
+    if "CV" in source_text or "cv" in source_text or "resume" in source_text.lower():
+        source_types.append("CV/Resume")
+    
+    # Replace specific patterns
+    # Replace Hogan temp files
+    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.pdf\s*\(Hogan\)', 'Hogan Assessment', source_text)
+    
+    # Replace Individual Directions Inventory files
+    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.pdf\s*\(IDI\)', 'Individual Directions Inventory', source_text)
+    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.pdf\s*\(Individual Directions\)', 'Individual Directions Inventory', source_text)
+    
+    # Replace Intercultural Development references
+    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.pdf\s*\(Intercultural\)', 'Intercultural Development Assessment', source_text)
+    
+    # Replace other temp files
+    source_text = re.sub(r'tmp[a-zA-Z0-9]+\.[a-z]+', '', source_text)
+    source_text = re.sub(r'tmp[a-zA-Z0-9]+', '', source_text)
+    
+    # Replace generic file types with more meaningful descriptions
+    source_text = re.sub(r'\bPDF\b', 'Document', source_text)
+    source_text = re.sub(r'\bDOCX\b', 'Document', source_text)
+    source_text = re.sub(r'\bDOC\b', 'Document', source_text)
+    
+    # Clean up formatting
+    source_text = re.sub(r'\s+', ' ', source_text)  # Multiple spaces
+    source_text = re.sub(r',\s*,', ',', source_text)  # Multiple commas
+    source_text = re.sub(r'\(\s*\)', '', source_text)  # Empty parentheses
+    source_text = re.sub(r',\s*$', '', source_text)  # Trailing commas
+    source_text = re.sub(r'^\s*,\s*', '', source_text)  # Leading commas
+    source_text = re.sub(r'\(\s*,', '(', source_text)  # Commas after opening parenthesis
+    source_text = re.sub(r',\s*\)', ')', source_text)  # Commas before closing parenthesis
+    
+    # Final cleanup
+    source_text = source_text.strip()
+    
+    # If we've removed everything but have identified source types, use them
+    if (not source_text or source_text == ',' or source_text == '()') and source_types:
+        return ", ".join(source_types)
+    
+    # If we still have nothing, return a generic source
+    if not source_text or source_text == ',' or source_text == '()':
+        return "Assessment Documents"
+    
+    return source_text
+
+# Each section's content shape is named after the section, so one slide can be patched later
+CONTENT_SHAPE_PREFIX = "Profile Content: "
+
+def _write_section_text(text_frame, content, sources):
+    """Write a section's content as bullet-aware paragraphs followed by its sources line."""
+    for line in content.split('\n'):
+        if not line.strip():
+            continue
+        p = text_frame.add_paragraph()
+        p.text = line.lstrip('-* ').strip()
+        if line.strip().startswith(('-', '*')):
+            p.level = 0
+            p.font.bullet = True
+        if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
+            try:
+                p.font.color.rgb = RGBColor(10, 44, 77)
+            except:
+                pass
+        if hasattr(p.font, 'name'):
+            try:
+                p.font.name = "Calibri"
+            except:
+                pass
+        if hasattr(p.font, 'size'):
+            try:
+                p.font.size = 18 * 12700  # 18pt (increased from 12pt)
+            except:
+                pass
+    
+    # Add sources as a separate paragraph if present
+    if sources:
+        p = text_frame.add_paragraph()
+        p.text = f"Sources: {sources}"
+        if hasattr(p.font, 'italic'):
+            p.font.italic = True
+        if hasattr(p.font, 'name'):
+            p.font.name = "Calibri"
+        if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
+            p.font.color.rgb = RGBColor(10, 44, 77)
+        if hasattr(p.font, 'size'):
+            p.font.size = 18 * 12700  # 18pt (increased from 12pt)
+
+def patch_section_slide(deck, section):
+    """Rewrite one section's content in a deck rendered by generate_pptx_from_json.
+
+    deck is the rendered .pptx as bytes; returns the patched deck as a BytesIO,
+    or None if the deck has no content shape for the section (render it again instead).
+    """
+    prs = Presentation(BytesIO(deck))
+    shape_name = CONTENT_SHAPE_PREFIX + section['section']
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if shape.name == shape_name and shape.has_text_frame:
+                shape.text_frame.clear()
+                _write_section_text(shape.text_frame, section['content'], clean_source_text(section.get('sources', '')))
+                pptx_io = BytesIO()
+                prs.save(pptx_io)
+                pptx_io.seek(0)
+                return pptx_io
+    return None
+
+# Brand colors
+HEADER_COLOR_WHITE = RGBColor(255, 255, 255)  # White for headers
+BODY_COLOR_BLUE = RGBColor(10, 44, 77)        # Deep blue for body text - matches template
+
+# Map from section titles (from the JSON) to slide indexes in the template.
+# Slide 1 is the cover and slide 2 the table of contents; both are kept as they are.
+SECTION_TO_SLIDE = {
+    "Presenting Concerns and Goals": 2,     # Slide 3
+    "History Snapshot": 3,                  # Slide 4
+    "Behavioral Observations": 4,           # Slide 5
+    "Test Results by Domain": 5,            # Slide 6
+    "Integrative Case Formulation": 6,      # Slide 7
+    "Diagnoses": 7,                         # Slide 8
+    # For legacy support and backward compatibility:
+    "Profile Summary": 2,                   # Map to Presenting Concerns (slide 3)
+    "Key Strengths": 4,                     # Map to Behavioral Observations (slide 5)
+    "Potential Challenges": 5,              # Map to Test Results (slide 6)
+    "Psychological Style": 6,               # Map to Case Formulation (slide 7)
+    "Treatment Considerations": 7,          # Map to Diagnoses (slide 8)
+    "Risk Factors": 7                       # Map to Diagnoses (slide 8)
+}
+
+@lru_cache(maxsize=256)
+def resolve_section_slide(section_name):
+    """Template slide index for a section title, or None if it needs a slide of its own.
+
+    Exact titles come straight from SECTION_TO_SLIDE; other titles go through the fuzzy
+    matching chain once and the answer is kept for every later deck in the process.
+    """
+    slide_idx = SECTION_TO_SLIDE.get(section_name)
+    if slide_idx is None:
+        # Try more flexible matching for alternate section names
+        for map_name, idx in SECTION_TO_SLIDE.items():
+            # Check for strict containment first
+            if map_name.lower() in section_name.lower() or section_name.lower() in map_name.lower():
+                slide_idx = idx
+                print(f"Found slide match: '{section_name}' -> '{map_name}' (slide {idx+1})")
+                break
+
+        # If still no match, try more relaxed matching using section title subset
+        if (section_name.lower().startswith('present') or section_name.lower().startswith('concern')) and (idx == 2):
+            slide_idx = idx
+            print(f"Mapping '{section_name}' to slide {idx+1} (Presenting Concerns and Goals)")
+        elif "history" in section_name.lower() and (idx == 3):
+            slide_idx = idx
+            print(f"Mapping '{section_name}' to slide {idx+1} (History Snapshot)")
+        elif "observation" in section_name.lower() or "mental status" in section_name.lower() and (idx == 4):
+            slide_idx = idx
+            print(f"Mapping '{section_name}' to slide {idx+1} (Behavioral Observations)")
+        elif "test" in section_name.lower() or "results" in section_name.lower() and (idx == 5):
+            slide_idx = idx
+            print(f"Mapping '{section_name}' to slide {idx+1} (Test Results by Domain)")
+        elif "formulation" in section_name.lower() or "case" in section_name.lower() and (idx == 6):
+            slide_idx = idx
+            print(f"Mapping '{section_name}' to slide {idx+1} (Integrative Case Formulation)")
+        elif "diagnos" in section_name.lower() or "differential" in section_name.lower() and (idx == 7):
+            slide_idx = idx
+            print(f"Mapping '{section_name}' to slide {idx+1} (Diagnoses)")
+
+    # If still no match, try keyword matching for diagnosis or test sections
+    if slide_idx is None:
+        if "diagnos" in section_name.lower() or "dsm" in section_name.lower() or "icd" in section_name.lower():
+            slide_idx = 7  # Map to Diagnoses
+            print(f"Keyword mapping '{section_name}' to slide 8 (Diagnoses)")
+        elif "test" in section_name.lower() or "assessment" in section_name.lower() or "measure" in section_name.lower():
+            slide_idx = 5  # Map to Test Results
+            print(f"Keyword mapping '{section_name}' to slide 6 (Test Results)")
+        elif "history" in section_name.lower() or "background" in section_name.lower():
+            slide_idx = 3  # Map to History
+            print(f"Keyword mapping '{section_name}' to slide 4 (History Snapshot)")
+        elif "observation" in section_name.lower() or "mental status" in section_name.lower() or "mse" in section_name.lower():
+            slide_idx = 4  # Map to Behavioral Observations
+            print(f"Keyword mapping '{section_name}' to slide 5 (Behavioral Observations)")
+    return slide_idx
+
+def section_slide_table(section_names):
+    """Resolve every distinct section title once; returns {title: template slide index or None}."""
+    return {name: resolve_section_slide(name) for name in dict.fromkeys(section_names)}
+
+def _add_layout_slide(prs, section, title=None):
+    """Add a slide from the presentation's content layout and fill its title and body placeholders."""
+    slide_layout = prs.slide_layouts[1] if len(prs.slide_layouts) > 1 else prs.slide_layouts[0]
+    slide = prs.slides.add_slide(slide_layout)
+    # Set title if possible
+    title_shape = None
+    for shape in slide.shapes:
+        if shape.name.startswith('Title'):
+            title_shape = shape
+            break
+    if title_shape and hasattr(title_shape, 'text_frame'):
+        title_shape.text_frame.text = title or section['section']
+        # Set title font to white for contrast against blue background
+        for paragraph in title_shape.text_frame.paragraphs:
+            if hasattr(paragraph.font, 'color') and hasattr(paragraph.font.color, 'rgb'):
+                paragraph.font.color.rgb = HEADER_COLOR_WHITE
+            if hasattr(paragraph.font, 'bold'):
+                paragraph.font.bold = True
+            if hasattr(paragraph.font, 'size'):
+                paragraph.font.size = 32 * 12700  # 32pt for headers
+
+    # Add content
+    content = section['content']
+    sources = section.get('sources', '')
+
+    # Clean up sources to remove temporary filenames
+    sources = clean_source_text(sources)
+
+    content_shape = None
+    for shape in slide.placeholders:
+        if shape.placeholder_format.type == 1:  # MSO_PLACEHOLDER.BODY
+            content_shape = shape
+            break
+    if content_shape:
+        content_shape.text_frame.clear()
+        _write_section_text(content_shape.text_frame, content, sources)
+        content_shape.name = CONTENT_SHAPE_PREFIX + section['section']
+
+def _fill_template_slide(prs, slide, slide_idx, section_name, content, sources):
+    """Write a section into a template slide, leaving the template's title alone."""
+    print(f"Adding content to slide {slide_idx+1} for section '{section_name}'")
+
+    # IMPORTANT CHANGE: SKIP ALL TITLE MANIPULATION
+    # We will leave the template titles exactly as they are
+
+    # FIND OR CREATE CONTENT SHAPE
+    content_shape = None
+
+    # Look for existing content shapes (not the title)
+    for shape in slide.shapes:
+        if hasattr(shape, 'text_frame'):
+            # Skip any shape that looks like a title (usually at the top of slide)
+            if hasattr(shape, 'top') and shape.top < 1000000:  # ~1 inch from top
+                continue
+            # Use the first non-title text shape we find for content
+            content_shape = shape
+            print(f"Found content shape in slide {slide_idx+1}")
+            break
+
+    # If no content shape found, create a new textbox for content
+    if not content_shape:
+        try:
+            # Create new textbox with better positioning (below title)
+            content_left = 0.5 * 914400    # 0.5 inch from left
+            content_top = 650000     # 0.5 inches from top (below title)
+            content_width = prs.slide_width - (1 * 914400)  # Full width minus 1 inch
+            content_height = prs.slide_height - content_top - (0.5 * 914400)  # From top to bottom with margin
+
+            content_shape = slide.shapes.add_textbox(content_left, content_top, content_width, content_height)
+            print(f"Created new content textbox on slide {slide_idx+1}")
+        except Exception as e:
+            print(f"Error creating content textbox: {e}")
+
+    if content_shape:
+        try:
+            # Clear existing text
+            if hasattr(content_shape, 'text_frame'):
+                content_shape.text_frame.clear()
+
+            # Adjust position for better spacing from header
+            if hasattr(content_shape, 'top'):
+                try:
+                    if content_shape.top < 650000:
+                        content_shape.top = 650000
+                except:
+                    pass
+
+            # Enable word wrap 
+            if hasattr(content_shape, 'text_frame') and hasattr(content_shape.text_frame, 'word_wrap'):
+                content_shape.text_frame.word_wrap = True
+
+            # Add margins to text frame if possible
+            if hasattr(content_shape, 'text_frame') and hasattr(content_shape.text_frame, 'margin_top'):
+                try:
+                    # Add generous margins
+                    content_shape.text_frame.margin_top = 300000     # ~8mm top margin
+                    content_shape.text_frame.margin_bottom = 150000  # ~4mm bottom margin
+                    content_shape.text_frame.margin_left = 150000    # ~4mm left margin
+                    content_shape.text_frame.margin_right = 150000   # ~4mm right margin
+                except:
+                    pass
+
+            # Add main content as bullet-aware paragraphs, then sources
+            _write_section_text(content_shape.text_frame, content, sources)
+            content_shape.name = CONTENT_SHAPE_PREFIX + section_name
+
+            print(f"Successfully added content to slide {slide_idx+1}")
+        except Exception as e:
+            print(f"Error setting content on slide {slide_idx+1}: {e}")
+
+def _add_section_slide(prs, section_name, content, sources):
+    """Add a slide with a title bar and a content box for a section the template has no slide for."""
+    # Add a new slide with appropriate formatting
+    slide_layout = prs.slide_layouts[1] if len(prs.slide_layouts) > 1 else prs.slide_layouts[0]
+    slide = prs.slides.add_slide(slide_layout)
+
+    # Create proper title with blue background
+    try:
+        # Create a title box with blue background
+        title_left = 0
+        title_top = 0
+        title_width = prs.slide_width
+        title_height = 0.8 * 914400  # 0.8 inches
+
+        # Add shape for title background
+        title_shape = slide.shapes.add_textbox(title_left, title_top, title_width, title_height)
+
+        # Apply blue background
+        if hasattr(title_shape, 'fill'):
+            title_shape.fill.solid()
+            title_shape.fill.fore_color.rgb = RGBColor(10, 44, 77)
+
+        # Add title text
+        title_shape.text_frame.clear()
+        p = title_shape.text_frame.add_paragraph()
+        p.text = section_name
+        p.alignment = 1  # Center
+
+        # Format title - white text
+        if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
+            p.font.color.rgb = RGBColor(255,255,255)
+        if hasattr(p.font, 'bold'):
+            p.font.bold = True
+        if hasattr(p.font, 'size'):
+            p.font.size = 36 * 12700  # 36pt (increased from 32pt)
+
+        # Apply to all runs
+        for run in p.runs:
+            if hasattr(run.font, 'color') and hasattr(run.font.color, 'rgb'):
+                run.font.color.rgb = RGBColor(255,255,255)
+            if hasattr(run.font, 'bold'):
+                run.font.bold = True
+            if hasattr(run.font, 'size'):
+                run.font.size = 36 * 12700  # 36pt (increased from 32pt)
+    except Exception as e:
+        print(f"Error creating title on new slide: {e}")
+
+    # Create content box
+    try:
+        # Create content box
+        content_left = 0.5 * 914400    # 0.5 inch from left
+        content_top = 650000     # 1.2 inches from top (below title)
+        content_width = prs.slide_width - (1 * 914400)  # Full width minus 1 inch margins
+        content_height = prs.slide_height - content_top - (0.5 * 914400)  # To bottom with margin
+
+        content_shape = slide.shapes.add_textbox(content_left, content_top, content_width, content_height)
+        content_shape.name = CONTENT_SHAPE_PREFIX + section_name
+
+        # Add margins to text frame
+        if hasattr(content_shape, 'text_frame') and hasattr(content_shape.text_frame, 'margin_top'):
+            content_shape.text_frame.margin_top = 300000     # Top margin
+            content_shape.text_frame.margin_bottom = 150000  # Bottom margin
+            content_shape.text_frame.margin_left = 150000    # Left margin
+            content_shape.text_frame.margin_right = 150000   # Right margin
+
+        # Enable word wrap
+        if hasattr(content_shape, 'text_frame') and hasattr(content_shape.text_frame, 'word_wrap'):
+            content_shape.text_frame.word_wrap = True
+
+        # Add content
+        p = content_shape.text_frame.add_paragraph()
+        p.text = content
+
+        # Format content - blue text
+        if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
+            p.font.color.rgb = RGBColor(10, 44, 77)
+        if hasattr(p.font, 'name'):
+            p.font.name = "Calibri"
+        if hasattr(p.font, 'size'):
+            p.font.size = 18 * 12700  # 18pt (increased from 12pt)
+
+        # Apply to all runs
+        for run in p.runs:
+            if hasattr(run.font, 'color') and hasattr(run.font.color, 'rgb'):
+                run.font.color.rgb = RGBColor(10, 44, 77)
+            if hasattr(run.font, 'name'):
+                run.font.name = "Calibri"
+            if hasattr(run.font, 'size'):
+                run.font.size = 18 * 12700  # 18pt (increased from 12pt)
+
+        # Add sources if available
+        if sources:
+            p = content_shape.text_frame.add_paragraph()
+            p.text = f"Sources: {sources}"
+
+            # Format sources - italic
+            if hasattr(p.font, 'italic'):
+                p.font.italic = True
+            if hasattr(p.font, 'name'):
+                p.font.name = "Calibri"
+            if hasattr(p.font, 'color') and hasattr(p.font.color, 'rgb'):
+                p.font.color.rgb = RGBColor(10, 44, 77)
+            if hasattr(p.font, 'size'):
+                p.font.size = 18 * 12700  # 18pt (increased from 12pt)
+    except Exception as e:
+        print(f"Error creating content on new slide: {e}")
+
+def generate_pptx_from_json(json_data, template_path=None):
+    """
+    Generate a PowerPoint presentation from structured JSON data.
+    Uses a template if provided, otherwise creates a new presentation.
+    Maps each section to the appropriate slide in the template.
+    """
+    # Load template if provided, otherwise use blank
+    if template_path:
+        try:
+            prs = Presentation(template_path)
+            print(f"Using template: {template_path}")
+            # Debug template info
+            print(f"Template has {len(prs.slides)} slides")
+            for i, slide in enumerate(prs.slides):
+                print(f"Slide {i+1}: {len(slide.shapes)} shapes")
+                
+            # Debug theme colors
+            if hasattr(prs, 'theme') and hasattr(prs.theme, 'theme_color_scheme'):
+                print("\nTHEME COLORS:")
+                for idx, color in enumerate(prs.theme.theme_color_scheme.colors):
+                    if hasattr(color, 'rgb'):
+                        r, g, b = color.rgb >> 16, (color.rgb >> 8) & 0xFF, color.rgb & 0xFF
+                        print(f"  Color {idx+1}: RGB({r},{g},{b})")
+                    else:
+                        print(f"  Color {idx+1}: [No RGB value available]")
+            else:
+                print("\nNo theme color information available")
+        except Exception as e:
+            print(f"Error loading template: {e}")
+            prs = Presentation()
+    else:
+        prs = Presentation()
+        
+    # If using a blank presentation, create slides for each section
+    if template_path is None or len(prs.slides) < 2:  # If no template or not enough slides
+        for section in json_data:
+            _add_layout_slide(prs, section)
+    else:
+        # Using the template - map sections to specific slides
+        
+        # Process each section from the JSON data
+        print(f"Processing {len(json_data)} sections")
+        for section in json_data:
+            section_name = section['section']
+            print(f"Processing section: '{section_name}'")
+                
+            content = section['content']
+            sources = section.get('sources', '')
+            
+            # Clean up sources to remove temporary filenames
+            sources = clean_source_text(sources)
+            
+            # Find the slide index for this section
+            slide_idx = resolve_section_slide(section_name)
+            
+            if slide_idx is not None and slide_idx < len(prs.slides):
+                _fill_template_slide(prs, prs.slides[slide_idx], slide_idx, section_name, content, sources)
+            else:
+                print(f"No matching slide found for section '{section_name}', creating new slide")
+                _add_section_slide(prs, section_name, content, sources)
+    
+    # Save to BytesIO
+    pptx_io = BytesIO()
+    prs.save(pptx_io)
+    pptx_io.seek(0)
+    return pptx_io
+
+TEAM_MEMBER_PREFIX = "Team Member: "
+_REL_ATTR_PREFIX = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+def _clone_slide(prs, source):
+    """Append a copy of a slide (same layout, shapes and background; speaker notes are not copied)."""
+    slide = prs.slides.add_slide(source.slide_layout)
+    tree = slide.shapes._spTree
+    for shape in list(slide.shapes):
+        # Placeholders the layout added; the copied shapes replace them
+        tree.remove(shape._element)
+    for element in source.shapes._spTree.iterchildren():
+        if element.tag.endswith(('}nvGrpSpPr', '}grpSpPr')):
+            continue
+        element = deepcopy(element)
+        # Pictures, media and links refer to the source slide's relationships; point them at the clone's
+        for node in element.iter():
+            for attr, rId in node.attrib.items():
+                if attr.startswith(_REL_ATTR_PREFIX):
+                    rel = source.part.rels[rId]
+                    target = rel.target_ref if rel.is_external else rel.target_part
+                    node.set(attr, slide.part.relate_to(target, rel.reltype, is_external=rel.is_external))
+        tree.insert_element_before(element, 'p:extLst')
+    background = source._element.cSld.bg
+    if background is not None:
+        slide._element.cSld.insert(0, deepcopy(background))
+    return slide
+
+def _drop_slide(prs, slide):
+    """Remove a slide from the deck; its part is no longer written when the deck is saved."""
+    slide_ids = prs.slides._sldIdLst
+    for slide_id in list(slide_ids):
+        if prs.part.related_part(slide_id.rId) is slide.part:
+            slide_ids.remove(slide_id)
+            prs.part.drop_rel(slide_id.rId)
+
+def _add_member_slide(prs, name, layout):
+    """Add a full-slide divider naming the team member whose slides follow."""
+    slide = prs.slides.add_slide(layout)
+    for shape in list(slide.shapes):
+        slide.shapes._spTree.remove(shape._element)
+    banner = slide.shapes.add_textbox(0, 0, prs.slide_width, prs.slide_height)
+    banner.name = TEAM_MEMBER_PREFIX + name
+    banner.fill.solid()
+    banner.fill.fore_color.rgb = BODY_COLOR_BLUE
+    banner.text_frame.word_wrap = True
+    banner.text_frame.vertical_anchor = MSO_ANCHOR.MIDDLE
+    p = banner.text_frame.paragraphs[0]
+    p.text = name
+    p.alignment = PP_ALIGN.CENTER
+    p.font.bold = True
+    p.font.size = Pt(44)
+    p.font.color.rgb = HEADER_COLOR_WHITE
+    return slide
+
+def generate_team_pptx(profiles, template_path=None, on_profile=None):
+    """
+    Generate one deck holding several individuals' profiles.
+    profiles is a list of {"name": ..., "profile": [sections]}.
+
+    The template is loaded once and every section title is resolved once through
+    section_slide_table. Each individual gets a divider slide followed by clones of the
+    template slides their sections fill (in template order), then slides for sections
+    the template has no slide for. The cover and contents slides appear once, and the
+    template's own section slides are removed. Without a template, each section gets a
+    layout slide titled "<name>: <section>".
+    on_profile(name, seconds) is called after each individual's slides are built.
+    """
+    prs = None
+    if template_path:
+        try:
+            prs = Presentation(template_path)
+        except Exception as e:
+            print(f"Error loading template: {e}")
+    if prs is None:
+        prs = Presentation()
+    use_template = template_path is not None and len(prs.slides) >= 2
+    templates = list(prs.slides)
+    table = section_slide_table(section['section'] for member in profiles for section in member['profile'])
+    if use_template:
+        layout = templates[min(2, len(templates) - 1)].slide_layout
+    else:
+        layout = prs.slide_layouts[1] if len(prs.slide_layouts) > 1 else prs.slide_layouts[0]
+
+    for member in profiles:
+        start = time.perf_counter()
+        name = member['name']
+        _add_member_slide(prs, name, layout)
+        if not use_template:
+            for section in member['profile']:
+                _add_layout_slide(prs, section, title=f"{name}: {section['section']}")
+        else:
+            # As in generate_pptx_from_json, a later section mapped to the same slide replaces an earlier one
+            by_slide = {}
+            unmatched = []
+            for section in member['profile']:
+                slide_idx = table[section['section']]
+                if slide_idx is not None and slide_idx < len(templates):
+                    by_slide[slide_idx] = section
+                else:
+                    unmatched.append(section)
+            for slide_idx in sorted(by_slide):
+                section = by_slide[slide_idx]
+                slide = _clone_slide(prs, templates[slide_idx])
+                _fill_template_slide(prs, slide, slide_idx, section['section'], section['content'],
+                                     clean_source_text(section.get('sources', '')))
+            for section in unmatched:
+                _add_section_slide(prs, section['section'], section['content'],
+                                   clean_source_text(section.get('sources', '')))
+        if on_profile is not None:
+            on_profile(name, time.perf_counter() - start)
+
+    if use_template:
+        for slide in templates[2:]:
+            _drop_slide(prs, slide)
+
+    pptx_io = BytesIO()
+    prs.save(pptx_io)
+    pptx_io.seek(0)
+    return pptx_io
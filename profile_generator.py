@@ -1,8 +1,21 @@
+import asyncio
+import json
 import os
-from openai import OpenAI
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import openai
+from openai import AsyncOpenAI, OpenAI
 from typing import List
 from dotenv import load_dotenv
 import re
+import assessment_types
+import metrics
+from model_router import router
+import profile_schema
+import prompt_templates
+from tokens import count_tokens, encoding as token_encoding
+from digest_cache import DigestCache
 
 # Load environment variables
 load_dotenv()
@@ -12,176 +25,441 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("OPENAI_API_KEY environment variable is not set. Please check your .env file.")
 
-client = OpenAI(api_key=api_key)
+# Retries are handled in ProfileGenerator._chat so that each attempt is counted
+client = OpenAI(api_key=api_key, max_retries=0)
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# Model, max_tokens and timeout per task come from the tier configuration (model_tiers.json)
+DEFAULT_MODEL = router.route("profile").model
+
+# Request parameters per task, shared by the sync and async call paths
+PROFILE_PARAMS = {"temperature": 0.4, **router.params("profile")}
+# Constrain profile replies to the section schema; disable for endpoints without structured output
+if os.getenv("LLM_STRUCTURED_OUTPUT", "1").lower() not in ("0", "false", "no"):
+    PROFILE_PARAMS["response_format"] = profile_schema.response_format()
+SECTIONS_PARAMS = dict(PROFILE_PARAMS, **router.params("sections"))
+ANSWER_PARAMS = {"temperature": 0.4, **router.params("answer")}
+DIGEST_PARAMS = {"temperature": 0.0, **router.params("digest")}
+REFERENCE_DIGEST_PARAMS = {"temperature": 0.0, **router.params("reference_digest")}
+# Reply budget per section when only some sections are regenerated
+SECTION_MAX_TOKENS = 600
+
+# Prompts estimated above this many tokens (including the reply) switch to
+# map-reduce: each case document is condensed into an evidence digest first.
+# The default leaves headroom below gpt-4.1's 1,047,576-token window.
+CONTEXT_BUDGET_TOKENS = int(os.getenv("LLM_CONTEXT_BUDGET_TOKENS", "1000000"))
+# Documents longer than this are digested in parts
+DIGEST_PART_TOKENS = int(os.getenv("DIGEST_PART_TOKENS", "30000"))
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "4"))
+
+# What to do with a prompt that cannot fit the model's context window with its reply:
+# "trim" cuts case text from the middle of the last message, "reject" raises PromptTooLarge
+LLM_OVERBUDGET = os.getenv("LLM_OVERBUDGET", "trim").lower()
+# Trimming keeps this many tokens at the end of the prompt (closing instructions)
+TRIM_KEEP_TAIL_TOKENS = 1000
+
+class PromptTooLarge(ValueError):
+    """A prompt does not fit the model's context window and LLM_OVERBUDGET is "reject"."""
+
+# Shared by every generator in the process, so re-runs only digest new documents
+digest_cache = DigestCache(os.getenv("DIGEST_CACHE_DIR") or None)
+
+def _trim_middle(text: str, excess_tokens: int) -> str:
+    """Remove about excess_tokens tokens just before the last TRIM_KEEP_TAIL_TOKENS tokens of text."""
+    marker = "\n[... trimmed to fit the model's context window ...]\n"
+    enc = token_encoding()
+    if enc is not None:
+        tokens = enc.encode(text, disallowed_special=())
+        cut_end = max(len(tokens) - TRIM_KEEP_TAIL_TOKENS, 0)
+        cut_start = max(cut_end - excess_tokens - count_tokens(marker), 0)
+        return enc.decode(tokens[:cut_start]) + marker + enc.decode(tokens[cut_end:])
+    cut_end = max(len(text) - TRIM_KEEP_TAIL_TOKENS * 4, 0)
+    cut_start = max(cut_end - (excess_tokens + count_tokens(marker)) * 4, 0)
+    return text[:cut_start] + marker + text[cut_end:]
+
+def _case_chunks(document_chunks: List[str], reference_docs: List[str] = None) -> List[str]:
+    """Drop reference documents from the retrieved chunks; they are sent in the prompt prefix instead."""
+    if not reference_docs:
+        return list(document_chunks)
+    reference = set(reference_docs)
+    return [chunk for chunk in document_chunks if chunk not in reference]
+
+def _split_for_digest(text: str, max_tokens: int) -> List[str]:
+    """Split a long document into parts of roughly max_tokens, preferring paragraph boundaries."""
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    max_chars = max_tokens * 4
+    parts = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        parts.append(current)
+    return parts
+
+def _pack_chunks(chunks: List[str], max_tokens: int) -> List[str]:
+    """Join consecutive chunks (pages) into documents of up to roughly max_tokens, so digests are not per page."""
+    packed = []
+    current = []
+    size = 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk)
+        if current and size + tokens > max_tokens:
+            packed.append("\n\n".join(current))
+            current = []
+            size = 0
+        current.append(chunk)
+        size += tokens
+    if current:
+        packed.append("\n\n".join(current))
+    return packed
+
+def _cached_tokens(usage) -> int:
+    """Prompt tokens served from the provider's prompt cache, if the response reports them."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
 
 class ProfileGenerator:
-    def __init__(self):
+    def __init__(self, base_url: str = None, stream: bool = None, slots=None):
+        # A base URL points the generator at another OpenAI-compatible endpoint,
+        # e.g. stub_llm_server.py; OPENAI_BASE_URL does the same for the default client
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0) if base_url else client
+        self.base_url = base_url
+        self._async_client = None
+        if stream is None:
+            stream = os.getenv("LLM_STREAM", "").lower() in ("1", "true", "yes")
+        self.stream = stream
+        # Optional semaphore bounding this generator's in-flight synchronous requests, map-reduce
+        # digest calls included; a slot is held per request, not while waiting to retry
+        self.slots = slots or nullcontext()
         self.system_prompt = """You are a world-class expert in psychology, psychological assessment, and mental health. You specialize in synthesizing diverse data sources—such as psychological assessments, medical history, therapy notes, and diagnostic evaluations—into insightful, psychologically sophisticated profiles. Your goal is to produce actionable insights, grounded in evidence, that support treatment planning and patient care. Always cite the data source behind your claims and remain both rigorous and humanistic in tone."""
 
-    def generate_profile(self, document_chunks: List[str], metadata: List[dict] = None) -> str:
+    def _chat(self, task: str, messages: List[dict], **kwargs) -> str:
+        """Send a chat completion and return its text, retrying transient failures and recording latency and token usage."""
+        model, tier = self._route(task, kwargs)
+        with metrics.span("llm_call", task=task, model=model, tier=tier) as span:
+            messages, prompt_tokens = self._preflight(task, model, messages, kwargs)
+            span.record(prompt_tokens_est=prompt_tokens)
+            attempt = 0
+            while True:
+                try:
+                    with self.slots:
+                        if self.stream:
+                            content = self._stream_completion(span, model, messages, **kwargs)
+                        else:
+                            response = self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+                            content = response.choices[0].message.content
+                            usage = getattr(response, "usage", None)
+                            if usage is not None:
+                                span.record(prompt_tokens=usage.prompt_tokens or 0,
+                                            completion_tokens=usage.completion_tokens or 0,
+                                            cached_tokens=_cached_tokens(usage))
+                    break
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= LLM_MAX_RETRIES:
+                        raise
+                    attempt += 1
+                    span.record(retries=1)
+                    delay = self._retry_delay(e, attempt)
+                    print(f"LLM call for {task} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+            self._record_usage(task, model, tier, span.attrs)
+        return content
+
+    @staticmethod
+    def _preflight(task: str, model: str, messages: List[dict], kwargs: dict):
+        """Count a call's prompt tokens before sending it, trimming or rejecting a prompt that cannot fit.
+
+        Returns the messages to send and their prompt token count.
+        """
+        prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+        context_tokens = router.context_tokens(model)
+        reply_tokens = kwargs.get("max_tokens") or 0
+        budget = context_tokens - reply_tokens
+        if not context_tokens or prompt_tokens <= budget:
+            return messages, prompt_tokens
+        metrics.registry.inc("llm_preflight_over_budget_total", task=task, action=LLM_OVERBUDGET)
+        if LLM_OVERBUDGET == "reject":
+            raise PromptTooLarge(f"The {task} prompt is {prompt_tokens} tokens; {model} fits {budget} "
+                                 f"alongside a {reply_tokens}-token reply")
+        excess = prompt_tokens - budget
+        print(f"The {task} prompt is {excess} tokens over {model}'s context window; trimming case text")
+        messages = messages[:-1] + [dict(messages[-1], content=_trim_middle(messages[-1]["content"], excess))]
+        return messages, sum(count_tokens(m["content"]) for m in messages)
+
+    @staticmethod
+    def _record_usage(task: str, model: str, tier: str, attrs: dict, batch: bool = False):
+        """Add a call's token usage (the API's figures, or estimates if it sent none) and cost to the usage ledger."""
+        prompt_tokens = attrs.get("prompt_tokens", attrs.get("prompt_tokens_est", 0))
+        cached_tokens = attrs.get("cached_tokens", 0)
+        completion_tokens = attrs.get("completion_tokens", 0)
+        cost = router.cost(model, prompt_tokens, cached_tokens, completion_tokens, batch=batch)
+        metrics.usage.record(prompt_tokens, cached_tokens, completion_tokens, cost, task=task, model=model, tier=tier)
+
+    @staticmethod
+    def _route(task: str, kwargs: dict):
+        """Model and tier for a call: the task's route, unless the caller passed a model."""
+        route = router.route(task)
+        return kwargs.pop("model", route.model), route.tier
+
+    @staticmethod
+    def _retry_delay(error, attempt: int) -> float:
+        """Backoff before the next attempt, honouring the server's retry-after header."""
+        delay = min(0.5 * 2 ** attempt, 8.0)
+        retry_after = getattr(getattr(error, "response", None), "headers", {}).get("retry-after")
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                pass
+        return delay
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """AsyncOpenAI client for the same endpoint, created on first use inside the event loop."""
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(api_key=api_key, base_url=self.base_url, max_retries=0)
+        return self._async_client
+
+    async def _achat(self, task: str, messages: List[dict], **kwargs) -> str:
+        """Async counterpart of _chat for the API server: same retries, spans and token accounting."""
+        model, tier = self._route(task, kwargs)
+        with metrics.span("llm_call", task=task, model=model, tier=tier) as span:
+            messages, prompt_tokens = self._preflight(task, model, messages, kwargs)
+            span.record(prompt_tokens_est=prompt_tokens)
+            attempt = 0
+            while True:
+                try:
+                    response = await self.async_client.chat.completions.create(model=model, messages=messages, **kwargs)
+                    content = response.choices[0].message.content
+                    usage = getattr(response, "usage", None)
+                    if usage is not None:
+                        span.record(prompt_tokens=usage.prompt_tokens or 0, completion_tokens=usage.completion_tokens or 0,
+                                    cached_tokens=_cached_tokens(usage))
+                    break
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= LLM_MAX_RETRIES:
+                        raise
+                    attempt += 1
+                    span.record(retries=1)
+                    delay = self._retry_delay(e, attempt)
+                    print(f"LLM call for {task} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            self._record_usage(task, model, tier, span.attrs)
+        return content
+
+    async def astream(self, task: str, messages: List[dict], **kwargs):
+        """Yield completion text deltas as they arrive, recording the same llm_call metrics as _chat.
+
+        Retries only happen before the first token; once text has been yielded a failure is raised.
+        """
+        model, tier = self._route(task, kwargs)
+        labels = {"task": task, "model": model, "tier": tier}
+        messages, prompt_tokens = self._preflight(task, model, messages, kwargs)
+        # A span would be held open across yields, so time the call by hand
+        metrics.registry.inc("llm_call_prompt_tokens_est_total", prompt_tokens, **labels)
+        start = time.perf_counter()
+        parts = []
+        usage = None
+        attempt = 0
+        try:
+            while True:
+                try:
+                    stream = await self.async_client.chat.completions.create(
+                        model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **kwargs)
+                    async for chunk in stream:
+                        if getattr(chunk, "usage", None) is not None:
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if not parts:
+                                metrics.registry.observe("llm_ttft_seconds", time.perf_counter() - start, model=model)
+                            parts.append(delta)
+                            yield delta
+                    break
+                except RETRYABLE_ERRORS as e:
+                    if parts or attempt >= LLM_MAX_RETRIES:
+                        raise
+                    attempt += 1
+                    metrics.registry.inc("llm_call_retries_total", **labels)
+                    delay = self._retry_delay(e, attempt)
+                    print(f"LLM stream for {task} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+        finally:
+            metrics.registry.observe("llm_call_seconds", time.perf_counter() - start, **labels)
+            if usage is not None:
+                metrics.registry.inc("llm_call_prompt_tokens_total", usage.prompt_tokens or 0, **labels)
+                metrics.registry.inc("llm_call_completion_tokens_total", usage.completion_tokens or 0, **labels)
+                metrics.registry.inc("llm_call_cached_tokens_total", _cached_tokens(usage), **labels)
+            else:
+                metrics.registry.inc("llm_call_completion_tokens_total", count_tokens("".join(parts)), **labels)
+            if parts:
+                if usage is not None:
+                    attrs = {"prompt_tokens": usage.prompt_tokens or 0, "cached_tokens": _cached_tokens(usage),
+                             "completion_tokens": usage.completion_tokens or 0}
+                else:
+                    attrs = {"prompt_tokens_est": prompt_tokens, "completion_tokens": count_tokens("".join(parts))}
+                self._record_usage(task, model, tier, attrs)
+
+    def _stream_completion(self, span, model: str, messages: List[dict], **kwargs) -> str:
+        """Consume a streamed completion, recording time to first token."""
+        start = time.perf_counter()
+        parts = []
+        usage = None
+        stream = self.client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                     stream_options={"include_usage": True}, **kwargs)
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts:
+                    ttft = time.perf_counter() - start
+                    span.record(ttft_ms=round(ttft * 1000, 1))
+                    metrics.registry.observe("llm_ttft_seconds", ttft, model=model)
+                parts.append(delta)
+        content = "".join(parts)
+        if usage is not None:
+            span.record(prompt_tokens=usage.prompt_tokens or 0, completion_tokens=usage.completion_tokens or 0,
+                        cached_tokens=_cached_tokens(usage))
+        else:
+            # Endpoints that ignore stream_options send no usage chunk
+            span.record(completion_tokens=count_tokens(content))
+        return content
+
+    def profile_messages(self, document_chunks: List[str], metadata: List[dict] = None, reference_docs: List[str] = None,
+                         sections: List[str] = None, guidance: str = None):
+        """Build the chat messages for a profile request, returning them with the filename to document-type map.
+
+        reference_docs are moved out of document_chunks into the static prompt prefix;
+        sections restricts the request to those profile sections, revised per guidance.
+        """
+        with metrics.span("prompt_assembly", task="profile" if sections is None else "sections") as span:
+            case_chunks = _case_chunks(document_chunks, reference_docs)
+            prefix, case_prompt, doc_type_map = self._build_profile_prompt(case_chunks, metadata, reference_docs,
+                                                                           sections=sections, guidance=guidance)
+            prefix_tokens = count_tokens(self.system_prompt) + count_tokens(prefix)
+            case_tokens = count_tokens(case_prompt)
+            if prefix_tokens + case_tokens + PROFILE_PARAMS["max_tokens"] > CONTEXT_BUDGET_TOKENS:
+                span.record(map_reduce=1)
+                digests = self.digest_documents(_pack_chunks(case_chunks, DIGEST_PART_TOKENS))
+                prefix, case_prompt, doc_type_map = self._build_profile_prompt(
+                    case_chunks, metadata, reference_docs, context_chunks=digests, sections=sections, guidance=guidance)
+                case_tokens = count_tokens(case_prompt)
+            span.record(prompt_tokens=prefix_tokens + case_tokens, prefix_tokens=prefix_tokens)
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prefix + case_prompt}
+        ]
+        return messages, doc_type_map
+
+    def generate_profile(self, document_chunks: List[str], metadata: List[dict] = None, reference_docs: List[str] = None) -> str:
         """Generate a psychology profile from document chunks and optional metadata, returning structured JSON output."""
-        # Build the document type list for the LLM prompt and for the report
-        doc_types = list(dict.fromkeys(meta['file_type'] for meta in metadata)) if metadata else []
-        doc_type_list = "\n".join(f"- {doc_type}" for doc_type in doc_types)
+        messages, doc_type_map = self.profile_messages(document_chunks, metadata, reference_docs)
+        profile_content = self._chat("profile", messages, **PROFILE_PARAMS)
+        return self.complete_profile(profile_content, doc_type_map, document_chunks, metadata, reference_docs)
 
-        # Create a mapping of document types for cleaning up sources later
-        doc_type_map = {}
-        
-        # Identify the types of documents based on content
-        assessment_types = []
-        
-        # Check for Hogan assessment content
-        hogan_terms = ["hogan", "hpi", "hds", "mvpi", "motives values preferences", "personality inventory", "development survey"]
-        has_hogan = any(term in " ".join(document_chunks).lower() for term in hogan_terms)
-        if has_hogan:
-            assessment_types.append("Hogan Assessment")
-            
-        # Check for 360 content
-        has_360 = "360" in " ".join(document_chunks) or "360-degree" in " ".join(document_chunks).lower()
-        if has_360:
-            assessment_types.append("360° Feedback")
-            
-        # Check for CV/Resume content
-        cv_terms = ["cv", "resume", "résumé", "curriculum vitae", "work history", "professional experience", "education:"]
-        has_cv = any(term in " ".join(document_chunks).lower() for term in cv_terms)
-        if has_cv:
-            assessment_types.append("CV/Resume")
-            
-        # Check for Intercultural Development Inventory
-        intercultural_terms = ["intercultural development inventory", "intercultural sensitivity", "cultural competence"]
-        has_intercultural = any(term in " ".join(document_chunks).lower() for term in intercultural_terms)
-        if has_intercultural:
-            assessment_types.append("Intercultural Development Assessment")
-        
-        # Check for Individual Directions Inventory
-        individual_directions_terms = ["individual directions inventory", "idi report", "directions inventory"]
-        has_directions = any(term in " ".join(document_chunks).lower() for term in individual_directions_terms)
-        if has_directions:
-            assessment_types.append("Individual Directions Inventory")
-        
-        # Check for performance reviews
-        perf_terms = ["performance review", "annual review", "performance assessment", "performance rating"]
-        has_perf = any(term in " ".join(document_chunks).lower() for term in perf_terms)
-        if has_perf:
-            assessment_types.append("Performance Review")
-        
-        # Check for interview notes
-        interview_terms = ["interview notes", "interview summary", "candidate interview"]
-        has_interview = any(term in " ".join(document_chunks).lower() for term in interview_terms)
-        if has_interview:
-            assessment_types.append("Interview Notes")
+    async def agenerate_profile(self, document_chunks: List[str], metadata: List[dict] = None,
+                                reference_docs: List[str] = None) -> str:
+        """Async generate_profile, for callers running inside an event loop."""
+        # Prompt assembly may digest oversized packets with blocking calls
+        messages, doc_type_map = await asyncio.to_thread(self.profile_messages, document_chunks, metadata, reference_docs)
+        profile_content = await self._achat("profile", messages, **PROFILE_PARAMS)
+        # Re-requesting missing sections makes a blocking call
+        return await asyncio.to_thread(self.complete_profile, profile_content, doc_type_map, document_chunks,
+                                       metadata, reference_docs)
 
-        if metadata:
-            for meta in metadata:
-                if 'file_name' in meta and 'file_type' in meta:
-                    # Map temporary filenames to their document types
-                    file_name = meta['file_name']
-                    file_type = meta['file_type'].upper()
-                    
-                    # Parse meaningful document type from filename if possible
-                    doc_type = None
-                    
-                    # Check if it's a Hogan assessment
-                    if 'hogan' in file_name.lower():
-                        doc_type = "Hogan Assessment"
-                    # Check if it's a 360 assessment
-                    elif '360' in file_name:
-                        doc_type = "360° Feedback"
-                    # Check if it's a CV or resume
-                    elif any(term in file_name.lower() for term in ['cv', 'resume', 'résumé']):
-                        doc_type = "CV/Resume"
-                    # Check if it's an IDI assessment
-                    elif 'idi' in file_name.lower():
-                        doc_type = "IDI Assessment"
-                    # Otherwise use a more generic but still descriptive term
-                    else:
-                        doc_type = f"{file_type} Document"
-                    
-                    doc_type_map[file_name] = doc_type
+    def parse_profile(self, content: str, task: str = "profile", expected: List[str] = None):
+        """Sections of a profile reply, repaired locally if it is malformed, and the expected sections it lacks."""
+        with metrics.span("json_parse", task=task) as span:
+            try:
+                sections, repaired = profile_schema.parse_sections(content)
+                outcome = "repaired" if repaired else "ok"
+            except ValueError as e:
+                print(f"Could not recover any section from the {task} reply: {e}")
+                sections, outcome = [], "failed"
+            span.record(sections=len(sections))
+        metrics.registry.inc("profile_json_total", task=task, outcome=outcome)
+        present = {section["section"] for section in sections}
+        missing = [name for name in expected or [] if name not in present]
+        if missing:
+            metrics.registry.inc("profile_sections_missing_total", len(missing), task=task)
+        return sections, missing
 
-        # Combine detected document types with the filenames
-        detected_doc_types = ", ".join(assessment_types) if assessment_types else "Submitted Documents"
+    def repair_profile(self, profile_content: str, doc_type_map: dict) -> str:
+        """Local-only completion of a profile reply (for streamed and Batch API replies): repair, order and clean sources."""
+        sections, _ = self.parse_profile(profile_content, expected=assessment_types.PROFILE_SECTIONS)
+        if sections:
+            profile_content = json.dumps(profile_schema.in_profile_order(sections), ensure_ascii=False)
+        return self.clean_profile_sources(profile_content, doc_type_map)
 
-        doc_summary_prompt = (
-            "You have been provided with the following types of documents for your analysis:\n"
-            f"{doc_type_list}\n\n"
-            f"Based on content analysis, these appear to include: {detected_doc_types}\n\n"
-            "EXTREMELY IMPORTANT GUIDANCE ON SOURCES:\n"
-            "1. When citing sources, DO NOT refer to them by their file type (e.g., 'PDF', 'DOCX'). Instead, identify them by their content type:\n"
-            "   - Refer to personality assessments as 'Hogan Assessment' or similar specific assessment name\n"
-            "   - Refer to 360-degree feedback as '360° Feedback'\n"
-            "   - Refer to resumes as 'CV/Resume'\n"
-            "   - Refer to intercultural assessments as 'IDI Assessment'\n"
-            "   - For other documents, identify them by their purpose (e.g., 'Performance Review', 'Interview Notes')\n\n"
-            "2. For each major claim or insight in your analysis, include a brief in-text citation showing the source, like this: '... demonstrates strong analytical abilities (Hogan Assessment).' or '... has experience managing global teams (CV/Resume).'\n\n"
-            "Use all and only the documents and data provided by the user. "
-            "You must only reference the document types listed above. Do not invent or assume the existence of other data sources. "
-            "If a type of data (e.g., 'Coaching Notes') is not present in the provided documents, do not reference it.\n\n"
-            "For each section of your analysis, make a good faith effort to use and reference insights from all of the provided documents. \n\n"
-        )
-        
-        # Join document chunks for context
-        context = "\n\n".join(document_chunks)
-        
-        # Format metadata for the prompt
-        metadata_text = ""
-        if metadata and len(metadata) > 0:
-            metadata_items = []
-            for meta in metadata:
-                for key, value in meta.items():
-                    if key != 'file_type' and key != 'filename':
-                        metadata_items.append(f"{key}: {value}")
-            metadata_text = "\n".join(metadata_items)
+    def complete_profile(self, profile_content: str, doc_type_map: dict, document_chunks: List[str],
+                         metadata: List[dict] = None, reference_docs: List[str] = None) -> str:
+        """Turn a profile reply into a complete profile JSON array.
 
-        prompt = (
-            doc_summary_prompt +
-            f"Based on the following psychology documents, generate a comprehensive psychology profile:\n\n"
-            f"Person Information:\n{metadata_text}\n\n"
-            "IMPORTANT FORMATTING INSTRUCTIONS:\n"
-            "- For 'Presenting Concerns and Goals', 'Test Results by Domain', 'Diagnoses' sections, ALWAYS format the content as a numbered list (1., 2., 3., etc.)\n"
-            "- Insert a blank line between each numbered item (double line break)\n"
-            "- Each point should be focused on a single concern, test result, or diagnosis\n"
-            "- Limit each enumerated list to a maximum of 5 items\n"
-            "- For other sections, use paragraph format\n"
-            "- Each significant claim should include a parenthetical reference to the source (e.g., 'exhibits anxious tendencies (Psychological Assessment)')\n"
-            "- Do not use markdown formatting or special characters that might interfere with JSON\n\n"
-            "Sections:\n"
-            "1. Presenting Concerns and Goals\n"
-            "2. History Snapshot\n"
-            "3. Behavioral Observations\n"
-            "4. Test Results by Domain\n"
-            "5. Integrative Case Formulation\n"
-            "6. Diagnoses\n\n"
-            "Example output:\n"
-            "[\n"
-            "  {\"section\": \"Presenting Concerns and Goals\", \"content\": \"1. Patient presents with moderate anxiety symptoms and panic attacks occurring 2-3 times weekly for the past three months (Clinical Interview)\\n\\n2. Reports significant impact on sleep and work performance (Psychological Assessment)\\n\\n3. Goals include developing coping strategies for anxiety and improving sleep quality (Treatment Notes)\", \"sources\": \"Clinical Interview, Psychological Assessment, Treatment Notes\"},\n"
-            "  {\"section\": \"History Snapshot\", \"content\": \"Psychiatric/Psychological: Previous diagnosis of adjustment disorder at age 25 following job loss, responded well to brief therapy (Medical History)\\n\\nMedical/Neurological: Chronic migraines since adolescence, currently managed with sumatriptan (Medical History)\\n\\nDevelopmental: No significant developmental concerns or delays reported (Clinical Interview)\\n\\nFamily & Social: Lives with supportive partner, reports close relationship with parents (Psychological Assessment)\\n\\nEducational/Occupational: Master's degree in business, currently employed as project manager with high job satisfaction (CV/Resume)\", \"sources\": \"Medical History, Clinical Interview, Psychological Assessment, CV/Resume\"},\n"
-            "  {\"section\": \"Behavioral Observations\", \"content\": \"Patient presented as well-groomed with appropriate affect. Speech was normal in rate and volume. Thought process was logical and goal-directed. No evidence of hallucinations or delusions. Insight and judgment intact. Mild psychomotor agitation observed when discussing work stressors (Clinical Interview).\", \"sources\": \"Clinical Interview\"},\n"
-            "  {\"section\": \"Test Results by Domain\", \"content\": \"1. Cognitive & Neuropsychological: WAIS-IV results show high average overall cognitive functioning (FSIQ 115) with relative strengths in verbal comprehension (Standardized Tests)\\n\\n2. Personality/Emotional: MMPI-2 profile suggests elevated anxiety (T=68) and mild depression (T=61) with no evidence of serious psychopathology (Psychological Assessment)\\n\\n3. Symptom Measures: GAD-7 score of 14 indicating moderate anxiety; PHQ-9 score of 8 indicating mild depression (Standardized Tests)\\n\\n4. Adaptive Functioning: WHODAS 2.0 shows moderate impairment in life activities domain (score 2.1) but minimal impairment in other domains (Psychological Assessment)\", \"sources\": \"Standardized Tests, Psychological Assessment\"},\n"
-            "  {\"section\": \"Integrative Case Formulation\", \"content\": \"Predisposing Factors: Family history of anxiety disorders and perfectionistic tendencies (Medical History)\\n\\nPrecipitating Factors: Recent promotion with increased responsibilities and deadline pressure (Clinical Interview)\\n\\nPerpetuating Factors: Maladaptive coping strategies including work avoidance and catastrophic thinking (Psychological Assessment)\\n\\nProtective Factors: Strong social support system, good insight, and previous positive response to therapy (Treatment Notes)\", \"sources\": \"Medical History, Clinical Interview, Psychological Assessment, Treatment Notes\"},\n"
-            "  {\"section\": \"Diagnoses\", \"content\": \"1. F41.1 Generalized Anxiety Disorder - Meets criteria based on excessive worry, difficulty controlling anxiety, restlessness, and sleep disturbance (DSM-5-TR)\\n\\n2. F51.01 Insomnia Disorder - Sleep initiation and maintenance problems related to anxiety but warranting clinical attention (DSM-5-TR)\\n\\n3. Rule Out: F34.1 Persistent Depressive Disorder - Some depressive symptoms present but not meeting full criteria for duration and severity (DSM-5-TR)\", \"sources\": \"Psychological Assessment, Clinical Interview\"}\n"
-            "]\n\n"
-            f"{context}\n\n"
-            "Return only the JSON array, with no extra commentary or explanation.\n"
-            "Remember to format list-type sections with numbered items and proper line breaks between items, and structure the History Snapshot with clear domain headings."
-        )
-
-        response = client.chat.completions.create(
-            model="gpt-4.1-2025-04-14",
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.4,
-            max_tokens=2000
-        )
-
-        profile_content = response.choices[0].message.content
-        
+        Malformed JSON is repaired locally; sections still missing are re-requested
+        in one small call rather than regenerating the whole profile. A reply with
+        nothing recoverable is returned as is.
+        """
+        sections, missing = self.parse_profile(profile_content, expected=assessment_types.PROFILE_SECTIONS)
+        if not sections:
+            return self.clean_profile_sources(profile_content, doc_type_map)
+        if missing:
+            print(f"Profile reply lacked {', '.join(missing)}; requesting only those sections")
+            sections = sections + self.generate_sections(document_chunks, missing, metadata, reference_docs)
+        profile_content = json.dumps(profile_schema.in_profile_order(sections), ensure_ascii=False)
+        return self.clean_profile_sources(profile_content, doc_type_map)
+
+    def generate_sections(self, document_chunks: List[str], sections: List[str], metadata: List[dict] = None,
+                          reference_docs: List[str] = None, guidance: str = None) -> List[dict]:
+        """Regenerate only the named profile sections, returning their section objects in profile order."""
+        messages, doc_type_map = self.profile_messages(document_chunks, metadata, reference_docs,
+                                                       sections=sections, guidance=guidance)
+        params = dict(SECTIONS_PARAMS, max_tokens=min(SECTIONS_PARAMS["max_tokens"], SECTION_MAX_TOKENS * len(sections)))
+        regenerated, _ = self.parse_profile(self._chat("sections", messages, **params), task="sections",
+                                            expected=sections)
+        content = self.clean_profile_sources(json.dumps(regenerated, ensure_ascii=False), doc_type_map)
+        wanted = set(sections)
+        return [section for section in json.loads(content) if section.get("section") in wanted]
+
+    def regenerate_section(self, document_chunks: List[str], section_name: str, metadata: List[dict] = None,
+                           reference_docs: List[str] = None, guidance: str = None) -> dict:
+        """Rewrite one profile section from its retrieved chunks with one small call, optionally per guidance."""
+        regenerated = self.generate_sections(document_chunks, [section_name], metadata, reference_docs, guidance)
+        if not regenerated:
+            raise ValueError(f"Model did not return the '{section_name}' section")
+        return regenerated[0]
+
+    def clean_profile_sources(self, profile_content: str, doc_type_map: dict) -> str:
+        """Replace temporary filenames in each section's sources with document types."""
         # Clean up sources in the profile content
         try:
             import json
-            profile_json = json.loads(profile_content)
+            with metrics.span("json_parse", task="profile"):
+                profile_json = json.loads(profile_content)
             
             for section in profile_json:
                 if "sources" in section:
@@ -222,9 +500,107 @@ class ProfileGenerator:
         
         return profile_content
 
-    def answer_question(self, document_chunks: List[str], question: str) -> str:
+    def digest_documents(self, documents: List[str]) -> List[str]:
+        """Condense each document into an evidence digest, in parallel, reusing cached digests by document hash."""
+        parts = [_split_for_digest(document, DIGEST_PART_TOKENS) for document in documents]
+        jobs = [(part, i + 1, len(doc_parts)) for doc_parts in parts for i, part in enumerate(doc_parts)]
+        with metrics.span("digest_documents") as span:
+            span.record(documents=len(documents), parts=len(jobs))
+            with ThreadPoolExecutor(max_workers=DIGEST_CONCURRENCY) as executor:
+                # One bound context per task: a context cannot be entered by two threads at once
+                futures = [executor.submit(metrics.bind(self._digest_part), *job) for job in jobs]
+                results = [future.result() for future in futures]
+        digests = []
+        for doc_parts in parts:
+            digests.append("\n\n".join(results[:len(doc_parts)]))
+            results = results[len(doc_parts):]
+        return digests
+
+    def _digest_part(self, text: str, part: int, parts: int) -> str:
+        key = DigestCache.key(text, DIGEST_PARAMS["model"], prompt_templates.DIGEST_INSTRUCTIONS)
+        digest = digest_cache.get(key)
+        if digest is not None:
+            metrics.registry.inc("digest_cache_total", outcome="hit")
+            return digest
+        metrics.registry.inc("digest_cache_total", outcome="miss")
+        digest = self._chat("digest", [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt_templates.DIGEST_INSTRUCTIONS + prompt_templates.digest_prompt(text, part, parts)}
+        ], **DIGEST_PARAMS)
+        digest_cache.put(key, digest)
+        return digest
+
+    def digest_reference_manual(self, instrument_name: str, text: str) -> str:
+        """Condense an instrument's interpretation manual into an interpretive digest (offline build step)."""
+        return self._chat("reference_digest", [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt_templates.REFERENCE_DIGEST_INSTRUCTIONS +
+                prompt_templates.reference_digest_prompt(instrument_name, text)}
+        ], **REFERENCE_DIGEST_PARAMS)
+
+    def detect_assessment_types(self, document_chunks: List[str]) -> List[str]:
+        """Identify the assessment and document types present in the chunks from their content."""
+        return assessment_types.detect_assessment_types(document_chunks)
+
+    def _build_profile_prompt(self, document_chunks: List[str], metadata: List[dict] = None, reference_docs: List[str] = None,
+                              context_chunks: List[str] = None, sections: List[str] = None, guidance: str = None):
+        """Assemble the profile prompt as (static prefix, per-case prompt, filename to document-type map).
+
+        context_chunks (e.g. evidence digests) replace document_chunks as the case context;
+        document types are still detected from the full documents.
+        """
+        # Build the document type list for the LLM prompt and for the report
+        doc_types = list(dict.fromkeys(meta['file_type'] for meta in metadata)) if metadata else []
+
+        # Create a mapping of document types for cleaning up sources later
+        doc_type_map = {}
+        
+        # Identify the types of documents based on content
+        detected_types = self.detect_assessment_types(document_chunks)
+
+        if metadata:
+            for meta in metadata:
+                if 'file_name' in meta and 'file_type' in meta:
+                    # Map temporary filenames to their document types
+                    file_name = meta['file_name']
+                    doc_type_map[file_name] = assessment_types.document_type_from_filename(file_name, meta['file_type'])
+
+        # Combine detected document types with the filenames
+        detected_doc_types = ", ".join(detected_types) if detected_types else "Submitted Documents"
+
+        # Join document chunks for context
+        context = "\n\n".join(document_chunks if context_chunks is None else context_chunks)
+        
+        # Format metadata for the prompt
+        metadata_text = ""
+        if metadata and len(metadata) > 0:
+            metadata_items = []
+            for meta in metadata:
+                for key, value in meta.items():
+                    if key != 'file_type' and key != 'filename':
+                        metadata_items.append(f"{key}: {value}")
+            metadata_text = "\n".join(metadata_items)
+
+        prefix = prompt_templates.profile_prefix(reference_docs)
+        case_prompt = prompt_templates.profile_case_prompt(doc_types, detected_doc_types, metadata_text, context, sections, guidance)
+        return prefix, case_prompt, doc_type_map
+
+    def answer_question(self, document_chunks: List[str], question: str, reference_docs: List[str] = None) -> str:
         """Answer a special clinical question based on the document context."""
+        return self._chat("answer", self.answer_messages(document_chunks, question, reference_docs), **ANSWER_PARAMS)
+
+    async def aanswer_question(self, document_chunks: List[str], question: str, reference_docs: List[str] = None) -> str:
+        """Async answer_question, for callers running inside an event loop."""
+        messages = await asyncio.to_thread(self.answer_messages, document_chunks, question, reference_docs)
+        return await self._achat("answer", messages, **ANSWER_PARAMS)
+
+    def answer_messages(self, document_chunks: List[str], question: str, reference_docs: List[str] = None) -> List[dict]:
+        """Build the chat messages for a clinical question; reference_docs go in the cacheable prefix."""
+        document_chunks = _case_chunks(document_chunks, reference_docs)
         context = "\n\n".join(document_chunks)
+        fixed_tokens = count_tokens(self.system_prompt) + count_tokens(prompt_templates.answer_prefix(reference_docs))
+        if fixed_tokens + count_tokens(context) + ANSWER_PARAMS["max_tokens"] > CONTEXT_BUDGET_TOKENS:
+            context = "\n\n".join(self.digest_documents(_pack_chunks(document_chunks, DIGEST_PART_TOKENS)))
         
         # Identify the types of documents based on content
         assessment_types = []
@@ -261,54 +637,13 @@ class ProfileGenerator:
             
         # Combine detected document types
         detected_doc_types = ", ".join(assessment_types) if assessment_types else "Submitted Documents"
-        
-        # Add citation guidance for clinical assessment
-        citation_guidance = """
-EXTREMELY IMPORTANT GUIDANCE ON SOURCES AND CITATIONS:
-
-1. When citing sources, DO NOT refer to them by their file type (e.g., 'PDF', 'DOCX'). Instead, identify them by their clinical content type:
-   - Refer to formal evaluations as 'Psychological Assessment' 
-   - Refer to documented discussions as 'Clinical Interview'
-   - Refer to medical information as 'Medical History'
-   - Refer to measurement data as 'Standardized Tests'
-   - Refer to session documentation as 'Treatment Notes'
-
-2. For EVERY claim in your analysis, include a brief in-text citation showing the source, like this: 
-   '... presents with significant anxiety symptoms (Psychological Assessment).' or '... reports improvement with relaxation techniques (Treatment Notes).'
-
-3. Do not make diagnostic or clinical claims that cannot be directly supported by the provided documents.
-
-4. At the end of your response, include a "References" section that lists all the source documents you cited.
-
-5. Every paragraph should include at least one specific citation to a source document.
-
-6. DO NOT HALLUCINATE OR INVENT SOURCES. Only use the document types that have been detected in the uploaded materials:
-   {detected_doc_types}
-"""
-
-        prompt = f"""Based on the following patient documentation, answer this clinical question from the mental health practitioner:
-
-{citation_guidance}
-
-{context}
-
-Question: {question}
-
-Please provide a detailed, evidence-based clinical answer, providing specific in-text citations for each claim (e.g., "presents with generalized anxiety symptoms (Psychological Assessment)").
-
-End your response with a "References" section that lists all the documents you cited.
 
-Remember: Only make claims that are directly supported by the clinical documentation. Include parenthetical citations for each major clinical observation or conclusion."""
+        prompt = prompt_templates.answer_prefix(reference_docs) + prompt_templates.answer_case_prompt(
+            detected_doc_types, context, question)
 
-        response = client.chat.completions.create(
-            model="gpt-4.1-2025-04-14",
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.4,
-            max_tokens=4000
-        )
-        return response.choices[0].message.content
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt}
+        ]
 
 
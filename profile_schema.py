@@ -0,0 +1,140 @@
+import json
+import re
+from typing import List
+
+from assessment_types import PROFILE_SECTIONS
+
+FENCE_PATTERN = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+
+
+def profile_schema() -> dict:
+    """JSON schema for a profile reply. Structured output needs an object at the top level,
+    so the section array is wrapped as {"sections": [...]}."""
+    return {
+        "type": "object",
+        "properties": {
+            "sections": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "section": {"type": "string", "enum": PROFILE_SECTIONS},
+                        "content": {"type": "string"},
+                        "sources": {"type": "string"},
+                    },
+                    "required": ["section", "content", "sources"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["sections"],
+        "additionalProperties": False,
+    }
+
+
+def response_format() -> dict:
+    """The response_format request parameter that constrains replies to profile_schema()."""
+    return {"type": "json_schema", "json_schema": {"name": "profile", "strict": True, "schema": profile_schema()}}
+
+
+def _unwrap(value) -> List[dict]:
+    if isinstance(value, dict) and isinstance(value.get("sections"), list):
+        value = value["sections"]
+    if not isinstance(value, list):
+        raise ValueError("Profile reply is not a list of sections")
+    return [section for section in value if isinstance(section, dict) and section.get("section")]
+
+
+def _strip_trailing_commas(text: str) -> str:
+    """Drop commas directly before a closing bracket or brace, leaving string contents untouched."""
+    out = []
+    in_string = escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ",":
+            rest = text[i + 1:].lstrip()
+            if rest[:1] in ("]", "}"):
+                continue
+        out.append(char)
+    return "".join(out)
+
+
+def _close_after_last_element(text: str) -> str:
+    """Cut text after the last array element that closed, then close whatever is still open."""
+    stack = []
+    cut = None
+    in_string = escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            stack.append(char)
+        elif char in "]}":
+            if not stack:
+                break
+            stack.pop()
+            if char == "}" and stack and stack[-1] == "[":
+                cut = (i + 1, list(stack))
+    if cut is None:
+        raise ValueError("Profile reply has no complete section")
+    end, still_open = cut
+    return text[:end] + "".join("]" if opener == "[" else "}" for opener in reversed(still_open))
+
+
+def repair_json(text: str) -> List[dict]:
+    """Recover the sections from a malformed profile reply.
+
+    Strips markdown fences and any prose before the JSON, drops trailing commas (outside
+    strings, and only if the JSON does not parse as it is) and, for a reply cut off
+    mid-section, keeps the sections that were complete.
+    """
+    text = FENCE_PATTERN.sub("", text or "")
+    starts = [i for i in (text.find("["), text.find("{")) if i >= 0]
+    if not starts:
+        raise ValueError("Profile reply contains no JSON")
+    text = text[min(starts):]
+    for candidate in (text, _strip_trailing_commas(text)):
+        try:
+            return _unwrap(json.JSONDecoder().raw_decode(candidate)[0])
+        except json.JSONDecodeError:
+            pass
+    truncated = _strip_trailing_commas(_close_after_last_element(text))
+    try:
+        return _unwrap(json.loads(truncated))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Profile reply could not be repaired: {e}")
+
+
+def parse_sections(text: str):
+    """Sections from a profile reply as (sections, repaired); raises ValueError if nothing is recoverable."""
+    try:
+        return _unwrap(json.loads(text)), False
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return repair_json(text), True
+
+
+def in_profile_order(sections: List[dict]) -> List[dict]:
+    """Sections sorted into profile order, one per name (the first wins), unknown names last."""
+    seen = set()
+    unique = []
+    for section in sections:
+        if section["section"] not in seen:
+            seen.add(section["section"])
+            unique.append(section)
+    order = {name: i for i, name in enumerate(PROFILE_SECTIONS)}
+    return sorted(unique, key=lambda section: order.get(section["section"], len(order)))
@@ -0,0 +1,184 @@
+from functools import lru_cache
+from typing import List
+
+# Prompts are laid out static-first: everything that is the same for every
+# case (instructions, worked example, reference material) forms a byte-identical
+# prefix that the provider can cache, and per-case material comes last.
+# Anything that varies per request must stay out of the *_INSTRUCTIONS strings.
+
+PROFILE_INSTRUCTIONS = (
+    "You will be given a case's documents and asked to generate a comprehensive psychology profile.\n\n"
+    "EXTREMELY IMPORTANT GUIDANCE ON SOURCES:\n"
+    "1. When citing sources, DO NOT refer to them by their file type (e.g., 'PDF', 'DOCX'). Instead, identify them by their content type:\n"
+    "   - Refer to personality assessments as 'Hogan Assessment' or similar specific assessment name\n"
+    "   - Refer to 360-degree feedback as '360° Feedback'\n"
+    "   - Refer to resumes as 'CV/Resume'\n"
+    "   - Refer to intercultural assessments as 'IDI Assessment'\n"
+    "   - For other documents, identify them by their purpose (e.g., 'Performance Review', 'Interview Notes')\n\n"
+    "2. For each major claim or insight in your analysis, include a brief in-text citation showing the source, like this: '... demonstrates strong analytical abilities (Hogan Assessment).' or '... has experience managing global teams (CV/Resume).'\n\n"
+    "Use all and only the documents and data provided by the user. "
+    "You must only reference the document types listed in the case material. Do not invent or assume the existence of other data sources. "
+    "If a type of data (e.g., 'Coaching Notes') is not present in the provided documents, do not reference it.\n\n"
+    "For each section of your analysis, make a good faith effort to use and reference insights from all of the provided documents. \n\n"
+    "IMPORTANT FORMATTING INSTRUCTIONS:\n"
+    "- For 'Presenting Concerns and Goals', 'Test Results by Domain', 'Diagnoses' sections, ALWAYS format the content as a numbered list (1., 2., 3., etc.)\n"
+    "- Insert a blank line between each numbered item (double line break)\n"
+    "- Each point should be focused on a single concern, test result, or diagnosis\n"
+    "- Limit each enumerated list to a maximum of 5 items\n"
+    "- For other sections, use paragraph format\n"
+    "- Each significant claim should include a parenthetical reference to the source (e.g., 'exhibits anxious tendencies (Psychological Assessment)')\n"
+    "- Do not use markdown formatting or special characters that might interfere with JSON\n\n"
+    "Sections:\n"
+    "1. Presenting Concerns and Goals\n"
+    "2. History Snapshot\n"
+    "3. Behavioral Observations\n"
+    "4. Test Results by Domain\n"
+    "5. Integrative Case Formulation\n"
+    "6. Diagnoses\n\n"
+    "Example output:\n"
+    "[\n"
+    "  {\"section\": \"Presenting Concerns and Goals\", \"content\": \"1. Patient presents with moderate anxiety symptoms and panic attacks occurring 2-3 times weekly for the past three months (Clinical Interview)\\n\\n2. Reports significant impact on sleep and work performance (Psychological Assessment)\\n\\n3. Goals include developing coping strategies for anxiety and improving sleep quality (Treatment Notes)\", \"sources\": \"Clinical Interview, Psychological Assessment, Treatment Notes\"},\n"
+    "  {\"section\": \"History Snapshot\", \"content\": \"Psychiatric/Psychological: Previous diagnosis of adjustment disorder at age 25 following job loss, responded well to brief therapy (Medical History)\\n\\nMedical/Neurological: Chronic migraines since adolescence, currently managed with sumatriptan (Medical History)\\n\\nDevelopmental: No significant developmental concerns or delays reported (Clinical Interview)\\n\\nFamily & Social: Lives with supportive partner, reports close relationship with parents (Psychological Assessment)\\n\\nEducational/Occupational: Master's degree in business, currently employed as project manager with high job satisfaction (CV/Resume)\", \"sources\": \"Medical History, Clinical Interview, Psychological Assessment, CV/Resume\"},\n"
+    "  {\"section\": \"Behavioral Observations\", \"content\": \"Patient presented as well-groomed with appropriate affect. Speech was normal in rate and volume. Thought process was logical and goal-directed. No evidence of hallucinations or delusions. Insight and judgment intact. Mild psychomotor agitation observed when discussing work stressors (Clinical Interview).\", \"sources\": \"Clinical Interview\"},\n"
+    "  {\"section\": \"Test Results by Domain\", \"content\": \"1. Cognitive & Neuropsychological: WAIS-IV results show high average overall cognitive functioning (FSIQ 115) with relative strengths in verbal comprehension (Standardized Tests)\\n\\n2. Personality/Emotional: MMPI-2 profile suggests elevated anxiety (T=68) and mild depression (T=61) with no evidence of serious psychopathology (Psychological Assessment)\\n\\n3. Symptom Measures: GAD-7 score of 14 indicating moderate anxiety; PHQ-9 score of 8 indicating mild depression (Standardized Tests)\\n\\n4. Adaptive Functioning: WHODAS 2.0 shows moderate impairment in life activities domain (score 2.1) but minimal impairment in other domains (Psychological Assessment)\", \"sources\": \"Standardized Tests, Psychological Assessment\"},\n"
+    "  {\"section\": \"Integrative Case Formulation\", \"content\": \"Predisposing Factors: Family history of anxiety disorders and perfectionistic tendencies (Medical History)\\n\\nPrecipitating Factors: Recent promotion with increased responsibilities and deadline pressure (Clinical Interview)\\n\\nPerpetuating Factors: Maladaptive coping strategies including work avoidance and catastrophic thinking (Psychological Assessment)\\n\\nProtective Factors: Strong social support system, good insight, and previous positive response to therapy (Treatment Notes)\", \"sources\": \"Medical History, Clinical Interview, Psychological Assessment, Treatment Notes\"},\n"
+    "  {\"section\": \"Diagnoses\", \"content\": \"1. F41.1 Generalized Anxiety Disorder - Meets criteria based on excessive worry, difficulty controlling anxiety, restlessness, and sleep disturbance (DSM-5-TR)\\n\\n2. F51.01 Insomnia Disorder - Sleep initiation and maintenance problems related to anxiety but warranting clinical attention (DSM-5-TR)\\n\\n3. Rule Out: F34.1 Persistent Depressive Disorder - Some depressive symptoms present but not meeting full criteria for duration and severity (DSM-5-TR)\", \"sources\": \"Psychological Assessment, Clinical Interview\"}\n"
+    "]\n\n"
+)
+
+ANSWER_INSTRUCTIONS = """You will be given a patient's documentation and a clinical question from the mental health practitioner.
+
+EXTREMELY IMPORTANT GUIDANCE ON SOURCES AND CITATIONS:
+
+1. When citing sources, DO NOT refer to them by their file type (e.g., 'PDF', 'DOCX'). Instead, identify them by their clinical content type:
+   - Refer to formal evaluations as 'Psychological Assessment'
+   - Refer to documented discussions as 'Clinical Interview'
+   - Refer to medical information as 'Medical History'
+   - Refer to measurement data as 'Standardized Tests'
+   - Refer to session documentation as 'Treatment Notes'
+
+2. For EVERY claim in your analysis, include a brief in-text citation showing the source, like this:
+   '... presents with significant anxiety symptoms (Psychological Assessment).' or '... reports improvement with relaxation techniques (Treatment Notes).'
+
+3. Do not make diagnostic or clinical claims that cannot be directly supported by the provided documents.
+
+4. At the end of your response, include a "References" section that lists all the source documents you cited.
+
+5. Every paragraph should include at least one specific citation to a source document.
+
+6. DO NOT HALLUCINATE OR INVENT SOURCES. Only use the document types listed as detected in the case material.
+
+"""
+
+REFERENCE_HEADER = "REFERENCE MATERIAL (interpretation guides for the assessment instruments; these are not case documents and must not be cited as sources):\n\n"
+
+CASE_HEADER = "CASE MATERIAL\n\n"
+
+
+@lru_cache(maxsize=16)
+def _prefix(instructions: str, reference_docs: tuple) -> str:
+    if not reference_docs:
+        return instructions
+    return instructions + REFERENCE_HEADER + "\n\n".join(reference_docs) + "\n\n"
+
+
+def profile_prefix(reference_docs: List[str] = None) -> str:
+    """The static part of a profile prompt: instructions, worked example and reference material."""
+    return _prefix(PROFILE_INSTRUCTIONS, tuple(reference_docs or ()))
+
+
+def answer_prefix(reference_docs: List[str] = None) -> str:
+    """The static part of a consultation prompt: citation rules and reference material."""
+    return _prefix(ANSWER_INSTRUCTIONS, tuple(reference_docs or ()))
+
+
+def profile_case_prompt(doc_types: List[str], detected_doc_types: str, metadata_text: str, context: str,
+                        sections: List[str] = None, guidance: str = None) -> str:
+    """The per-case part of a profile prompt, appended after profile_prefix().
+
+    sections restricts the reply to those sections, for partial regeneration.
+    """
+    doc_type_list = "\n".join(f"- {doc_type}" for doc_type in doc_types)
+    return (
+        CASE_HEADER +
+        "You have been provided with the following types of documents for your analysis:\n"
+        f"{doc_type_list}\n\n"
+        f"Based on content analysis, these appear to include: {detected_doc_types}\n\n"
+        f"Based on the following psychology documents, generate a comprehensive psychology profile:\n\n"
+        f"Person Information:\n{metadata_text}\n\n"
+        f"{context}\n\n"
+        "Return only the JSON array, with no extra commentary or explanation.\n"
+        "Remember to format list-type sections with numbered items and proper line breaks between items, and structure the History Snapshot with clear domain headings."
+        + (sections_instruction(sections, guidance) if sections else "")
+    )
+
+
+def sections_instruction(sections: List[str], guidance: str = None) -> str:
+    """Restricts a profile reply to some sections, with the clinician's guidance; appended to the per-case prompt."""
+    names = "\n".join(f"- {section}" for section in sections)
+    instruction = (
+        "\n\nThis is a partial update of an existing profile. Write ONLY these sections, in this order, "
+        f"and return a JSON array containing only them:\n{names}"
+    )
+    if guidance:
+        instruction += f"\n\nThe practitioner asked for this revision: {guidance.strip()}"
+    return instruction
+
+
+def answer_case_prompt(detected_doc_types: str, context: str, question: str) -> str:
+    """The per-case part of a consultation prompt, appended after answer_prefix()."""
+    return f"""{CASE_HEADER}Document types detected in the uploaded materials: {detected_doc_types}
+
+{context}
+
+Question: {question}
+
+Please provide a detailed, evidence-based clinical answer, providing specific in-text citations for each claim (e.g., "presents with generalized anxiety symptoms (Psychological Assessment)").
+
+End your response with a "References" section that lists all the documents you cited.
+
+Remember: Only make claims that are directly supported by the clinical documentation. Include parenthetical citations for each major clinical observation or conclusion."""
+
+
+DIGEST_INSTRUCTIONS = """You are condensing one document from a client's assessment packet into an evidence digest. The digests of all documents in the packet will later be combined to write a psychology profile, so keep every piece of evidence that profile could use and nothing else.
+
+Write plain text under these headings, omitting any heading the document has no evidence for:
+Document Type
+Presenting Concerns and Goals
+History
+Behavioral Observations
+Test Results and Scores
+Clinical Impressions and Diagnoses
+Notable Quotes
+
+Rules:
+- Keep instrument names, scale names, exact scores, percentiles, dates and rater groups exactly as written
+- Attribute each point to the kind of document it comes from (e.g. 'Hogan Assessment', 'Interview Notes'), never to a file name
+- Do not interpret, diagnose or add anything that is not in the document
+- Use at most 400 words
+
+"""
+
+
+def digest_prompt(text: str, part: int = 1, parts: int = 1) -> str:
+    """The per-document part of a digest request, appended after DIGEST_INSTRUCTIONS."""
+    label = f" (part {part} of {parts})" if parts > 1 else ""
+    return f"DOCUMENT{label}\n\n{text}\n\nReturn only the digest."
+
+
+REFERENCE_DIGEST_INSTRUCTIONS = """You are condensing a publisher's interpretation manual for a psychometric instrument into a compact interpretive digest. Practitioners' profiles will use the digest, instead of the full manual, to interpret client scores on this instrument.
+
+Keep, as terse bullet points under a heading per scale or theme:
+- What each scale, dimension, type or theme measures
+- How to read score bands (high, moderate, low; norm percentiles and cut-offs where given)
+- Typical strengths, risks and development implications at each band
+- Caveats for interpretation and feedback
+
+Leave out marketing copy, administration instructions, sample reports and copyright notices. Use at most 1500 words.
+
+"""
+
+
+def reference_digest_prompt(instrument_name: str, text: str) -> str:
+    """The per-instrument part of a reference digest request, appended after REFERENCE_DIGEST_INSTRUCTIONS."""
+    return f"INSTRUMENT: {instrument_name}\n\nMANUAL\n\n{text}\n\nReturn only the digest."
@@ -0,0 +1,252 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import List
+
+import metrics
+
+REFERENCE_FOLDER = "HowToInterpret"
+DIGEST_FOLDER = "digests"
+# Bump when the digest instructions or record format change, so old digests are rebuilt
+DIGEST_VERSION = 1
+
+# Instruments with interpretation manuals in HowToInterpret/: which manuals belong
+# to each (matched against lower-cased file names) and the terms that show the
+# instrument appears in a client's documents
+INSTRUMENTS = {
+    "hogan": {
+        "name": "Hogan Assessments (HPI, HDS, MVPI)",
+        "files": ["cheatsheet", "norm documentation", "hogan"],
+        "terms": [r"\bhogan\b", r"\bhpi\b", r"\bhds\b", r"\bmvpi\b", r"motives,? values,? preferences",
+                  r"hogan development survey", r"hogan personality inventory"],
+    },
+    "disc": {
+        "name": "DISC",
+        "files": ["disc"],
+        "terms": [r"\bdisc\b"],
+    },
+    "idi": {
+        "name": "Individual Directions Inventory",
+        "files": ["individual directions"],
+        "terms": [r"individual directions inventory", r"\bidi report\b", r"directions inventory"],
+    },
+    "mbti": {
+        "name": "Myers-Briggs Type Indicator (MBTI)",
+        "files": ["myers-briggs", "mbti"],
+        "terms": [r"myers[- ]briggs", r"\bmbti\b"],
+    },
+    "strengths": {
+        "name": "CliftonStrengths (StrengthsFinder)",
+        "files": ["strengthsfinder", "cliftonstrengths"],
+        "terms": [r"strengthsfinder", r"clifton ?strengths", r"signature themes"],
+    },
+}
+
+_PATTERNS = {key: re.compile("|".join(spec["terms"]), re.IGNORECASE) for key, spec in INSTRUMENTS.items()}
+
+
+def detect_instruments(texts: List[str]) -> List[str]:
+    """Instruments (INSTRUMENTS keys, in registry order) mentioned in the given documents."""
+    return [key for key, pattern in _PATTERNS.items() if any(pattern.search(text) for text in texts)]
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def assign_manuals(folder=REFERENCE_FOLDER):
+    """Map each instrument to its manuals in folder; returns (assigned, unassigned file names)."""
+    assigned = {key: [] for key in INSTRUMENTS}
+    unassigned = []
+    for filename in sorted(os.listdir(folder)):
+        if not filename.lower().endswith(".pdf"):
+            continue
+        lower = filename.lower()
+        key = next((k for k, spec in INSTRUMENTS.items() if any(p in lower for p in spec["files"])), None)
+        if key is None:
+            unassigned.append(filename)
+        else:
+            assigned[key].append(filename)
+    return {key: files for key, files in assigned.items() if files}, unassigned
+
+
+def _digest_path(folder, key):
+    return os.path.join(folder, DIGEST_FOLDER, f"{key}.json")
+
+
+def _sources(folder, filenames):
+    return [{"file": name, "sha256": _file_hash(os.path.join(folder, name))} for name in filenames]
+
+
+def load_digest(folder, key, filenames):
+    """Return the stored digest record for an instrument, or None if missing or stale."""
+    path = _digest_path(folder, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable reference digest {path}: {e}")
+        return None
+    if record.get("version") != DIGEST_VERSION or record.get("sources") != _sources(folder, filenames):
+        print(f"Reference digest for {key} is out of date; using the full manuals until it is rebuilt")
+        return None
+    return record
+
+
+def build_digests(profile_generator, document_processor, folder=REFERENCE_FOLDER, only=None, force=False):
+    """Build (or rebuild, if stale) the interpretive digest for each instrument with manuals in folder.
+
+    An instrument whose build fails is reported and skipped; it keeps using its full manuals.
+    Returns (built, failed) instrument keys.
+    """
+    from profile_generator import REFERENCE_DIGEST_PARAMS
+
+    assigned, unassigned = assign_manuals(folder)
+    os.makedirs(os.path.join(folder, DIGEST_FOLDER), exist_ok=True)
+    built = []
+    failed = []
+    for key, filenames in assigned.items():
+        if only and key not in only:
+            continue
+        if not force and load_digest(folder, key, filenames) is not None:
+            print(f"{key}: up to date", file=sys.stderr)
+            continue
+        name = INSTRUMENTS[key]["name"]
+        try:
+            texts = [document_processor.process_document(os.path.join(folder, name))[0] for name in filenames]
+            with metrics.span("reference_digest_build", instrument=key) as span:
+                digest = profile_generator.digest_reference_manual(name, "\n\n".join(texts))
+                span.record(source_chars=sum(len(t) for t in texts), digest_chars=len(digest))
+        except Exception as e:
+            print(f"{key}: digest build failed, full manuals are used instead: {e}", file=sys.stderr)
+            failed.append(key)
+            continue
+        record = {
+            "instrument": key,
+            "name": name,
+            "version": DIGEST_VERSION,
+            "model": REFERENCE_DIGEST_PARAMS["model"],
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "sources": _sources(folder, filenames),
+            "digest": digest,
+        }
+        path = _digest_path(folder, key)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        print(f"{key}: {sum(len(t) for t in texts)} chars -> {len(digest)} chars ({path})", file=sys.stderr)
+        built.append(key)
+    if unassigned:
+        print(f"No instrument for {', '.join(unassigned)}; these are always sent in full", file=sys.stderr)
+    return built, failed
+
+
+class ReferenceLibrary:
+    """Reference material for the prompt prefix: digests for the instruments a case uses, full manuals as fallback."""
+
+    def __init__(self, document_processor, folder=REFERENCE_FOLDER):
+        from reference_index import open_index
+
+        self.document_processor = document_processor
+        self.folder = folder
+        self.manuals, self.unassigned = assign_manuals(folder)
+        self.digests = {}
+        for key, filenames in self.manuals.items():
+            record = load_digest(folder, key, filenames)
+            if record is not None:
+                self.digests[key] = record
+        # Texts extracted at deploy time (reference_index.py build), so the first case does not parse the manuals
+        self.index = open_index(folder, document_processor.pdf_backend)
+        self._full_texts = {}
+        self._lock = threading.Lock()
+
+    def full_text(self, filename):
+        """Extracted text of one manual: decoded from the mapped reference index on each call, or extracted once per process.
+
+        Indexed texts are not cached, so between cases they stay in the shared page cache rather than on the heap.
+        """
+        text = self.index.text(filename) if self.index is not None else None
+        if text is not None:
+            metrics.registry.inc("reference_text_total", source="index")
+            return text
+        with self._lock:
+            if filename in self._full_texts:
+                return self._full_texts[filename]
+        text, _ = self.document_processor.process_document(os.path.join(self.folder, filename))
+        metrics.registry.inc("reference_text_total", source="extracted")
+        with self._lock:
+            self._full_texts[filename] = text
+        return text
+
+    def select(self, subject_texts: List[str]) -> List[str]:
+        """Reference documents for a case: only instruments detected in its subject documents."""
+        documents = []
+        with metrics.span("reference_select") as span:
+            instruments = [key for key in detect_instruments(subject_texts) if key in self.manuals]
+            for key in instruments:
+                record = self.digests.get(key)
+                if record is not None:
+                    documents.append(f"Interpretive digest: {record['name']} (v{record['version']})\n\n{record['digest']}")
+                    span.record(digests=1)
+                else:
+                    documents.extend(self.full_text(name) for name in self.manuals[key])
+                    span.record(full_manuals=len(self.manuals[key]))
+            # Manuals not tied to a known instrument cannot be matched to a case, so always go in full
+            documents.extend(self.full_text(name) for name in self.unassigned)
+            span.record(instruments=len(instruments), chars=sum(len(d) for d in documents))
+        return documents
+
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def get_library(document_processor, folder=REFERENCE_FOLDER):
+    """Process-wide ReferenceLibrary per folder, so manuals are read at most once."""
+    key = os.path.abspath(folder)
+    with _libraries_lock:
+        if key not in _libraries:
+            _libraries[key] = ReferenceLibrary(document_processor, folder)
+        return _libraries[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build interpretive digests of the HowToInterpret reference manuals.")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--folder", default=REFERENCE_FOLDER)
+    parser.add_argument("--only", help="Comma-separated instruments to build (default: all)")
+    parser.add_argument("--force", action="store_true", help="Rebuild digests that are already up to date")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        assigned, unassigned = assign_manuals(args.folder)
+        for key, filenames in assigned.items():
+            record = load_digest(args.folder, key, filenames)
+            state = f"v{record['version']} built {record['built_at']}" if record else "missing or stale"
+            print(f"{key:<10} {state:<40} {', '.join(filenames)}")
+        for filename in unassigned:
+            print(f"{'-':<10} {'always sent in full':<40} {filename}")
+        return
+
+    from document_processor import DocumentProcessor
+    from profile_generator import ProfileGenerator
+
+    only = set(args.only.split(",")) if args.only else None
+    _, failed = build_digests(ProfileGenerator(), DocumentProcessor(), args.folder, only=only, force=args.force)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+
+import metrics
+from reference_digests import REFERENCE_FOLDER, _sources, assign_manuals
+
+INDEX_FOLDER = "index"
+MANIFEST_FILE = "index.json"
+# Bump when the extraction or the index layout changes, so old indexes are rebuilt
+INDEX_VERSION = 1
+
+
+def _index_dir(folder):
+    return os.path.join(folder, INDEX_FOLDER)
+
+
+def _manual_names(folder):
+    assigned, unassigned = assign_manuals(folder)
+    return sorted([name for names in assigned.values() for name in names] + unassigned)
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_manifest(folder):
+    path = os.path.join(_index_dir(folder), MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable reference index {path}: {e}")
+        return None
+
+
+def _is_current(manifest, folder, pdf_backend, names):
+    """True if manifest indexes exactly these manuals, unchanged, with this extractor.
+
+    Manuals whose size and mtime match the build are trusted without re-hashing them.
+    """
+    if manifest is None or manifest.get("version") != INDEX_VERSION or manifest.get("pdf_backend") != pdf_backend:
+        return False
+    entries = manifest.get("manuals", {})
+    if sorted(entries) != names:
+        return False
+    changed = [name for name in names
+               if list(_stat(os.path.join(folder, name))) != [entries[name]["size"], entries[name]["mtime_ns"]]]
+    return all(source["sha256"] == entries[source["file"]]["sha256"] for source in _sources(folder, changed))
+
+
+def build_index(document_processor, folder=REFERENCE_FOLDER, force=False):
+    """Extract every manual in folder into a versioned index; returns False if it was already up to date.
+
+    The texts go into one file named after its content hash and the manifest is replaced last,
+    so a process opening the index never sees a manifest without its texts.
+    """
+    names = _manual_names(folder)
+    if not force and _is_current(_read_manifest(folder), folder, document_processor.pdf_backend, names):
+        print(f"Reference index for {len(names)} manual(s) is up to date", file=sys.stderr)
+        return False
+    index_dir = _index_dir(folder)
+    os.makedirs(index_dir, exist_ok=True)
+    entries = {}
+    chunks = []
+    offset = 0
+    with metrics.span("reference_index_build") as span:
+        for source in _sources(folder, names):
+            path = os.path.join(folder, source["file"])
+            text, _ = document_processor.process_document(path)
+            data = text.encode("utf-8")
+            size, mtime_ns = _stat(path)
+            entries[source["file"]] = {"sha256": source["sha256"], "size": size, "mtime_ns": mtime_ns,
+                                       "offset": offset, "length": len(data)}
+            chunks.append(data)
+            offset += len(data)
+        span.record(manuals=len(names), bytes=offset)
+    texts = b"".join(chunks)
+    texts_file = f"texts-{hashlib.sha256(texts).hexdigest()[:16]}.bin"
+    with open(os.path.join(index_dir, texts_file + ".tmp"), "wb") as f:
+        f.write(texts)
+    os.replace(os.path.join(index_dir, texts_file + ".tmp"), os.path.join(index_dir, texts_file))
+    manifest = {
+        "version": INDEX_VERSION,
+        "pdf_backend": document_processor.pdf_backend,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "texts": texts_file,
+        "manuals": entries,
+    }
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    for name in os.listdir(index_dir):
+        if name.startswith("texts-") and name != texts_file:
+            os.remove(os.path.join(index_dir, name))
+    print(f"Indexed {len(names)} manual(s), {offset} bytes of text ({index_dir})", file=sys.stderr)
+    return True
+
+
+class ReferenceIndex:
+    """Read-only view of a built index: manual texts are sliced from a memory-mapped file."""
+
+    def __init__(self, folder, manifest):
+        self.manifest = manifest
+        with open(os.path.join(_index_dir(folder), manifest["texts"]), "rb") as f:
+            # An empty file cannot be mapped; an index of empty manuals has nothing to read anyway
+            self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def text(self, filename):
+        """Extracted text of one manual, or None if it is not in the index."""
+        entry = self.manifest["manuals"].get(filename)
+        if entry is None:
+            return None
+        return self._texts[entry["offset"]:entry["offset"] + entry["length"]].decode("utf-8")
+
+
+def open_index(folder=REFERENCE_FOLDER, pdf_backend=None):
+    """The built index for folder, or None if there is none or it no longer matches the manuals."""
+    manifest = _read_manifest(folder)
+    if manifest is None:
+        return None
+    with metrics.span("reference_index_open"):
+        if not _is_current(manifest, folder, pdf_backend or manifest.get("pdf_backend"), _manual_names(folder)):
+            print("Reference index is out of date; manuals are extracted on first use until it is rebuilt")
+            return None
+        try:
+            return ReferenceIndex(folder, manifest)
+        except OSError as e:
+            print(f"Ignoring unreadable reference index: {e}")
+            return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the extracted-text index of the HowToInterpret reference manuals.")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--folder", default=REFERENCE_FOLDER)
+    parser.add_argument("--force", action="store_true", help="Rebuild the index even if it is up to date")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        manifest = _read_manifest(args.folder)
+        if manifest is None:
+            print("No reference index")
+        elif not _is_current(manifest, args.folder, manifest.get("pdf_backend"), _manual_names(args.folder)):
+            print(f"Reference index v{manifest.get('version')} built {manifest.get('built_at')} is out of date")
+        else:
+            print(f"Reference index v{manifest['version']} built {manifest['built_at']} "
+                  f"({manifest['pdf_backend']}): {len(manifest['manuals'])} manual(s)")
+        return
+
+    from document_processor import DocumentProcessor
+
+    build_index(DocumentProcessor(), args.folder, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
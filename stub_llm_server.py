@@ -0,0 +1,421 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic_corpus import sample_profile
+
+CANNED_ANSWER = (
+    "The documentation points to moderate, work-related anxiety with intact functioning "
+    "(Psychological Assessment). Sleep disruption during high-workload periods is reported "
+    "consistently (Interview Notes), and 360° ratings suggest stress is visible to direct reports "
+    "(360° Feedback). CBT is not contraindicated; monitor sleep and escalation of avoidance.\n\n"
+    "References\n- Psychological Assessment\n- Interview Notes\n- 360° Feedback"
+)
+
+
+class StubConfig:
+    """Latency and failure behaviour of the stub, adjustable while it runs."""
+
+    def __init__(self, ttft=0.5, tokens_per_sec=80.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, batch_delay=2.0, seed=0, malformed_rate=0.0):
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.batch_delay = batch_delay
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "streamed": 0, "errors_injected": 0, "rate_limited": 0,
+                      "in_flight": 0, "max_in_flight": 0, "batches": 0, "batch_requests": 0,
+                      "prompt_tokens": 0, "cached_tokens": 0, "malformed": 0}
+        # Hashes of prompt prefixes seen so far, to report cached tokens like the real API
+        self.prompt_cache = set()
+        # Uploaded files and batch jobs for the Batch API endpoints
+        self.files = {}
+        self.batches = {}
+
+    def draw(self):
+        with self.lock:
+            return self.rng.random()
+
+    def bump(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+            if key == "in_flight":
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+
+def canned_content(messages, response_format=None):
+    """Pick a canned reply that satisfies the caller's output contract (including a json_schema response_format)."""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    if "JSON array" in prompt or "JSON object" in prompt:
+        profile = sample_profile()
+        if "Write ONLY these sections" in prompt:
+            # Partial regeneration: the requested sections are listed one per line after the marker
+            listed = prompt.split("Write ONLY these sections", 1)[1].split("\n")
+            wanted = {line[2:].strip() for line in listed if line.startswith("- ")}
+            profile = [section for section in profile if section["section"] in wanted]
+        if (response_format or {}).get("type") == "json_schema":
+            return json.dumps({"sections": profile}, ensure_ascii=False)
+        return json.dumps(profile, ensure_ascii=False)
+    return CANNED_ANSWER
+
+
+def malform(content):
+    """Damage a JSON reply the way models do: fenced, with a trailing comma, and cut off mid-section."""
+    cut = content.rfind('{"section"')
+    if cut <= 0:
+        return f"```json\n{content}\n```"
+    head, last = content[:cut].rstrip().rstrip(","), content[cut:]
+    separator = "" if head.endswith("[") else ","
+    return f"```json\n{head}{separator}\n{last[:len(last) // 2]}"
+
+
+# OpenAI caches prompts of at least 1024 tokens, in 128-token increments
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+
+
+def _usage(prompt_tokens, completion_tokens, cached_tokens=0):
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+
+def cached_prefix_tokens(config, messages):
+    """Tokens of this prompt whose prefix an earlier request already sent, then remember its prefixes."""
+    serialized = "".join(f"{m.get('role')}\n{m.get('content', '')}\n" for m in messages).encode("utf-8")
+    block = CACHE_BLOCK_TOKENS * 4
+    hasher = hashlib.sha1()
+    cached = 0
+    seen = []
+    for end in range(block, len(serialized) + 1, block):
+        hasher.update(serialized[end - block:end])
+        if end < CACHE_MIN_TOKENS * 4:
+            continue
+        digest = hasher.hexdigest()
+        seen.append(digest)
+        with config.lock:
+            if digest in config.prompt_cache:
+                cached = end // 4
+    with config.lock:
+        config.prompt_cache.update(seen)
+        config.stats["prompt_tokens"] += len(serialized) // 4
+        config.stats["cached_tokens"] += cached
+    return cached
+
+
+def _chat_completion(model, content, finish_reason, prompt_tokens, completion_tokens, cached_tokens=0):
+    return {
+        "id": f"chatcmpl-stub-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": finish_reason,
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": _usage(prompt_tokens, completion_tokens, cached_tokens),
+    }
+
+
+def _completion_for(request, config=None):
+    """Build the canned chat completion for a request body, ignoring latency."""
+    messages = request.get("messages", [])
+    content = canned_content(messages, request.get("response_format"))
+    if config is not None and config.malformed_rate and content != CANNED_ANSWER and config.draw() < config.malformed_rate:
+        config.bump("malformed")
+        content = malform(content)
+    tokens = _split_tokens(content)
+    max_tokens = request.get("max_tokens")
+    finish_reason = "stop"
+    if max_tokens and len(tokens) > max_tokens:
+        tokens = tokens[:max_tokens]
+        finish_reason = "length"
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+    return tokens, finish_reason, prompt_tokens
+
+
+def _run_batch(config, batch):
+    """Work through a batch's input file in the background, as the real Batch API does."""
+    time.sleep(config.batch_delay / 2)
+    with config.lock:
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+        lines = config.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+    output, errors = [], []
+    for line in lines:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        body = item.get("body", {})
+        if item.get("url") != "/v1/chat/completions":
+            errors.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": item.get("custom_id"),
+                           "response": None,
+                           "error": {"code": "invalid_url", "message": f"Unsupported url {item.get('url')}"}})
+            continue
+        tokens, finish_reason, prompt_tokens = _completion_for(body, config)
+        completion = _chat_completion(body.get("model", "gpt-4.1-2025-04-14"), "".join(tokens),
+                                      finish_reason, prompt_tokens, len(tokens))
+        output.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": item.get("custom_id"),
+                       "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": completion},
+                       "error": None})
+    time.sleep(config.batch_delay / 2)
+    with config.lock:
+        config.stats["batch_requests"] += len(output) + len(errors)
+        if output:
+            batch["output_file_id"] = _store_file(config, "batch_output.jsonl", "batch_output",
+                                                  "".join(json.dumps(o) + "\n" for o in output).encode("utf-8"))
+        if errors:
+            batch["error_file_id"] = _store_file(config, "batch_errors.jsonl", "batch_output",
+                                                 "".join(json.dumps(e) + "\n" for e in errors).encode("utf-8"))
+        batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output),
+                                   "failed": len(errors)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+
+def _store_file(config, filename, purpose, content):
+    # Callers hold config.lock
+    file_id = f"file-stub-{uuid.uuid4().hex[:12]}"
+    config.files[file_id] = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                             "filename": filename, "purpose": purpose, "status": "processed", "content": content}
+    return file_id
+
+
+def _file_object(entry):
+    return {key: value for key, value in entry.items() if key != "content"}
+
+
+def _split_tokens(text, size=4):
+    # Roughly 4 characters per token, matching how OpenAI models tokenise English
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+            with self.config.lock:
+                stats = dict(self.config.stats)
+            self._send_json(200, stats)
+        elif self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4.1-2025-04-14", "object": "model"}]})
+        elif self.path.startswith("/v1/files/"):
+            self._get_file(self.path[len("/v1/files/"):].rstrip("/"))
+        elif self.path.startswith("/v1/batches/"):
+            batch_id = self.path[len("/v1/batches/"):].rstrip("/")
+            with self.config.lock:
+                batch = dict(self.config.batches[batch_id]) if batch_id in self.config.batches else None
+            if batch is None:
+                self._send_json(404, {"error": {"message": f"No batch {batch_id}", "type": "invalid_request_error"}})
+            else:
+                self._send_json(200, batch)
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def _get_file(self, path):
+        file_id, _, suffix = path.partition("/")
+        with self.config.lock:
+            entry = self.config.files.get(file_id)
+        if entry is None:
+            self._send_json(404, {"error": {"message": f"No file {file_id}", "type": "invalid_request_error"}})
+        elif suffix == "content":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(entry["content"])))
+            self.end_headers()
+            self.wfile.write(entry["content"])
+        else:
+            self._send_json(200, _file_object(entry))
+
+    def _upload_file(self, body):
+        # Multipart form with a "file" part and a "purpose" field, as sent by client.files.create()
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + body)
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = (part.get_filename(), part.get_payload(decode=True))
+        if "file" not in fields:
+            self._send_json(400, {"error": {"message": "Missing file", "type": "invalid_request_error"}})
+            return
+        filename, content = fields["file"]
+        purpose = fields.get("purpose", (None, b"batch"))[1].decode("utf-8")
+        with self.config.lock:
+            file_id = _store_file(self.config, filename or "upload.jsonl", purpose, content)
+            entry = _file_object(self.config.files[file_id])
+        self._send_json(200, entry)
+
+    def _create_batch(self, request):
+        config = self.config
+        with config.lock:
+            if request.get("input_file_id") not in config.files:
+                missing = True
+            else:
+                missing = False
+                batch = {
+                    "id": f"batch_stub_{uuid.uuid4().hex[:12]}", "object": "batch",
+                    "endpoint": request.get("endpoint", "/v1/chat/completions"),
+                    "input_file_id": request["input_file_id"],
+                    "completion_window": request.get("completion_window", "24h"),
+                    "status": "validating", "created_at": int(time.time()),
+                    "output_file_id": None, "error_file_id": None, "errors": None,
+                    "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                    "metadata": request.get("metadata"),
+                }
+                config.batches[batch["id"]] = batch
+                config.stats["batches"] += 1
+        if missing:
+            self._send_json(400, {"error": {"message": "Unknown input_file_id", "type": "invalid_request_error"}})
+            return
+        with config.lock:
+            snapshot = dict(batch)
+        threading.Thread(target=_run_batch, args=(config, batch), daemon=True).start()
+        self._send_json(200, snapshot)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        path = self.path.rstrip("/")
+        if path == "/v1/files":
+            self._upload_file(body)
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+        if path == "/v1/batches":
+            self._create_batch(request)
+            return
+        if path != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        config = self.config
+        config.bump("requests")
+        config.bump("in_flight")
+        try:
+            draw = config.draw()
+            if draw < config.rate_limit_rate:
+                config.bump("rate_limited")
+                self._send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+                                headers={"retry-after": str(config.retry_after)})
+                return
+            if draw < config.rate_limit_rate + config.error_rate:
+                config.bump("errors_injected")
+                self._send_json(500, {"error": {"message": "Injected server error (stub)", "type": "server_error"}})
+                return
+            self._complete(request)
+        finally:
+            config.bump("in_flight", -1)
+
+    def _complete(self, request):
+        config = self.config
+        model = request.get("model", "gpt-4.1-2025-04-14")
+        tokens, finish_reason, prompt_tokens = _completion_for(request, config)
+        cached_tokens = min(cached_prefix_tokens(config, request.get("messages", [])), prompt_tokens)
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        per_token = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+
+        time.sleep(config.ttft)
+        if not request.get("stream"):
+            time.sleep(per_token * len(tokens))
+            self._send_json(200, _chat_completion(model, "".join(tokens), finish_reason, prompt_tokens, len(tokens),
+                                                  cached_tokens))
+            return
+
+        config.bump("streamed")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        for token in tokens:
+            event({"content": token})
+            time.sleep(per_token)
+        event({}, finish_reason)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [], "usage": _usage(prompt_tokens, len(tokens), cached_tokens)}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_stub_server(host="127.0.0.1", port=0, **config):
+    """Start the stub in a background thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), _StubHandler)
+    server.daemon_threads = True
+    server.config = StubConfig(**config)
+    thread = threading.Thread(target=server.serve_forever, name="stub-llm-server", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in for offline load and latency testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--ttft", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0, help="Generation speed after the first token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds sent with 429s")
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="Seconds a Batch API job takes to complete")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of JSON replies sent fenced and truncated mid-section")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for error injection")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(
+        host=args.host, port=args.port, ttft=args.ttft, tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after, batch_delay=args.batch_delay, seed=args.seed,
+        malformed_rate=args.malformed_rate,
+    )
+    print(f"Stub LLM listening on {base_url} (set OPENAI_BASE_URL={base_url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
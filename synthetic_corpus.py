@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timezone
+
+from docx import Document
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+# Fixed creation date so regenerated PDFs differ only when their content does
+FIXED_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+FIRST_NAMES = ["Alex", "Jordan", "Sam", "Taylor", "Morgan", "Casey", "Riley", "Jamie"]
+LAST_NAMES = ["Rivera", "Chen", "Okafor", "Lindqvist", "Haddad", "Novak", "Patel", "Moreau"]
+
+# Per-assessment vocabulary: a report title, scale names with plausible score
+# ranges, and sentence fragments that give each type the trigger phrases the
+# ProfileGenerator content detection looks for.
+ASSESSMENT_KINDS = {
+    "hogan": {
+        "title": "Hogan Personality Inventory (HPI) and Hogan Development Survey (HDS) Report",
+        "scales": ["Adjustment", "Ambition", "Sociability", "Interpersonal Sensitivity", "Prudence",
+                   "Inquisitive", "Learning Approach", "Excitable", "Skeptical", "Cautious",
+                   "Reserved", "Leisurely", "Bold", "Mischievous", "Colorful", "Imaginative", "Diligent"],
+        "score_range": (5, 99),
+        "score_label": "percentile",
+        "sentences": [
+            "The HPI describes bright-side personality as seen by others in day-to-day interactions.",
+            "HDS results describe derailment risks that emerge under stress, pressure or fatigue.",
+            "MVPI results indicate the motives values preferences that shape preferred work environments.",
+            "Scores above the 90th percentile on the HDS indicate a high-risk derailer.",
+            "The candidate is likely to be seen as composed and even-tempered under pressure.",
+            "Low Prudence scores suggest flexibility but possible impatience with process and rules.",
+        ],
+    },
+    "360": {
+        "title": "360-Degree Leadership Feedback Report",
+        "scales": ["Strategic Thinking", "Communication", "Developing Others", "Execution",
+                   "Collaboration", "Emotional Control", "Decision Making", "Integrity"],
+        "score_range": (1, 5),
+        "score_label": "mean rating",
+        "sentences": [
+            "Raters included the manager, six peers and eight direct reports in this 360 review.",
+            "Direct reports rated communication lower than peers and the manager did.",
+            "Open-ended comments describe a leader who is driven but sometimes hard to approach.",
+            "Self ratings exceeded the ratings of others on most 360-degree dimensions.",
+            "Peers highlighted cross-functional collaboration as a consistent strength.",
+        ],
+    },
+    "cv": {
+        "title": "Curriculum Vitae",
+        "scales": [],
+        "score_range": (0, 0),
+        "score_label": "",
+        "sentences": [
+            "Professional experience: led a regional operations team of forty staff across three sites.",
+            "Work history includes progressively senior roles in finance and operations.",
+            "Education: MSc in Organisational Psychology, BSc in Economics.",
+            "Managed a budget of 12 million and delivered a multi-year transformation programme.",
+            "Resume highlights include international assignments in Singapore and Frankfurt.",
+        ],
+    },
+    "idi": {
+        "title": "Individual Directions Inventory (IDI) Report",
+        "scales": ["Affiliation", "Recognition", "Autonomy", "Achievement", "Security",
+                   "Dominance", "Nurturance", "Creativity"],
+        "score_range": (10, 90),
+        "score_label": "T score",
+        "sentences": [
+            "The Individual Directions Inventory describes the sources of emotional satisfaction at work.",
+            "This IDI report compares the respondent with a normative managerial sample.",
+            "High Achievement combined with low Security suggests comfort with ambiguity and risk.",
+            "Directions inventory results should be interpreted alongside behavioural evidence.",
+        ],
+    },
+    "performance": {
+        "title": "Annual Performance Review",
+        "scales": ["Goal Attainment", "Quality of Work", "Teamwork", "Initiative", "Reliability"],
+        "score_range": (1, 5),
+        "score_label": "performance rating",
+        "sentences": [
+            "This performance review covers the twelve-month period ending in December.",
+            "The annual review notes strong delivery against commercial objectives.",
+            "Development areas include delegation and coaching of junior colleagues.",
+            "The manager recommends a stretch assignment in the coming year.",
+        ],
+    },
+    "interview": {
+        "title": "Candidate Interview Notes",
+        "scales": [],
+        "score_range": (0, 0),
+        "score_label": "",
+        "sentences": [
+            "Interview notes: the candidate described a recent conflict with a senior stakeholder.",
+            "Interview summary: answers were structured, concise and evidence-based.",
+            "The candidate interview explored motivation for the role and career goals.",
+            "Reported sleeping poorly during periods of high workload.",
+        ],
+    },
+    "psych": {
+        "title": "Psychological Assessment Report",
+        "scales": ["MMPI-2 Depression", "MMPI-2 Psychasthenia", "GAD-7", "PHQ-9",
+                   "WAIS-IV FSIQ", "WAIS-IV Verbal Comprehension", "WHODAS 2.0"],
+        "score_range": (4, 120),
+        "score_label": "score",
+        "sentences": [
+            "Mental status examination: alert, oriented, speech normal in rate and volume.",
+            "Test results indicate elevated anxiety (T=68) with mild depressive symptoms (T=61).",
+            "Symptoms meet criteria for F41.1 Generalized Anxiety Disorder (DSM-5-TR).",
+            "Medical history includes chronic migraines managed with medication.",
+            "Treatment notes record improvement following relaxation training.",
+        ],
+    },
+}
+
+# Packet shapes by size: (kind, format, pages)
+PACKET_SIZES = {
+    "small": [("hogan", "pdf", 4), ("cv", "docx", 2), ("interview", "docx", 1)],
+    "medium": [("hogan", "pdf", 24), ("360", "pdf", 16), ("cv", "docx", 3),
+               ("idi", "pdf", 10), ("performance", "docx", 6), ("psych", "pdf", 12)],
+    "large": [("hogan", "pdf", 120), ("360", "pdf", 48), ("cv", "docx", 4), ("idi", "pdf", 30),
+              ("performance", "docx", 20), ("interview", "docx", 8), ("psych", "pdf", 60)],
+}
+
+PARAGRAPHS_PER_PAGE = 5
+SENTENCES_PER_PARAGRAPH = 4
+
+
+def _page_content(kind, page_no, rng):
+    """Return (paragraphs, score_rows) for one page of a synthetic report."""
+    spec = ASSESSMENT_KINDS[kind]
+    paragraphs = []
+    for _ in range(PARAGRAPHS_PER_PAGE):
+        paragraphs.append(" ".join(rng.choice(spec["sentences"]) for _ in range(SENTENCES_PER_PARAGRAPH)))
+    rows = []
+    if spec["scales"]:
+        low, high = spec["score_range"]
+        for scale in rng.sample(spec["scales"], min(6, len(spec["scales"]))):
+            rows.append((scale, str(rng.randint(low, high)), spec["score_label"]))
+    return paragraphs, rows
+
+
+def _page_text(heading, paragraphs, rows):
+    lines = [heading] + paragraphs + [" | ".join(row) for row in rows]
+    return "\n".join(lines)
+
+
+def _write_pdf(path, title, pages):
+    pdf = FPDF()
+    pdf.set_creation_date(FIXED_DATE)
+    pdf.set_auto_page_break(auto=False)
+    for heading, paragraphs, rows in pages:
+        pdf.add_page()
+        pdf.set_font("helvetica", "B", 13)
+        pdf.multi_cell(0, 7, heading, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.set_font("helvetica", size=10)
+        for paragraph in paragraphs:
+            pdf.multi_cell(0, 5, paragraph, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            pdf.ln(2)
+        for row in rows:
+            pdf.multi_cell(0, 5, " | ".join(row), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_title(title)
+    pdf.output(path)
+
+
+def _write_docx(path, title, pages):
+    doc = Document()
+    doc.add_heading(title, level=1)
+    for heading, paragraphs, rows in pages:
+        doc.add_heading(heading, level=2)
+        for paragraph in paragraphs:
+            doc.add_paragraph(paragraph)
+        if rows:
+            table = doc.add_table(rows=0, cols=3)
+            for row in rows:
+                cells = table.add_row().cells
+                for cell, value in zip(cells, row):
+                    cell.text = value
+        doc.add_page_break()
+    doc.save(path)
+
+
+def generate_document(out_dir, kind, fmt, pages, seed=0, name=None):
+    """Write one synthetic report and return its descriptor, including the ground-truth text."""
+    rng = random.Random(f"{seed}:{kind}:{fmt}:{pages}")
+    person = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    title = f"{ASSESSMENT_KINDS[kind]['title']} - {person}"
+    page_specs = []
+    for page_no in range(1, pages + 1):
+        paragraphs, rows = _page_content(kind, page_no, rng)
+        page_specs.append((f"{title} - Page {page_no}", paragraphs, rows))
+
+    name = name or f"{kind}_{pages}p_s{seed}.{fmt}"
+    path = os.path.join(out_dir, name)
+    if fmt == "pdf":
+        _write_pdf(path, title, page_specs)
+    elif fmt == "docx":
+        _write_docx(path, title, page_specs)
+    else:
+        raise ValueError(f"Unsupported synthetic format: {fmt}")
+
+    return {
+        "path": path,
+        "kind": kind,
+        "format": fmt,
+        "pages": pages,
+        "bytes": os.path.getsize(path),
+        "text": "\n".join(_page_text(*spec) for spec in page_specs),
+    }
+
+
+def generate_packet(out_dir, size="medium", seed=0):
+    """Generate a client packet of the given size and return the document descriptors."""
+    os.makedirs(out_dir, exist_ok=True)
+    return [generate_document(out_dir, kind, fmt, pages, seed=seed) for kind, fmt, pages in PACKET_SIZES[size]]
+
+
+def sample_profile():
+    """A valid six-section profile, as generate_profile would return it, for rendering benchmarks and stubs."""
+    return [
+        {"section": "Presenting Concerns and Goals", "content": "1. Reports moderate anxiety and disrupted sleep during high workload periods (Psychological Assessment)\n\n2. Seeks to improve delegation and reduce conflict with senior stakeholders (Interview Notes)\n\n3. Goals include building sustainable coping strategies (Treatment Notes)", "sources": "Psychological Assessment, Interview Notes, Treatment Notes"},
+        {"section": "History Snapshot", "content": "Psychiatric/Psychological: No prior diagnoses reported (Clinical Interview)\n\nMedical/Neurological: Chronic migraines managed with medication (Medical History)\n\nFamily & Social: Lives with partner, close family ties (Clinical Interview)\n\nEducational/Occupational: MSc in Organisational Psychology, senior operations roles (CV/Resume)", "sources": "Clinical Interview, Medical History, CV/Resume"},
+        {"section": "Behavioral Observations", "content": "Alert and oriented, speech normal in rate and volume, affect mildly anxious when discussing work stressors (Psychological Assessment).", "sources": "Psychological Assessment"},
+        {"section": "Test Results by Domain", "content": "1. Personality/Emotional: MMPI-2 elevated anxiety (T=68) and mild depression (T=61) (Psychological Assessment)\n\n2. Derailers: HDS Excitable at the 92nd percentile (Hogan Assessment)\n\n3. Symptom Measures: GAD-7 of 14 indicating moderate anxiety (Standardized Tests)", "sources": "Psychological Assessment, Hogan Assessment, Standardized Tests"},
+        {"section": "Integrative Case Formulation", "content": "Predisposing Factors: Perfectionistic tendencies (Hogan Assessment)\n\nPrecipitating Factors: Recent promotion (CV/Resume)\n\nPerpetuating Factors: Avoidant coping under pressure (360° Feedback)\n\nProtective Factors: Strong social support (Clinical Interview)", "sources": "Hogan Assessment, CV/Resume, 360° Feedback, Clinical Interview"},
+        {"section": "Diagnoses", "content": "1. F41.1 Generalized Anxiety Disorder - excessive worry and sleep disturbance (DSM-5-TR)\n\n2. Rule Out: F51.01 Insomnia Disorder (DSM-5-TR)", "sources": "Psychological Assessment"},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic assessment packets.")
+    parser.add_argument("--out", default="bench_corpus", help="Output directory")
+    parser.add_argument("--size", choices=sorted(PACKET_SIZES), default="medium")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    docs = generate_packet(os.path.join(args.out, args.size), size=args.size, seed=args.seed)
+    summary = [{k: v for k, v in d.items() if k != "text"} for d in docs]
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
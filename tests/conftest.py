@@ -0,0 +1,18 @@
+import hashlib
+import os
+
+import pytest
+
+# The modules read the key at import; tests never reach the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture(autouse=True)
+def offline_embeddings(monkeypatch):
+    """Replace Chroma's default embedding model (downloaded on first use) with a content hash."""
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+    def embed(self, input):
+        return [[b / 255 for b in hashlib.sha256(text.encode("utf-8")).digest()[:16]] for text in input]
+
+    monkeypatch.setattr(ONNXMiniLM_L6_V2, "__call__", embed)
@@ -0,0 +1,53 @@
+import io
+
+import docx
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("REFERENCE_FOLDER", str(tmp_path))
+    with TestClient(api_server.app) as client:
+        yield client
+
+
+def _case(client):
+    return client.post("/cases").json()["case_id"]
+
+
+def _docx(text):
+    document = docx.Document()
+    document.add_paragraph(text)
+    data = io.BytesIO()
+    document.save(data)
+    return data.getvalue()
+
+
+def test_upload_adds_documents(client):
+    case_id = _case(client)
+    response = client.post(f"/cases/{case_id}/documents", data={"role": "subject"},
+                           files=[("files", ("notes.docx", _docx("Interview notes: candidate interview")))])
+    assert response.status_code == 200, response.text
+    assert len(response.json()["documents"]["subject"]) == 1
+
+
+@pytest.mark.parametrize("name, data", [
+    ("hogan_report.pdf", b"%PDF-1.7 truncated"),
+    ("hogan_report.pdf", b"not a pdf at all"),
+    ("notes.docx", b"PK not a zip"),
+])
+def test_unreadable_upload_is_422_naming_the_file(client, name, data):
+    case_id = _case(client)
+    response = client.post(f"/cases/{case_id}/documents", data={"role": "subject"}, files=[("files", (name, data))])
+    assert response.status_code == 422
+    assert name in response.json()["detail"]
+    assert client.get(f"/cases/{case_id}").json()["documents"]["subject"] == []
+
+
+def test_unsupported_upload_is_400(client):
+    case_id = _case(client)
+    response = client.post(f"/cases/{case_id}/documents", files=[("files", ("notes.txt", b"plain text"))])
+    assert response.status_code == 400
@@ -0,0 +1,37 @@
+import docx
+from docx.enum.text import WD_BREAK
+
+from document_processor import iter_docx_blocks
+
+
+def test_iter_docx_blocks_in_document_order(tmp_path):
+    document = docx.Document()
+    document.add_paragraph("Hogan Development Survey")
+    run = document.add_paragraph("Bold:\t92").add_run()
+    run.add_break(WD_BREAK.LINE)
+    run.add_text("Mischievous: 75")
+    table = document.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = "Scale"
+    table.cell(0, 1).text = "Percentile"
+    table.cell(1, 0).text = "Adjustment"
+    nested = table.cell(1, 1).add_table(rows=1, cols=2)
+    nested.cell(0, 0).text = "62"
+    nested.cell(0, 1).text = "average"
+    document.add_paragraph("Summary")
+    path = tmp_path / "report.docx"
+    document.save(path)
+
+    assert list(iter_docx_blocks(str(path))) == [
+        "Hogan Development Survey",
+        "Bold:\t92\nMischievous: 75",
+        "Scale | Percentile",
+        "Adjustment | 62 | average",
+        "Summary",
+    ]
+
+
+def test_iter_docx_blocks_empty_document(tmp_path):
+    path = tmp_path / "empty.docx"
+    document = docx.Document()
+    document.save(path)
+    assert list(iter_docx_blocks(str(path))) == []
@@ -0,0 +1,123 @@
+import pytest
+
+from document_store import DocumentEvicted, DocumentStore, text_key
+
+
+def test_put_stores_each_text_once():
+    store = DocumentStore()
+    first = store.put("s1", "shared manual")
+    second = store.put("s2", "shared manual")
+    assert first == second == text_key("shared manual")
+    assert store.stats()["documents"] == 1
+    assert store.get_many([first]) == ["shared manual"]
+
+
+def test_release_frees_text_only_when_no_session_holds_it():
+    store = DocumentStore()
+    key = store.put("s1", "shared manual")
+    store.put("s2", "shared manual")
+    store.release("s1")
+    assert store.get(key) == "shared manual"
+    store.release("s2")
+    assert not store.has_all([key])
+    with pytest.raises(DocumentEvicted):
+        store.get(key)
+    assert store.stats() == {"sessions": 0, "documents": 0, "bytes": 0, "max_bytes": store.max_bytes}
+
+
+def test_retain_keeps_only_listed_keys():
+    store = DocumentStore()
+    keep, drop = store.put_many("s1", ["report", "old manual"])
+    store.put("s1", "report")
+    store.retain("s1", [keep])
+    assert store.has_all([keep])
+    assert not store.has_all([drop])
+    assert store.session_bytes("s1")["documents"] == 1
+    # Re-putting a retained text does not take a second reference
+    store.release("s1")
+    assert not store.has_all([keep])
+
+
+def test_session_bytes_splits_shared_text():
+    store = DocumentStore()
+    store.put("s1", "x" * 100)
+    store.put("s2", "x" * 100)
+    store.put("s1", "y" * 50)
+    assert store.session_bytes("s1") == {"documents": 2, "bytes": 150, "shared_bytes": 50, "attributed_bytes": 100}
+
+
+def test_evict_idle_releases_and_notifies():
+    store = DocumentStore(idle_seconds=60)
+    evicted = []
+    store.on_evict("test", evicted.append)
+    key = store.put("idle", "old text")
+    store.put("active", "new text")
+    now = store._last_seen["idle"] + 120
+    store._last_seen["active"] = now - 10
+    assert store.evict_idle(now=now) == 1
+    assert evicted == ["idle"]
+    assert not store.has_all([key])
+    assert store.evict_idle(now=now) == 0
+
+
+def test_touch_keeps_session_alive():
+    store = DocumentStore(idle_seconds=60)
+    key = store.put("s1", "text")
+    store.touch("s1")
+    assert store.evict_idle(now=store._last_seen["s1"] + 30) == 0
+    assert store.has_all([key])
+
+
+def test_ceiling_evicts_least_recently_active_other_session():
+    store = DocumentStore(max_bytes=250)
+    evicted = []
+    store.on_evict("test", evicted.append)
+    store.put("oldest", "a" * 100)
+    store.put("older", "b" * 100)
+    store._last_seen["oldest"] -= 10
+    store.put("current", "c" * 100)
+    assert evicted == ["oldest"]
+    assert store.stats()["bytes"] == 200
+
+
+def test_failing_listener_does_not_stop_others():
+    store = DocumentStore(idle_seconds=0)
+    evicted = []
+
+    def fail(session_id):
+        raise RuntimeError("boom")
+
+    store.on_evict("failing", fail)
+    store.on_evict("recording", evicted.append)
+    store.put("s1", "text")
+    store.evict_idle(now=store._last_seen["s1"] + 1)
+    assert evicted == ["s1"]
+
+
+def test_ceiling_skips_sessions_in_use_until_they_finish():
+    store = DocumentStore(max_bytes=250)
+    evicted = []
+    store.on_evict("test", evicted.append)
+    with store.active("busy"):
+        store.put("busy", "a" * 100)
+        store.put("older", "b" * 100)
+        store._last_seen["busy"] -= 10
+        store.put("current", "c" * 100)
+        assert evicted == ["older"]
+        store.put("current", "d" * 100)
+        # Nothing left to evict but the session in use: the store stays over its ceiling
+        assert evicted == ["older"]
+        assert store.stats()["bytes"] == 300
+    # Once it finishes, the ceiling is enforced again, sparing the session that just finished
+    assert evicted == ["older", "current"]
+    assert store.stats()["bytes"] == 100
+
+
+def test_idle_eviction_skips_sessions_in_use():
+    store = DocumentStore(idle_seconds=60)
+    key = store.put("s1", "text")
+    now = store._last_seen["s1"] + 120
+    with store.active("s1"), store.active("s1"):
+        assert store.evict_idle(now=now) == 0
+    assert store.has_all([key])
+    assert store.evict_idle(now=now) == 1
@@ -0,0 +1,75 @@
+from lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def make_index():
+    index = BM25Index()
+    index.add(["a", "b", "c"],
+              ["HDS derailers: Bold and Mischievous scales are high",
+               "MMPI-2 profile, F41.1 generalised anxiety",
+               "Work history in finance and consulting"],
+              [{"role": "subject", "type": "Hogan Assessment"},
+               {"role": "subject", "type": "PDF Document"},
+               {"role": "context", "type": "CV/Resume"}])
+    return index
+
+
+def test_tokenize_keeps_clinical_codes_whole():
+    assert tokenize("MMPI-2 T=68, F41.1 and 360°") == ["mmpi-2", "t=68", "f41.1", "and", "360°"]
+
+
+def test_search_ranks_exact_tokens():
+    index = make_index()
+    assert [chunk_id for chunk_id, _ in index.search("mmpi-2 f41.1")] == ["b"]
+    assert index.search("hds bold")[0][0] == "a"
+    assert index.search("unrelated words") == []
+
+
+def test_add_replaces_existing_id():
+    index = make_index()
+    index.add(["b"], ["Interview notes about the hds"], [{"role": "context", "type": "Interview Notes"}])
+    assert len(index) == 3
+    assert index.search("mmpi-2") == []
+    assert {chunk_id for chunk_id, _ in index.search("hds")} == {"a", "b"}
+    assert index.total_length == sum(index.lengths.values())
+
+
+def test_remove_drops_postings_and_fields():
+    index = make_index()
+    index.remove(["a", "missing"])
+    assert len(index) == 2
+    assert "hds" not in index.postings
+    assert ("type", "Hogan Assessment") not in index.fields
+    assert index.search("hds") == []
+    assert index.total_length == sum(index.lengths.values())
+
+
+def test_filters_restrict_candidates():
+    index = make_index()
+    assert index.search("hds finance", role="context")[0][0] == "c"
+    assert [chunk_id for chunk_id, _ in index.search("hds finance", role="subject")] == ["a"]
+    assert {chunk_id for chunk_id, _ in index.search("hds finance", type=["Hogan Assessment", "CV/Resume"])} == {"a", "c"}
+    assert index.search("hds", role="subject", type="CV/Resume") == []
+    assert index.search("hds", role="nobody") == []
+    assert index.search("hds", role=None)[0][0] == "a"
+
+
+def test_filters_do_not_change_scores():
+    index = make_index()
+    unfiltered = dict(index.search("hds finance"))
+    for chunk_id, score in index.search("hds finance", role="context"):
+        assert score == unfiltered[chunk_id]
+
+
+def test_clear():
+    index = make_index()
+    index.clear()
+    assert len(index) == 0
+    assert index.search("hds") == []
+    assert not index.fields and index.total_length == 0
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c"]], k=60)
+    assert [chunk_id for chunk_id, _ in fused] == ["b", "c", "a"]
+    assert fused[0][1] == 1 / 62 + 1 / 61
+    assert reciprocal_rank_fusion([]) == []
@@ -0,0 +1,25 @@
+import pytest
+
+from model_router import TASKS, ModelRouter, router
+
+TIERS = {"synthesis": {"model": "big", "max_tokens": 2000}, "fast": {"model": "small", "max_tokens": 500, "timeout": 30}}
+
+
+def test_configured_tasks_are_the_routed_tasks():
+    assert set(router.tasks) == set(TASKS)
+
+
+def test_task_overrides_its_tier():
+    routes = ModelRouter(TIERS, {"digest": {"tier": "fast", "max_tokens": 800}})
+    assert routes.params("digest") == {"model": "small", "max_tokens": 800, "timeout": 30}
+    assert routes.route("profile").tier == "synthesis"
+
+
+def test_unknown_task_is_rejected():
+    with pytest.raises(ValueError, match="question_rewrite"):
+        ModelRouter(TIERS, {"question_rewrite": {"tier": "fast"}})
+
+
+def test_unknown_tier_is_rejected():
+    with pytest.raises(ValueError, match="tiny"):
+        ModelRouter(TIERS, {"digest": {"tier": "tiny"}})
@@ -0,0 +1,66 @@
+import pytest
+
+import pdf_renderer
+
+PROFILE = [{"section": "Diagnoses", "content": "- No diagnosis indicated\n**Rule out:** adjustment disorder",
+            "sources": "Interview notes"}]
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Count real renders, starting from an empty cache."""
+    calls = []
+    render = pdf_renderer._render
+
+    def counting_render(profile_json, answers):
+        calls.append(profile_json)
+        return render(profile_json, answers)
+
+    monkeypatch.setattr(pdf_renderer, "_render", counting_render)
+    monkeypatch.setattr(pdf_renderer, "_cache", type(pdf_renderer._cache)())
+    return calls
+
+
+def test_render_pdf_produces_a_pdf(renders):
+    data = pdf_renderer.render_pdf(PROFILE, [{"question": "Fit for role?", "answer": "Likely, with support."}])
+    assert data.startswith(b"%PDF")
+
+
+def test_unchanged_report_is_rendered_once(renders):
+    first = pdf_renderer.render_pdf(PROFILE)
+    assert pdf_renderer.render_pdf([dict(section) for section in PROFILE]) is first
+    assert pdf_renderer.submit_pdf(PROFILE).result() is first
+    assert len(renders) == 1
+
+
+def test_changed_report_is_rendered_again(renders):
+    pdf_renderer.render_pdf(PROFILE)
+    pdf_renderer.render_pdf(PROFILE, [{"question": "Fit for role?", "answer": "Yes."}])
+    pdf_renderer.render_pdf([dict(PROFILE[0], content="Updated")])
+    assert len(renders) == 3
+
+
+def test_cache_is_bounded(renders, monkeypatch):
+    monkeypatch.setattr(pdf_renderer, "CACHE_ENTRIES", 2)
+    profiles = [[dict(PROFILE[0], content=f"Version {i}")] for i in range(3)]
+    for profile in profiles:
+        pdf_renderer.render_pdf(profile)
+    assert len(pdf_renderer._cache) == 2
+    # The oldest report was dropped, the most recent ones are still lookups
+    pdf_renderer.render_pdf(profiles[2])
+    pdf_renderer.render_pdf(profiles[0])
+    assert len(renders) == 4
+
+
+def test_underscores_and_dashes_are_plain_text(renders):
+    text = "Scored __ out of 10 on ____ -- see [1](2) and **Bold** only"
+    data = pdf_renderer.render_pdf([{"section": "Diagnoses", "content": f"{text}\n- Item -- with __ blank",
+                                     "sources": ""}])
+    assert data.startswith(b"%PDF")
+
+    pdf = pdf_renderer._ReportPDF()
+    pdf.set_font("helvetica", "", 11)
+    fragments = list(pdf._markdown_parse(text))
+    assert "".join(fragment.string for fragment in fragments) == text.replace("**", "")
+    assert [fragment.font_style for fragment in fragments] == ["", "B", ""]
+    assert not any(fragment.underline or fragment.link for fragment in fragments)
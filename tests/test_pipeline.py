@@ -0,0 +1,148 @@
+import json
+import os
+import uuid
+
+import pytest
+
+import pipeline
+from assessment_types import PROFILE_SECTIONS, affected_sections
+from document_store import store as document_store
+from vector_store import VectorStore
+
+
+class Upload:
+    """An uploaded file, as the app and API hand it to the pipeline."""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.data = text.encode("utf-8")
+
+    def getvalue(self):
+        return self.data
+
+
+class FakeProcessor:
+    """Extracts uploads as plain text, one page per form feed, and records what it extracted."""
+
+    def __init__(self):
+        self.extracted = []
+
+    def process_document_pages(self, file_path):
+        with open(file_path, encoding="utf-8") as f:
+            pages = f.read().split("\f")
+        self.extracted.append(pages[0])
+        return pages, {"file_type": file_path.split(".")[-1].lower(), "file_name": os.path.basename(file_path)}
+
+
+class FakeGenerator:
+    """Returns a fixed profile and records which calls were made."""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate_profile(self, document_chunks, metadata=None, reference_docs=None):
+        self.calls.append(("profile", None))
+        self.pinned = dict(document_store._active)
+        return json.dumps([{"section": name, "content": "first", "sources": ""} for name in PROFILE_SECTIONS])
+
+    def generate_sections(self, document_chunks, sections, metadata=None, reference_docs=None, guidance=None):
+        self.calls.append(("sections", list(sections)))
+        return [{"section": name, "content": "regenerated", "sources": ""} for name in sections]
+
+    def answer_question(self, document_chunks, question, reference_docs=None):
+        self.calls.append(("answer", question))
+        return f"Answer to {question}"
+
+
+HOGAN = Upload("hogan_report.pdf", "HPI adjustment high\fHDS bold elevated")
+NOTES = Upload("notes.pdf", "Interview notes: candidate interview about goals")
+CV = Upload("jane_cv.docx", "Work history in finance")
+
+
+@pytest.fixture
+def case():
+    state = {"profile": None, "question_answer": None}
+    vector_store = VectorStore(namespace=uuid.uuid4().hex[:12])
+    processor = FakeProcessor()
+    generator = FakeGenerator()
+
+    def submit(subject, context, question=""):
+        processor.extracted.clear()
+        generator.calls.clear()
+        return pipeline.submit_case(state, subject, context, question, processor, vector_store, generator, None)
+
+    yield state, vector_store, processor, generator, submit
+    vector_store.drop()
+    document_store.release(pipeline.session_id(state))
+
+
+def _contents(state):
+    return {section["section"]: section["content"] for section in json.loads(state["profile"])}
+
+
+def test_first_submit_generates_everything(case):
+    state, vector_store, processor, generator, submit = case
+    assert submit([HOGAN, NOTES], [], "Next steps?") == PROFILE_SECTIONS
+    assert generator.calls == [("profile", None), ("answer", "Next steps?")]
+    assert vector_store.collection.count() == 3
+    assert [entry["type"] for entry in state["case_manifest"].values()] == ["Hogan Assessment", "Interview Notes"]
+    assert pipeline.session_docs(state, "subject") == ["HPI adjustment high HDS bold elevated",
+                                                       "Interview notes: candidate interview about goals"]
+
+
+def test_unchanged_submit_is_a_no_op(case):
+    state, vector_store, processor, generator, submit = case
+    submit([HOGAN, NOTES], [], "Next steps?")
+    profile = state["profile"]
+    assert submit([HOGAN, NOTES], [], "Next steps?") == []
+    assert processor.extracted == []
+    assert generator.calls == []
+    assert state["profile"] == profile
+    assert vector_store.collection.count() == 3
+    # Only a new question is answered
+    assert submit([HOGAN, NOTES], [], "Strengths?") == []
+    assert generator.calls == [("answer", "Strengths?")]
+
+
+def test_added_document_regenerates_its_sections(case):
+    state, vector_store, processor, generator, submit = case
+    submit([HOGAN], [])
+    sections = submit([HOGAN], [CV])
+    assert sections == affected_sections(["CV/Resume"])
+    assert processor.extracted == ["Work history in finance"]
+    assert generator.calls == [("sections", sections)]
+    assert vector_store.collection.count() == 3
+    assert vector_store.get_relevant_chunks(role="context") == ["Work history in finance"]
+    contents = _contents(state)
+    assert [name for name in PROFILE_SECTIONS if contents[name] == "regenerated"] == sections
+    assert len(state["context_doc_keys"]) == 1 and state["context_metadatas"][0]["file_type"] == "docx"
+
+
+def test_removed_document_is_deleted(case):
+    state, vector_store, processor, generator, submit = case
+    submit([HOGAN, NOTES], [])
+    hogan_key = next(key for key, entry in state["case_manifest"].items() if entry["type"] == "Hogan Assessment")
+    sections = submit([NOTES], [])
+    assert sections == affected_sections(["Hogan Assessment"])
+    assert processor.extracted == []
+    assert vector_store.get_relevant_chunks(doc=hogan_key) == []
+    assert vector_store.lexical.search("hds") == []
+    assert vector_store.collection.count() == 1
+    assert list(state["case_manifest"]) == [key for key in state["case_manifest"] if key != hogan_key]
+    assert len(state["subject_doc_keys"]) == 1
+
+
+def test_emptied_vector_store_forces_full_submit(case):
+    state, vector_store, processor, generator, submit = case
+    submit([HOGAN], [])
+    vector_store.store_documents([])
+    assert submit([HOGAN], []) == PROFILE_SECTIONS
+    assert generator.calls == [("profile", None)]
+    assert vector_store.collection.count() == 2
+
+
+def test_submit_pins_the_session(case):
+    state, vector_store, processor, generator, submit = case
+    submit([HOGAN], [])
+    assert generator.pinned.get(state["session_id"]) == 1
+    assert state["session_id"] not in document_store._active
@@ -0,0 +1,67 @@
+import os
+from io import BytesIO
+
+from pptx import Presentation
+
+from assessment_types import PROFILE_SECTIONS
+from pptx_renderer import CONTENT_SHAPE_PREFIX, _clone_slide, generate_pptx_from_json, patch_section_slide
+
+REL_ATTR_PREFIX = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "template.pptx")
+PROFILE = [{"section": name, "content": f"{name} findings", "sources": "Hogan report"} for name in PROFILE_SECTIONS]
+
+
+def _reload(prs):
+    data = BytesIO()
+    prs.save(data)
+    data.seek(0)
+    return Presentation(data)
+
+
+def _related_parts(slide):
+    """Parts referenced from a slide's shapes (pictures, media, links), resolved through its relationships."""
+    return [slide.part.related_part(rId) for node in slide.shapes._spTree.iter() for attr, rId in node.attrib.items()
+            if attr.startswith(REL_ATTR_PREFIX)]
+
+
+def _texts(slide):
+    return [shape.text_frame.text for shape in slide.shapes if shape.has_text_frame]
+
+
+def test_clone_slide_copies_shapes_and_pictures():
+    prs = Presentation(TEMPLATE)
+    cover = prs.slides[0]
+    clone = _clone_slide(prs, cover)
+    assert clone.slide_layout is cover.slide_layout
+    assert [shape.name for shape in clone.shapes] == [shape.name for shape in cover.shapes]
+
+    reloaded = _reload(prs)
+    source, copy = reloaded.slides[0], reloaded.slides[len(reloaded.slides) - 1]
+    assert _texts(copy) == _texts(source)
+    images = _related_parts(copy)
+    assert images and images == _related_parts(source)
+
+
+def test_clone_slide_is_independent_of_source():
+    prs = Presentation(TEMPLATE)
+    source = prs.slides[2]
+    clone = _clone_slide(prs, source)
+    before = _texts(source)
+    next(shape for shape in clone.shapes if shape.has_text_frame).text_frame.text = "Changed"
+    assert _texts(source) == before
+
+
+def test_patch_section_slide_rewrites_one_section():
+    deck = generate_pptx_from_json(PROFILE, TEMPLATE).getvalue()
+    patched = patch_section_slide(deck, {"section": "Diagnoses", "content": "Revised diagnosis", "sources": "Interview"})
+    shapes = {shape.name: shape.text_frame.text for slide in Presentation(patched).slides for shape in slide.shapes
+              if shape.name.startswith(CONTENT_SHAPE_PREFIX)}
+    assert "Revised diagnosis" in shapes[CONTENT_SHAPE_PREFIX + "Diagnoses"]
+    assert "Diagnoses findings" not in shapes[CONTENT_SHAPE_PREFIX + "Diagnoses"]
+    assert "History Snapshot findings" in shapes[CONTENT_SHAPE_PREFIX + "History Snapshot"]
+    assert len(Presentation(patched).slides) == len(Presentation(BytesIO(deck)).slides)
+
+
+def test_patch_section_slide_without_the_section():
+    deck = generate_pptx_from_json(PROFILE[:1], TEMPLATE).getvalue()
+    assert patch_section_slide(deck, {"section": "Not In Deck", "content": "x", "sources": ""}) is None
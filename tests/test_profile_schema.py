@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from profile_schema import parse_sections, repair_json
+
+SECTIONS = [
+    {"section": "Presenting Concerns and Goals", "content": "Wants to lead a larger team.", "sources": "CV"},
+    {"section": "History Snapshot", "content": "Ten years in finance.", "sources": "CV"},
+]
+
+
+def test_parse_sections_valid_reply():
+    sections, repaired = parse_sections(json.dumps(SECTIONS))
+    assert sections == SECTIONS
+    assert not repaired
+
+
+def test_parse_sections_unwraps_structured_output():
+    sections, repaired = parse_sections(json.dumps({"sections": SECTIONS}))
+    assert sections == SECTIONS
+    assert not repaired
+
+
+def test_repair_json_strips_fences_and_prose():
+    reply = "Here is the profile:\n```json\n" + json.dumps(SECTIONS) + "\n```"
+    sections, repaired = parse_sections(reply)
+    assert sections == SECTIONS
+    assert repaired
+
+
+def test_repair_json_drops_trailing_commas():
+    reply = '[{"section": "History Snapshot", "content": "Ten years.", "sources": "CV",},]'
+    assert repair_json(reply) == [{"section": "History Snapshot", "content": "Ten years.", "sources": "CV"}]
+
+
+def test_repair_json_keeps_commas_inside_strings():
+    reply = '[{"section": "Diagnoses", "content": "Rule out: [A, ] and {B, }", "sources": "",},]'
+    assert repair_json(reply)[0]["content"] == "Rule out: [A, ] and {B, }"
+
+
+def test_repair_json_keeps_complete_sections_of_truncated_reply():
+    reply = json.dumps(SECTIONS)[:-40]
+    assert repair_json(reply) == SECTIONS[:1]
+
+
+def test_repair_json_handles_escaped_quotes_when_truncating():
+    first = {"section": "Diagnoses", "content": 'Reported "low mood, ]" at intake', "sources": ""}
+    reply = json.dumps([first])[:-1] + ', {"section": "History'
+    assert repair_json(reply) == [first]
+
+
+@pytest.mark.parametrize("reply", ["", "no json here", '[{"section": "Diagnoses", "content": "cut'])
+def test_parse_sections_unrecoverable(reply):
+    with pytest.raises(ValueError):
+        parse_sections(reply)
@@ -0,0 +1,71 @@
+import uuid
+
+import numpy as np
+import pytest
+
+import vector_store
+from vector_store import VectorStore, mmr_select
+
+# Candidates 0 and 1 are near duplicates; 2 is different but less relevant
+EMBEDDINGS = np.array([[1.0, 0.0], [0.99, 0.05], [0.0, 1.0], [0.7, 0.7]])
+RELEVANCE = [0.9, 0.85, 0.5, 0.1]
+
+
+def test_pure_relevance_order():
+    assert mmr_select(RELEVANCE, EMBEDDINGS, n_results=4, mmr_lambda=1.0) == [0, 1, 2, 3]
+
+
+def test_diversity_beats_near_duplicate():
+    assert mmr_select(RELEVANCE, EMBEDDINGS, n_results=2, mmr_lambda=0.5) == [0, 2]
+
+
+def test_duplicate_threshold_drops_near_duplicates():
+    picks = mmr_select(RELEVANCE, EMBEDDINGS, mmr_lambda=1.0, duplicate_threshold=0.95)
+    assert picks == [0, 2, 3]
+
+
+def test_token_budget_stops_selection():
+    tokens = [300, 300, 300, 300]
+    assert mmr_select(RELEVANCE, EMBEDDINGS, mmr_lambda=1.0, tokens=tokens, token_budget=700) == [0, 1]
+
+
+def test_token_budget_skips_candidates_that_do_not_fit():
+    tokens = [500, 400, 100, 50]
+    assert mmr_select(RELEVANCE, EMBEDDINGS, mmr_lambda=1.0, tokens=tokens, token_budget=600) == [0, 2]
+    assert mmr_select(RELEVANCE, EMBEDDINGS, mmr_lambda=1.0, tokens=tokens, token_budget=40) == []
+
+
+def test_n_results_and_budget_together():
+    tokens = [10, 10, 10, 10]
+    assert mmr_select(RELEVANCE, EMBEDDINGS, n_results=1, mmr_lambda=1.0, tokens=tokens, token_budget=100) == [0]
+
+
+def test_equal_relevance_and_zero_vectors():
+    assert mmr_select([], np.zeros((0, 2))) == []
+    assert sorted(mmr_select([1.0, 1.0], np.zeros((2, 2)))) == [0, 1]
+
+
+@pytest.fixture
+def store():
+    vector_store = VectorStore(namespace=uuid.uuid4().hex[:12])
+    vector_store.store_documents([f"Page {i} of the HDS report: bold scale {i}" for i in range(6)],
+                                 [{"role": "subject", "page": i} for i in range(6)])
+    yield vector_store
+    vector_store.drop()
+
+
+@pytest.mark.parametrize("options", [
+    dict(mode="hybrid"),
+    dict(mode="vector", mmr_lambda=0.7),
+    dict(mode="lexical", duplicate_threshold=0.95),
+    dict(mode="vector"),
+])
+def test_query_without_n_results(store, options):
+    chunks = store.get_relevant_chunks("hds bold", n_results=None, **options)
+    assert len(chunks) == 6
+
+
+def test_query_without_n_results_is_capped(store, monkeypatch):
+    monkeypatch.setattr(vector_store, "BUDGET_CANDIDATES", 4)
+    assert len(store.get_relevant_chunks("hds bold", n_results=None, mode="lexical")) == 4
+    assert len(store.get_relevant_chunks("hds bold", n_results=None, mode="vector", mmr_lambda=0.7)) == 4
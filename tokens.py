@@ -0,0 +1,27 @@
+import tiktoken
+
+_encoding = None
+
+
+def encoding():
+    """The tiktoken encoding prompts are counted with, loaded once; None if it cannot be loaded."""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # Encoding files could not be loaded (e.g. no network); estimate instead
+                print(f"Token encoding unavailable, estimating token counts: {e}")
+                _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    """Count prompt tokens with tiktoken, falling back to a 4-chars-per-token estimate."""
+    enc = encoding()
+    if enc is None:
+        return len(text) // 4
+    return len(enc.encode(text, disallowed_special=()))
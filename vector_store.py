@@ -1,49 +1,286 @@
 import chromadb
 from chromadb.config import Settings
 import os
+import threading
+from functools import lru_cache
 from typing import List
+import numpy as np
+import metrics
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from tokens import count_tokens
+
+COLLECTION_NAME = "psychology_documents"
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+# Hybrid and diversified queries consider this many candidates per result
+CANDIDATE_DEPTH = 4
+# Defaults for callers that diversify: MMR trade-off and near-duplicate cosine similarity
+MMR_LAMBDA = 0.7
+DUPLICATE_THRESHOLD = 0.95
+# Queries without a chunk count (n_results=None, usually filling a token budget) consider this many candidates
+BUDGET_CANDIDATES = 64
+
+_client = None
+_client_lock = threading.Lock()
+
+def _get_client():
+    """Return the process-wide Chroma client, creating it once.
+
+    Chroma's shared system setup is not thread-safe, so concurrent sessions
+    or batch workers must not construct clients in parallel.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            # In-memory: collections hold one session's or case's chunks and are dropped with it
+            _client = chromadb.Client(Settings(anonymized_telemetry=False))
+        return _client
+
+def _where(filters: dict):
+    """Chroma where clause for metadata filters: equality, $in for lists, combined with $and."""
+    conditions = []
+    for key, value in filters.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            conditions.append({key: {"$in": list(value)}})
+        else:
+            conditions.append({key: value})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+_lexical_indexes = {}
+_lexical_lock = threading.Lock()
+
+@lru_cache(maxsize=8192)
+def chunk_tokens(chunk: str) -> int:
+    """Prompt tokens of a stored chunk, counted once per distinct text."""
+    return count_tokens(chunk)
+
+def mmr_select(relevance, embeddings, n_results=None, mmr_lambda=MMR_LAMBDA, duplicate_threshold=None,
+               tokens=None, token_budget=None) -> List[int]:
+    """Indices of candidates chosen by maximal marginal relevance, up to n_results and/or token_budget.
+
+    relevance is one score per candidate (higher is better) and embeddings one row per
+    candidate. Each step picks the candidate maximising
+    mmr_lambda * relevance - (1 - mmr_lambda) * (max similarity to those already picked);
+    candidates at or above duplicate_threshold similarity to a pick are dropped. With a
+    token_budget, tokens gives each candidate's token count: candidates that no longer fit
+    are dropped and selection stops once the picks' total reaches the budget.
+    """
+    count = len(relevance)
+    if not count:
+        return []
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0, 1, norms)
+    similarity = unit @ unit.T
+    # Scale relevance to [0, 1] so it is comparable with cosine similarity whatever the scorer
+    relevance = np.asarray(relevance, dtype=np.float32)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(count, dtype=np.float32)
+
+    available = np.ones(count, dtype=bool)
+    max_similarity = np.zeros(count, dtype=np.float32)
+    if token_budget is not None:
+        tokens = np.asarray(tokens, dtype=np.int64)
+        remaining = token_budget
+        available &= tokens <= remaining
+    picks = []
+    while (n_results is None or len(picks) < n_results) and available.any():
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        picks.append(pick)
+        available[pick] = False
+        max_similarity = np.maximum(max_similarity, similarity[pick])
+        if duplicate_threshold is not None:
+            available &= similarity[pick] < duplicate_threshold
+        if token_budget is not None:
+            remaining -= int(tokens[pick])
+            available &= tokens <= remaining
+    return picks
+
+def _lexical_index(collection):
+    """Return the process-wide BM25 index for a collection, building it from the collection once."""
+    with _lexical_lock:
+        index = _lexical_indexes.get(collection.name)
+        if index is None:
+            index = _lexical_indexes[collection.name] = BM25Index()
+            # A collection created earlier in the process (or by an older build) is indexed on first use
+            existing = collection.get(include=["documents", "metadatas"])
+            if existing['ids']:
+                index.add(existing['ids'], existing['documents'], existing['metadatas'])
+        return index
 
 class VectorStore:
-    def __init__(self):
-        # Initialize ChromaDB with local persistence
-        self.client = chromadb.Client(Settings(
-            persist_directory="chroma_db",
-            anonymized_telemetry=False
-        ))
+    def __init__(self, namespace: str = None):
+        self.client = _get_client()
+        
+        # Every client in the process shares the same backing system, so each
+        # session or case gets its own collection (alphanumeric namespace, max 40 chars)
+        self.collection_name = f"{COLLECTION_NAME}_{namespace}" if namespace else COLLECTION_NAME
         
         # Create or get the collection
         self.collection = self.client.get_or_create_collection(
-            name="psychology_documents",
+            name=self.collection_name,
             metadata={"hnsw:space": "cosine"}
         )
+        # BM25 index over the same chunks, for exact tokens such as "HDS", "MMPI-2" or "F41.1"
+        self.lexical = _lexical_index(self.collection)
     
-    def store_documents(self, documents: List[str]):
-        """Store documents in the vector database."""
-        # Get all current IDs
-        existing = self.collection.get()
-        if existing and 'ids' in existing and existing['ids']:
-            self.collection.delete(ids=existing['ids'])
-        # Add new documents
-        ids = [str(i) for i in range(len(documents))]
+    def store_documents(self, documents: List[str], metadatas: List[dict] = None):
+        """Replace the stored documents, with optional per-chunk metadata (role, type, file, page)."""
+        with metrics.span("vector_store.store") as span:
+            span.record(documents=len(documents), chars=sum(len(d) for d in documents))
+            # Get all current IDs
+            existing = self.collection.get(include=[])
+            if existing and 'ids' in existing and existing['ids']:
+                self.collection.delete(ids=existing['ids'])
+            self.lexical.clear()
+            if not documents:
+                # Reference material is no longer stored here, so a Submit without uploads has nothing to add
+                return
+            self._add(documents, metadatas, start=0)
+
+    def add_documents(self, documents: List[str], metadatas: List[dict] = None):
+        """Add documents to those already stored, updating both indexes incrementally."""
+        with metrics.span("vector_store.add") as span:
+            span.record(documents=len(documents), chars=sum(len(d) for d in documents))
+            if documents:
+                # Ids only grow, so chunks added after a deletion never reuse a live id
+                self._add(documents, metadatas, start=max(map(int, self.lexical.documents), default=-1) + 1)
+
+    def delete_documents(self, **filters) -> int:
+        """Delete the chunks matching metadata filters (e.g. doc=<hash>) from both indexes; returns how many."""
+        where = _where(filters)
+        if where is None:
+            raise ValueError("delete_documents needs at least one filter; use store_documents([]) to clear a store")
+        with metrics.span("vector_store.delete") as span:
+            ids = self.collection.get(where=where, include=[])['ids']
+            if ids:
+                self.collection.delete(ids=ids)
+                self.lexical.remove(ids)
+            span.record(documents=len(ids))
+        return len(ids)
+
+    def _add(self, documents, metadatas, start):
+        ids = [str(i) for i in range(start, start + len(documents))]
         self.collection.add(
             documents=documents,
+            metadatas=metadatas,
             ids=ids
         )
+        self.lexical.add(ids, documents, metadatas)
     
-    def get_relevant_chunks(self, query: str = None, n_results: int = 5) -> List[str]:
-        """Retrieve relevant document chunks based on a query."""
-        if query is None:
-            # If no query provided, return all documents
-            results = self.collection.get()
-            return results['documents']
-        
-        # Search for relevant chunks
+    def get_relevant_chunks(self, query: str = None, n_results: int = 5, mode: str = "vector",
+                            mmr_lambda: float = None, duplicate_threshold: float = None, token_budget: int = None,
+                            **filters) -> List[str]:
+        """Retrieve relevant document chunks based on a query, restricted by metadata filters.
+
+        mode is "vector" (embedding similarity), "lexical" (BM25 only, no embedding is
+        computed) or "hybrid" (both, fused by reciprocal rank). Filters match chunk
+        metadata exactly (e.g. role="subject", type="Hogan Assessment"); a list matches
+        any of its values.
+
+        mmr_lambda re-ranks a deeper candidate set by maximal marginal relevance (1.0 is
+        pure relevance, lower values favour chunks unlike those already chosen), and
+        duplicate_threshold drops chunks whose embedding cosine similarity to a chosen
+        chunk reaches it. Without a query, duplicate_threshold prunes the full list.
+
+        token_budget fills a prompt token budget instead of a chunk count: diversified
+        chunks are taken until their tokens reach it, with n_results (None for no limit)
+        only capping how many. A query with n_results=None takes BUDGET_CANDIDATES candidates from each index it searches.
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"mode must be one of {', '.join(RETRIEVAL_MODES)}")
+        where = _where(filters)
+        diversify = mmr_lambda is not None or duplicate_threshold is not None or token_budget is not None
+        with metrics.span("vector_store.query", mode="all" if query is None else mode,
+                          filtered="yes" if where else "no") as span:
+            if query is None:
+                # If no query provided, return all (matching) documents
+                if duplicate_threshold is None and token_budget is None:
+                    results = self.collection.get(where=where, include=["documents"])
+                    span.record(results=len(results['documents']))
+                    return results['documents']
+                ids = self.collection.get(where=where, include=[])['ids']
+                ids.sort(key=int)
+                ranked = [(chunk_id, 1.0) for chunk_id in ids]
+                ids = self._diversify(ranked, len(ranked), 1.0, duplicate_threshold, token_budget)
+                span.record(results=len(ids), candidates=len(ranked))
+                return [self.lexical.documents[chunk_id] for chunk_id in ids]
+
+            # Diversification and rank fusion need deeper candidate lists than the final cut
+            if n_results is None:
+                depth = BUDGET_CANDIDATES
+            elif token_budget is not None:
+                depth = max(BUDGET_CANDIDATES, n_results * CANDIDATE_DEPTH)
+            else:
+                depth = n_results * CANDIDATE_DEPTH if diversify or mode == "hybrid" else n_results
+            if mode == "lexical":
+                ranked = self.lexical.search(query, depth, **filters)
+            elif mode == "vector":
+                ranked = self._vector_search(query, depth, where)
+            else:
+                ranked = reciprocal_rank_fusion([
+                    [chunk_id for chunk_id, _ in self._vector_search(query, depth, where)],
+                    [chunk_id for chunk_id, _ in self.lexical.search(query, depth, **filters)],
+                ])
+            if diversify:
+                ids = self._diversify(ranked, n_results, 1.0 if mmr_lambda is None else mmr_lambda,
+                                      duplicate_threshold, token_budget)
+            else:
+                ids = [chunk_id for chunk_id, _ in ranked[:n_results]]
+            span.record(results=len(ids), candidates=len(ranked))
+            return [self.lexical.documents[chunk_id] for chunk_id in ids]
+
+    def _vector_search(self, query, n_results, where):
+        """Nearest chunks as (chunk id, cosine similarity), best first."""
+        available = self.collection.count()
+        if not available:
+            return []
         results = self.collection.query(
             query_texts=[query],
-            n_results=n_results
+            n_results=min(n_results, available),
+            where=where,
+            include=["distances"]
         )
-        return results['documents'][0]
+        return [(chunk_id, 1.0 - distance) for chunk_id, distance in zip(results['ids'][0], results['distances'][0])]
+
+    def _diversify(self, ranked, n_results, mmr_lambda, duplicate_threshold, token_budget=None):
+        """Pick ids from ranked (id, score) candidates by MMR, skipping near-duplicates, up to n_results and token_budget."""
+        if not ranked:
+            return []
+        ids = [chunk_id for chunk_id, _ in ranked]
+        stored = self.collection.get(ids=ids, include=["embeddings"])
+        by_id = dict(zip(stored['ids'], stored['embeddings']))
+        embeddings = np.array([by_id[chunk_id] for chunk_id in ids], dtype=np.float32)
+        relevance = np.array([score for _, score in ranked], dtype=np.float32)
+        tokens = None
+        if token_budget is not None:
+            tokens = [chunk_tokens(self.lexical.documents[chunk_id]) for chunk_id in ids]
+        picks = mmr_select(relevance, embeddings, n_results, mmr_lambda, duplicate_threshold, tokens, token_budget)
+        metrics.registry.inc("vector_store_pruned_total", len(ids) - len(picks))
+        return [ids[i] for i in picks]
     
+    @staticmethod
+    def drop_namespace(namespace: str):
+        """Delete a namespace's collection and lexical index, if they exist."""
+        name = f"{COLLECTION_NAME}_{namespace}"
+        try:
+            _get_client().delete_collection(name)
+        except ValueError:
+            pass  # Never created, or already dropped
+        with _lexical_lock:
+            _lexical_indexes.pop(name, None)
+
+    def drop(self):
+        """Delete this store's collection entirely, releasing its memory."""
+        self.client.delete_collection(self.collection_name)
+        with _lexical_lock:
+            _lexical_indexes.pop(self.collection_name, None)
+
     def clear(self):
         """Clear all documents from the vector store."""
-        self.collection.delete(where={"id": {"$ne": None}}) 
\ No newline at end of file
+        self.collection.delete(where={"id": {"$ne": None}})
+        self.lexical.clear() 
\ No newline at end of file